@@ -0,0 +1,47 @@
+"""
+Process-level cache for files that are read for many documents.
+"""
+import os
+
+from docutils import io
+
+
+class AssetCache(object):
+    """
+    Process-level cache for files embedded in or applied to every output
+    document (scripts, stylesheets, the template). Entries are keyed on the
+    path and the format string applied to the content, and are reread only
+    when the mtime or size of the file changes.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        "(path, format) -> ((mtime, size), string) "
+
+    def read(self, path, format=None, encoding='utf-8'):
+        """
+        Return the decoded content of file `path`, interpolated into
+        `format` if given. Raises IOError if the file cannot be read.
+        """
+        try:
+            stat = os.stat(path)
+            stamp = stat.st_mtime, stat.st_size
+        except OSError:
+            stamp = None
+        key = os.path.abspath(path), format
+        if stamp and key in self.entries:
+            entry_stamp, content = self.entries[key]
+            if entry_stamp == stamp:
+                return content
+        content = io.FileInput(source_path=path, encoding=encoding).read()
+        if format:
+            content = format % content
+        if stamp:
+            self.entries[key] = stamp, content
+        return content
+
+    def clear(self):
+        self.entries.clear()
+
+assets = AssetCache()
+"The asset cache shared by all components in this process. "
@@ -23,7 +23,10 @@ import sqlite3
 #import nabu.server
 import dotmpe
 from dotmpe.du.mpe_du_util import get_session, SqlBase
-from dotmpe.du import comp, util
+from dotmpe.du import comp, frozen, util
+import dotmpe.du.ext.parser
+from dotmpe.du.ext.parser.rst.directive import CacheSettings
+from dotmpe.du.ext.transform import outline
 
 
 logger = util.get_log(__name__, fout_level=logging.INFO)
@@ -59,13 +62,23 @@ class Builder(SettingsSpec, Publisher):
     Parser = comp.get_parser_class('restructuredtext')
     """
     Both Du Reader and Parser Component classes are set/described here and can
-    be overridden in builder subclasses.
+    be overridden in builder subclasses. Builders that need the source ranges
+    of elements (see `dotmpe.du.ext.transform.ranges`) use the 'rst-mpe'
+    parser.
 
     The writer is accessed directly by name for now.
     """
     default_writer = 'html-mpe'
 
     settings_spec = (
+        'Builder',
+        None,
+        (
+            ('Cache the text and ids of nodes once the document is built, '
+             'for extractors and writers (see dotmpe.du.frozen).',
+             ['--freeze-document'],
+             {'action': 'store_true', 'default': False}),
+        )
     )
     """
     Additional frontend settings-spec used *besides* those on Reader, Parser and
@@ -110,7 +123,7 @@ class Builder(SettingsSpec, Publisher):
         # XXX render initializes again, but we want to see the help too...
         self.writer = comp.get_writer_class(self.default_writer)()
         # FIXME: having initial writer component enables publisher src2trgt frontends
-        self.components = (self.parser, self.reader, self.writer, self)
+        self.set_settings_components()
 
         # XXX: for now, all transforms are linked to the reader and the reader
         # gets its transforms from there.
@@ -119,6 +132,15 @@ class Builder(SettingsSpec, Publisher):
         # able to concatenate several groups
 
 
+    def set_settings_components(self):
+        """
+        Set the components whose settings specs make up the option parser.
+        Adds the directive cache settings if the writer does not have them.
+        """
+        self.components = (self.parser, self.reader, self.writer, self)
+        if not CacheSettings.included(self.writer):
+            self.components += (CacheSettings(),)
+
     # XXX docutils.core.Publisher override (no changes, just for ref.)
     def setup_option_parser(self, usage=None, description=None,
                             settings_spec=None, config_section=None,
@@ -162,7 +184,7 @@ class Builder(SettingsSpec, Publisher):
         source_class, parser, reader, settings = self.prepare_source(source, source_id)
         if not self.writer:
             self.writer = comp.get_writer_class('null')()
-        self.components = (self.parser, self.reader, self.writer, self)
+        self.set_settings_components()
         if not self.settings:
             if cli:
                 self.process_command_line()
@@ -211,6 +233,8 @@ class Builder(SettingsSpec, Publisher):
         self.document.transformer.populate_from_components(
             (source, self.reader, self.parser, self.writer, self.destination))
         self.document.transformer.apply_transforms()
+        if getattr(self.settings, 'freeze_document', False):
+            frozen.freeze(self.document)
         return self.document
 
     def build_doc(self):
@@ -280,6 +304,17 @@ class Builder(SettingsSpec, Publisher):
 
             self.extractors[idx] = (xcls, xstore)
 
+    def close_extractors(self):
+        """
+        Close the storages after the last document, so they can write out
+        buffered data.
+        """
+        for xcls, xstore in self.extractors:
+            if hasattr(xstore, 'close') and not isinstance(xstore,
+                    (type, types.ClassType)):
+                xstore.close()
+        outline.close_digest_storages()
+
     def process(self, document, source_id='<process>', overrides={},
             pickle_receiver=None):
         """
@@ -318,8 +353,14 @@ class Builder(SettingsSpec, Publisher):
             # XXX: parser allows update of list attrs
             document.settings.update(overrides)#, prsr)
         document.reporter = utils.new_reporter('', document.settings)
-        # Run extractor transforms on the document tree.
-        document.transformer.apply_transforms()
+        # Run extractor transforms on the document tree. Keep the outline
+        # digests only if they succeed, see transform.outline.
+        try:
+            document.transformer.apply_transforms()
+        except:
+            outline.finish_outline_diff(document, False)
+            raise
+        outline.finish_outline_diff(document)
         # clean doc
         #if document.transform_messages:
         #    print('XXX: document transformed, messages:',
@@ -0,0 +1,53 @@
+"""
+Form builder: validate the form fields of documents, and with
+``--form-process=submit`` store the values to an SQLite database.
+
+The form fields are given by the ``form_fields_spec`` setting (see
+`dotmpe.du.form`). Submissions are written in batches by
+`dotmpe.du.ext.extractor.form2.SQLiteFormStorage`, the last batch when the
+builder closes its extractors.
+"""
+import sqlite3
+
+from dotmpe.du import builder, util
+from dotmpe.du.ext.reader import form
+
+
+def _get_form_store(options):
+    dbf = options['form_db']
+    try:
+        return sqlite3.connect(dbf)
+    except sqlite3.OperationalError:
+        raise util.DatabaseConnectionError("Cannot connect to %s" % dbf)
+
+def _get_form_specs(options):
+    return options.get('form_fields_spec', [])
+
+
+class Builder(builder.Builder):
+
+    Reader = form.Reader
+
+    settings_default_overrides = {
+        'form_db': 'form.db',
+    }
+
+    settings_spec = (
+            'Form Builder',
+            None,
+            ((
+                 'SQLite database to store submitted form values. ',
+                 ['--form-db'],
+                 { 'metavar': 'PATH', 'default': 'form.db' }
+            ),)
+        )
+
+    extractor_spec = [
+            ('dotmpe.du.ext.extractor.form2', ),
+        ]
+
+    store_params = {
+            'dotmpe.du.ext.extractor.form2.SQLiteFormStorage': (
+                (), {'module': None, 'connection': _get_form_store,
+                    'specs': _get_form_specs}),
+        }
@@ -3,13 +3,16 @@
 
 import os.path
 
-from dotmpe.du import builder, util
+from dotmpe.du import builder, comp, util
 from dotmpe.du.ext.reader import standalone
 from dotmpe.du.ext.extractor import htdocs, reference, docinfo
 
 
 class Builder(builder.Builder):
 
+    Parser = comp.get_parser_class('rst-mpe')
+    "Record source ranges, for the term offsets of the htdocs extractor. "
+
     HTSTORE = 'sqlite:///%s' % os.path.expanduser('~/.cllct/htdocs.sqlite')
 
     settings_default_overrides = {
@@ -0,0 +1,295 @@
+"""
+Convert a directory tree of documents with a pool of worker processes.
+
+Each worker sets up one reader, parser and writer and reuses them for all
+documents it is given. The output tree mirrors the source tree, with the
+writer's file extension. A manifest with the digest of each source file (and
+of the settings) is kept in the output directory, so that a rerun only
+converts new or changed documents.
+
+With ``--builder-field`` the builder for each document is read from a field at
+the start of the source (see `dotmpe.du.util.sniff_fields`), without parsing
+it. Each builder gets its own pool, with the reader and parser of the builder.
+
+Used for the directory mode of the ``<source>2<target>`` tools, e.g.::
+
+    atlassian2rst --jobs 4 confluence-export/ rst/
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from docutils import SettingsSpec, core, frontend
+
+from dotmpe.du import comp, util
+from dotmpe.du.ext.transform.digest import settings_digest
+
+
+manifest_name = '.convert-digests'
+"Name of the manifest with source digests in the output directory. "
+
+extensions = {
+    'rst': '.rst',
+    'xml': '.xml',
+    'html': '.html',
+    'pprint': '.pxml',
+    'pseudoxml': '.pxml',
+    'latex': '.tex',
+    'atlassian': '.txt',
+}
+"Output file extension per target format. "
+
+
+class TreeConverter(SettingsSpec):
+
+    settings_spec = (
+        'Directory mode options',
+        'Used if the source is a directory.',
+        (
+            ('Number of worker processes (default: number of CPUs).',
+             ['--jobs'],
+             {'type': 'int', 'default': 0, 'metavar': '<n>'}),
+            ('Convert files with this suffix only (default: all).',
+             ['--source-suffix'],
+             {'default': '', 'metavar': '<suffix>'}),
+            ('Convert all documents, also those that did not change.',
+             ['--force'],
+             {'action': 'store_true', 'default': False}),
+            ('Select the builder of each document by this leading field, '
+             'e.g. "build". Documents without it use the default components.',
+             ['--builder-field'],
+             {'default': '', 'metavar': '<field>'}),
+        )
+    )
+
+    settings_default_overrides = { 'output_encoding': 'utf-8' }
+
+
+def source_files(source_dir, suffix=''):
+    "Yield the paths relative to `source_dir` of the files to convert. "
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if name.startswith('.') or not name.endswith(suffix):
+                continue
+            yield os.path.relpath(os.path.join(root, name), source_dir)
+
+def target_path(relpath, target_format):
+    return os.path.splitext(relpath)[0] + extensions.get(target_format,
+            '.' + target_format)
+
+def load_manifest(dest_dir):
+    path = os.path.join(dest_dir, manifest_name)
+    if os.path.exists(path):
+        return json.load(open(path))
+    return {}
+
+def save_manifest(dest_dir, manifest):
+    path = os.path.join(dest_dir, manifest_name)
+    json.dump(manifest, open(path + '.tmp', 'w'), indent=0, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+# Worker state, one set of components per process
+_worker = {}
+
+def init_worker(reader_name, parser_name, writer_name, settings,
+        builder_name=None):
+    if builder_name:
+        Builder = comp.get_builder_class(builder_name)
+        parser = Builder.Parser()
+        reader = Builder.Reader(parser)
+    else:
+        parser = comp.get_parser_class(parser_name)()
+        reader = comp.get_reader_class(reader_name)(parser)
+    _worker.update(
+        parser=parser,
+        reader=reader,
+        writer=comp.get_writer_class(writer_name)(),
+        settings=settings)
+
+def convert(task):
+    """
+    Convert one document, return (relpath, digest, input size, output size,
+    error message or None).
+    """
+    relpath, source_path, dest_path, digest = task
+    try:
+        source = open(source_path).read()
+        output = core.publish_string(source, source_path=source_path,
+                destination_path=dest_path, reader=_worker['reader'],
+                parser=_worker['parser'], writer=_worker['writer'],
+                settings=_worker['settings'])
+        dest_dir = os.path.dirname(dest_path)
+        if not os.path.isdir(dest_dir):
+            try:
+                os.makedirs(dest_dir)
+            except OSError:
+                if not os.path.isdir(dest_dir):
+                    raise
+        open(dest_path, 'w').write(output)
+    except (Exception, SystemExit), e:
+        return relpath, None, 0, 0, '%s: %s' % (e.__class__.__name__, e)
+    return relpath, digest, len(source), len(output), None
+
+
+def builder_module(name):
+    "Return the module path for a builder field value. "
+    if '.' not in name:
+        return 'dotmpe.du.builder.' + name
+    return name
+
+def builder_settings(builder_name, writer_name, settings, defaults=None):
+    """
+    Return the settings for the components of `builder_name`, with the
+    values in `settings` that differ from `defaults` (or all) applied.
+    """
+    Builder = comp.get_builder_class(builder_name)
+    parser = Builder.Parser()
+    option_parser = frontend.OptionParser(components=(parser,
+        Builder.Reader(parser), comp.get_writer_class(writer_name)(),
+        Builder, TreeConverter()))
+    values = option_parser.get_default_values()
+    values._update(dict( (name, value)
+        for name, value in vars(settings).items()
+        if defaults is None or getattr(defaults, name, None) != value ),
+        'loose')
+    return values
+
+def run_pool(tasks, initargs, jobs, manifest, out):
+    """
+    Convert `tasks` with a new pool, update `manifest` and return the
+    counts of converted and failed documents, and bytes in and out.
+    """
+    converted = failed = size_in = size_out = 0
+    pool = multiprocessing.Pool(jobs or None, init_worker, initargs)
+    try:
+        for relpath, digest, size, output_size, error in \
+                pool.imap_unordered(convert, tasks):
+            if error:
+                failed += 1
+                manifest.pop(relpath, None)
+                print >>out, "Failed %s: %s" % (relpath, error)
+                continue
+            converted += 1
+            size_in += size
+            size_out += output_size
+            manifest[relpath] = digest
+    finally:
+        pool.close()
+        pool.join()
+    return converted, failed, size_in, size_out
+
+def fail_group(tasks, error, manifest, out):
+    "Report `tasks` as failed, drop them from `manifest`, return the count. "
+    for task in tasks:
+        manifest.pop(task[0], None)
+        print >>out, "Failed %s: %s" % (task[0], error)
+    return len(tasks)
+
+
+
+def convert_tree(source_dir, dest_dir, reader_name, parser_name, writer_name,
+        target_format, settings, out=sys.stderr, defaults=None):
+    """
+    Convert all documents below `source_dir` to `dest_dir` with a worker
+    pool, skip those whose digest is in the manifest (unless settings.force).
+    With settings.builder_field, group the documents by builder first.
+    The documents of a builder that cannot be loaded fail, the other groups
+    are still converted.
+    `defaults` are the default settings, to tell which settings to apply
+    to the builder settings.
+    Returns the number of failed documents.
+    """
+    start = time.time()
+    manifest = load_manifest(dest_dir) if not settings.force else {}
+    salt = '\0'.join((reader_name, parser_name, writer_name,
+        settings_digest(settings, exclude=('_source', '_destination',
+            'jobs', 'force'))))
+    tasks, skipped = [], 0
+    for relpath in source_files(source_dir, settings.source_suffix):
+        source_path = os.path.join(source_dir, relpath)
+        dest_path = os.path.join(dest_dir, target_path(relpath, target_format))
+        sha1 = hashlib.sha1(salt)
+        sha1.update(open(source_path, 'rb').read())
+        digest = sha1.hexdigest()
+        if manifest.get(relpath) == digest and os.path.exists(dest_path):
+            skipped += 1
+            continue
+        tasks.append((relpath, source_path, dest_path, digest))
+
+    groups = {}
+    for task in tasks:
+        builder_name = None
+        if settings.builder_field:
+            builder_name = util.sniff_fields(task[1]).get(
+                    settings.builder_field.lower())
+        groups.setdefault(builder_name, []).append(task)
+
+    converted = failed = size_in = size_out = 0
+    if tasks:
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        try:
+            for builder_name, group in sorted(groups.items()):
+                if builder_name:
+                    builder_name = builder_module(builder_name)
+                    try:
+                        group_settings = builder_settings(builder_name,
+                                writer_name, settings, defaults)
+                    except Exception, e:
+                        failed += fail_group(group, 'No builder %s: %s: %s'
+                                % (builder_name, e.__class__.__name__, e),
+                                manifest, out)
+                        continue
+                else:
+                    group_settings = settings
+                counts = run_pool(group, (reader_name, parser_name,
+                    writer_name, group_settings, builder_name),
+                    settings.jobs, manifest, out)
+                converted += counts[0]
+                failed += counts[1]
+                size_in += counts[2]
+                size_out += counts[3]
+        finally:
+            save_manifest(dest_dir, manifest)
+
+    seconds = max(time.time() - start, 1e-6)
+    print >>out, ("%i converted, %i unchanged, %i failed in %.2fs "
+        "(%.1f docs/s, %.1f KB/s in, %.1f KB out)") % (converted, skipped,
+            failed, seconds, converted / seconds, size_in / 1024. / seconds,
+            size_out / 1024.)
+    return failed
+
+
+def cli_convert_tree(argv, reader_name, parser_name, writer_name,
+        target_format, description='', out=sys.stderr):
+    """
+    Parse the command line like publish_cmdline, and convert the tree at
+    the source argument to the destination directory.
+    """
+    parser = comp.get_parser_class(parser_name)()
+    reader = comp.get_reader_class(reader_name)(parser)
+    writer = comp.get_writer_class(writer_name)()
+    option_parser = frontend.OptionParser(
+            components=(reader, parser, writer, TreeConverter()),
+            usage='%prog [options] <source-dir> <dest-dir>',
+            description=description)
+    defaults = option_parser.get_default_values()
+    settings = option_parser.parse_args(argv)
+    if not settings._source or not settings._destination:
+        option_parser.error('Directory mode needs a source and a destination'
+                ' directory.')
+    return convert_tree(settings._source, settings._destination,
+            reader_name, parser_name, writer_name, target_format, settings,
+            out=out, defaults=defaults)
+
+def is_tree_argv(argv):
+    "True if the first argument that is an existing path is a directory. "
+    for arg in argv:
+        if not arg.startswith('-') and os.path.exists(arg):
+            return os.path.isdir(arg)
+    return False
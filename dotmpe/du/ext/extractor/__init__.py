@@ -123,6 +123,12 @@ class SQLiteExtractorStorage(extract.ExtractorStorage):
 
         self.connection.commit()
 
+    def close(self):
+        """
+        Called by the builder after the last document. Default implementation
+        does nothing.
+        """
+
     def clear(self, unid=None):
         """
         Default implementation that clears the entries/tables.
@@ -1,31 +1,194 @@
 from __future__ import print_function
-import sys, time, datetime, calendar
+import sys, time, datetime, calendar, json, multiprocessing, re
+from collections import OrderedDict
 
-from docutils import nodes
+from docutils import core, frontend, nodes
 import nabu.extract
 from nabu.extract import ExtractorStorage
 
-from dotmpe.du import util
+from dotmpe.du import comp, nodeindex, util
+from dotmpe.du.frozen import text_of
+from dotmpe.du.ext.extractor import SQLiteExtractorStorage
+from dotmpe.du.ext.transform import outline
 
 
+class DateParser(object):
+
+    """
+    Parse datetimes with a list of strptime formats. Formats are tried only
+    if the value has their shape, most recently matched first, and the
+    results for the last `size` values are kept.
+    """
+
+    directives = {
+        'Y': r'\d{4}', 'm': r'\d{1,2}', 'd': r'\d{1,2}', 'H': r'\d{1,2}',
+        'M': r'\d{1,2}', 'S': r'\d{1,2}', 'y': r'\d{2}', 'j': r'\d{1,3}',
+        'a': r'[^\W\d_]+', 'A': r'[^\W\d_]+', 'b': r'[^\W\d_]+',
+        'B': r'[^\W\d_]+', 'p': r'[^\W\d_]+', 'Z': r'[^\W\d_]*',
+        'f': r'\d{1,6}', '%': '%',
+    }
+
+    def __init__(self, formats, size=1024):
+        self.formats = list(formats)
+        self.shapes = dict( (fmt, self.shape(fmt)) for fmt in formats )
+        self.size = size
+        self.values = OrderedDict()
+
+    def shape(self, fmt):
+        """
+        Return a regex that matches values that `fmt` might parse. Like
+        strptime, it ignores case and matches any run of whitespace for
+        whitespace in the format.
+        """
+        parts = re.split(r'%(.)', fmt)
+        pattern = ''
+        for i, part in enumerate(parts):
+            if i % 2:
+                pattern += self.directives.get(part, '.+?')
+            else:
+                pattern += r'\s+'.join([ re.escape(literal)
+                    for literal in re.split(r'\s+', part) ])
+        return re.compile(pattern + '$', re.UNICODE | re.IGNORECASE)
+
+    def parse(self, value):
+        "Return the datetime for `value`, or None if no format matches. "
+        value = value.strip()
+        if value in self.values:
+            result = self.values.pop(value)
+        else:
+            result = None
+            for fmt in self.formats:
+                if not self.shapes[fmt].match(value):
+                    continue
+                try:
+                    result = datetime.datetime.strptime(value, fmt)
+                except ValueError:
+                    continue
+                if fmt is not self.formats[0]:
+                    self.formats.remove(fmt)
+                    self.formats.insert(0, fmt)
+                break
+            if len(self.values) >= self.size:
+                self.values.popitem(last=False)
+        self.values[value] = result
+        return result
+
+date_parsers = {}
+"Tuple of formats -> DateParser "
+
 def parse_datetime(value, formats=util.datetime_formats):
-    for fmt in formats:
-        e = None
-        try:
-            return datetime.datetime.strptime( value, fmt )
-        except ValueError as e:
-            continue
-        raise e
+    """
+    Return the datetime for `value` in one of `formats`, or None.
+    """
+    key = tuple(formats)
+    if key not in date_parsers:
+        date_parsers[key] = DateParser(formats)
+    return date_parsers[key].parse(value)
+
+def docinfo_fields(document):
+    """
+    Return the docinfo of `document` as a list of (lower-cased field name,
+    value) pairs. Bibliographic elements are listed by their tagname. The
+    list is kept until the document changes (see `dotmpe.du.nodeindex`).
+    """
+    nodeindex.track(document)
+    generation, fields = getattr(document, 'docinfo_fields', (None, None))
+    if generation != nodeindex.generation(document):
+        fields = []
+        for e in document.children:
+            if isinstance( e, nodes.docinfo, ):
+                for c in e.children:
+                    if isinstance(c, nodes.field):
+                        fields.append((text_of(c.children[0]).lower(),
+                            text_of(c.children[1])))
+                    else:
+                        fields.append((c.tagname, text_of(c)))
+                break
+        document.docinfo_fields = nodeindex.generation(document), fields
+    return fields
+
+def find_docinfo_field(document, field):
+    """
+    Return the value of the first docinfo field whose name contains `field`,
+    or None.
+    """
+    for name, value in docinfo_fields(document):
+        if field in name:
+            return value
 
 def find_docinfo_datetime(document, field):
     """
     Retrieve datetime from docinfo field in document.
     """
-    for e in document.children:
-        if isinstance( e, nodes.docinfo, ):
-            for c in e.children:
-                if field in c.children[0].astext().lower():
-                    return parse_datetime(c.children[1].astext())
+    value = find_docinfo_field(document, field)
+    if value:
+        return parse_datetime(value)
+
+
+def format_datetime(value):
+    if value:
+        return value.strftime(util.ISO_8601_DATETIME)
+
+def document_record(document):
+    "Return the index record for `document`. "
+    return OrderedDict([
+        ('source', document.get('source')),
+        ('title', document.get('title')),
+        ('ids', document['ids']),
+        ('created', format_datetime(find_docinfo_datetime(document, 'created'))),
+        ('updated', format_datetime(find_docinfo_datetime(document, 'updated'))),
+    ])
+
+def format_record(record, format='tsv'):
+    "Return `record` as a line of TSV or JSON. "
+    if format == 'jsonl':
+        return json.dumps(record)
+    return u'\t'.join(
+        u','.join(value) if isinstance(value, list) else (value or u'')
+        for value in record.values() ).encode('utf-8')
+
+
+# Worker state, one reader and parser per process
+_worker = {}
+
+def init_index_worker(reader_name, parser_name):
+    parser = comp.get_parser_class(parser_name)()
+    reader = comp.get_reader_class(reader_name)(parser)
+    settings = frontend.OptionParser(components=(parser, reader)
+            ).get_default_values()
+    settings.report_level = settings.halt_level = 5
+    settings._disable_config = True
+    _worker.update(parser=parser, reader=reader, settings=settings)
+
+def index_document(path):
+    """
+    Parse the file at `path` and return its record, or a record with only
+    the source and an error message.
+    """
+    try:
+        document = core.publish_doctree(open(path).read(), source_path=path,
+                reader=_worker['reader'], parser=_worker['parser'],
+                settings=_worker['settings'])
+    except (Exception, SystemExit), e:
+        return OrderedDict([ ('source', path),
+            ('error', '%s: %s' % (e.__class__.__name__, e)) ])
+    return document_record(document)
+
+def index_documents(paths, jobs=0, reader_name='standalone',
+        parser_name='rst'):
+    """
+    Yield the index records for the documents at `paths`, in order,
+    parsed by a pool of `jobs` (default: number of CPUs) workers.
+    """
+    pool = multiprocessing.Pool(jobs or None, init_index_worker,
+            (reader_name, parser_name))
+    try:
+        for record in pool.imap(index_document, paths, 8):
+            yield record
+    finally:
+        pool.close()
+        pool.join()
+
 
 class Extractor(nabu.extract.Extractor):
 
@@ -63,6 +226,9 @@ class Extractor(nabu.extract.Extractor):
     default_priority = 900
 
     def apply(self, unid=None, storage=None, **kwargs):
+        if isinstance(storage, DocinfoStorage):
+            self.store_docinfo(unid or self.document.get('source'), storage)
+            return
         a = (self.document['source'],)
         if self.document.settings.print_docid:
             ids = self.document['ids']
@@ -70,12 +236,10 @@ class Extractor(nabu.extract.Extractor):
             else: a += ( "(none)", )
         if self.document.settings.print_created:
             created = find_docinfo_datetime(self.document, 'created')
-            if created: a += ( created.strftime(util.ISO_8601_DATETIME), )
-            else: a += ( "(none)", )
+            a += ( format_datetime(created) or "(none)", )
         if self.document.settings.print_updated:
             updated = find_docinfo_datetime(self.document, 'updated')
-            if updated: a += ( updated.strftime(util.ISO_8601_DATETIME), )
-            else: a += ( "(none)", )
+            a += ( format_datetime(updated) or "(none)", )
 
         if self.document.settings.print_doctitle:
             if 'title' in self.document: a += ( self.document['title'], )
@@ -86,6 +250,93 @@ class Extractor(nabu.extract.Extractor):
         print(" ".join(a))
 
 
+    def store_docinfo(self, unid, storage):
+        """
+        Write the docinfo rows of the document to `storage`. With an outline
+        diff (see `dotmpe.du.ext.transform.outline`) only the rows of added
+        and changed fields are written and those of removed fields deleted.
+        Bibliographic elements are not outline nodes, their rows are
+        replaced whenever the document changed.
+        """
+        diff = getattr(self.document, 'outline_diff', None)
+        if diff is not None and not diff:
+            return # unchanged since the last run
+        rows = docinfo_rows(self.document)
+        if diff is None:
+            storage.clear(unid)
+            storage.store(unid, rows)
+        else:
+            paths = set(diff.added + diff.changed)
+            storage.store(unid, [ row for row in rows
+                if row[0].startswith('#') or row[0] in paths ],
+                diff.removed)
+
+
+def docinfo_rows(document):
+    """
+    Return the (path, name, value) rows for the docinfo of `document`. The
+    path of a field is its outline path, if the outline was recorded, or its
+    name. That of a bibliographic element is its tagname prefixed by '#', and
+    numbered if it repeats.
+    """
+    rows, count = [], {}
+    for e in document.children:
+        if isinstance( e, nodes.docinfo, ):
+            for c in e.children:
+                if isinstance(c, nodes.field):
+                    name = text_of(c.children[0]).lower()
+                    rows.append((outline.outline_path(c, document.settings)
+                        or name, name, text_of(c.children[1])))
+                else:
+                    path = '#' + c.tagname
+                    if c.tagname in count:
+                        path += '[%i]' % count[c.tagname]
+                    count[c.tagname] = count.get(c.tagname, 0) + 1
+                    rows.append((path, c.tagname, text_of(c)))
+            break
+    return rows
+
+
 class Storage(ExtractorStorage):
     def __init__(self):
         pass
+
+
+class DocinfoStorage(SQLiteExtractorStorage):
+
+    """
+    Docinfo fields per document, see `docinfo_rows`.
+    """
+
+    sql_relations_unid = [
+        ('docinfo', 'TABLE', """
+            CREATE TABLE docinfo (
+                unid VARCHAR NOT NULL,
+                path VARCHAR NOT NULL,
+                name VARCHAR NOT NULL,
+                value VARCHAR,
+                PRIMARY KEY (unid, path)
+            )
+        """),
+    ]
+
+    def store(self, unid, rows, removed=()):
+        """
+        Write `rows` and delete the rows at the `removed` paths. The rows of
+        bibliographic elements are replaced by those in `rows`.
+        """
+        cursor = self.connection.cursor()
+        cursor.executemany("DELETE FROM docinfo WHERE unid = ? AND path = ?",
+                [ (unid, path) for path in removed ])
+        cursor.execute("DELETE FROM docinfo WHERE unid = ? AND path LIKE '#%'",
+                (unid,))
+        cursor.executemany("INSERT OR REPLACE INTO docinfo "
+                "(unid, path, name, value) VALUES (?, ?, ?, ?)",
+                [ (unid,) + tuple(row) for row in rows ])
+        self.connection.commit()
+
+    def fields(self, unid):
+        "Return the stored (path, name, value) rows for `unid`. "
+        cursor = self.connection.execute("SELECT path, name, value "
+                "FROM docinfo WHERE unid = ? ORDER BY path", (unid,))
+        return cursor.fetchall()
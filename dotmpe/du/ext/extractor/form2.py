@@ -1,6 +1,12 @@
 """
 Extractors and util to retrieve and validate user-data from a document.
+
+FormStorage keeps submitted values in memory, SQLiteFormStorage persists them
+to a table derived from the fields spec. The latter buffers submissions and
+writes them in batches, so ``--form-process=submit`` can be used to ingest
+large numbers of documents.
 """
+import json
 import logging
 from nabu import extract
 from dotmpe.du import form, util
@@ -35,6 +41,9 @@ class FormExtractor(extract.Extractor):
             return # not an extract task
         if form_process == 'validate':
             return # validation should be done
+        if form_process == 'submit':
+            # DuForm leaves the validation of submitted forms to here
+            pfrm.validate()
         valid = getattr(settings, 'validated', False)
         if not valid:
             self.document.reporter.system_message(
@@ -99,7 +108,7 @@ class FormStorage(extractor.TransientStorage):
     """
 
     def __init__(self, init={}, specs=()):
-        super(self, FormStorage).__init__(init=init,
+        super(FormStorage, self).__init__(init=init,
             datakey='form_settings', specs=specs)
 
     def store(self, source_id, settings):
@@ -112,3 +121,178 @@ class FormStorage(extractor.TransientStorage):
         raise NotImplemented
 
 
+
+
+SQL_COLUMN_TYPES = {
+    util.du_int: 'INTEGER',
+    util.du_long: 'INTEGER',
+    util.du_bool: 'INTEGER',
+    util.du_yesno: 'INTEGER',
+    util.du_float: 'REAL',
+}
+"Column affinity per convertor, anything else is stored as TEXT. "
+
+
+class SQLiteFormStorage(extractor.SQLiteExtractorStorage):
+
+    """
+    Persist form values to a DBAPI-2.0 (sqlite3) connection.
+
+    The schema is derived from the fields spec: one column per scalar field
+    on the form table, and a child table ``<table>_<column>`` with one row per
+    item for each 'append' field. Non-scalar values of other fields are
+    stored JSON encoded.
+
+    Submissions are buffered and written per `batch_size` documents with an
+    ``INSERT .. ON CONFLICT (unid) DO UPDATE`` upsert, so resubmitting a
+    document replaces its row. The builder calls `close` after the last
+    document, which writes out any pending values (as do `flush`,
+    `export_columns`).
+    """
+
+    def __init__(self, module, connection, specs=(),
+            table='form', batch_size=500):
+        self.table = table
+        self.batch_size = batch_size
+        self.pending = {} # unid: values
+        self.columns = [] # (field_id, column, sqltype)
+        self.list_columns = [] # (field_id, column, child-table)
+        self.__init_schema(specs)
+        extractor.SQLiteExtractorStorage.__init__(self, module, connection)
+
+    def __init_schema(self, specs):
+        for spec in specs:
+            if not isinstance(spec, form.FormField):
+                field_id, conv = spec[0:2]
+                if len(spec)==3: attrs = spec[2]
+                else: attrs = {}
+                args, kwds = form.form_field_spec(field_id, conv, **attrs)
+                spec = form.FormField(*args, **kwds)
+            column = spec.field_id.replace('-', '_')
+            if spec.append:
+                self.list_columns.append((spec.field_id, column,
+                    '%s_%s' % (self.table, column)))
+            else:
+                self.columns.append((spec.field_id, column,
+                    SQL_COLUMN_TYPES.get(spec.convertor, 'TEXT')))
+        coldefs = ''.join([ ',\n               %s %s' % (column, sqltype)
+            for field_id, column, sqltype in self.columns ])
+        self.sql_relations_unid = [
+            (self.table, 'TABLE', """
+            CREATE TABLE %s
+            (
+               unid VARCHAR PRIMARY KEY%s
+            )
+            """ % (self.table, coldefs)) ]
+        for field_id, column, child in self.list_columns:
+            self.sql_relations_unid.append((child, 'TABLE', """
+            CREATE TABLE %s
+            (
+               unid VARCHAR NOT NULL,
+               idx INTEGER NOT NULL,
+               value TEXT,
+               PRIMARY KEY (unid, idx)
+            )
+            """ % child))
+        self.sql_relations = []
+
+    def store(self, source_id, settings):
+        self.pending[source_id] = settings
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all pending submissions in one transaction.
+        """
+        if not self.pending:
+            return
+        cursor = self.connection.cursor()
+        names = [ column for field_id, column, sqltype in self.columns ]
+        query = "INSERT INTO %s (unid%s) VALUES (?%s)" % (self.table,
+                ''.join([ ', '+n for n in names ]), ', ?' * len(names))
+        if names:
+            query += " ON CONFLICT (unid) DO UPDATE SET %s" % ', '.join([
+                "%s = excluded.%s" % (n, n) for n in names ])
+        else:
+            query += " ON CONFLICT (unid) DO NOTHING"
+        rows = []
+        for unid, values in self.pending.iteritems():
+            rows.append([unid] + [ sql_value(values.get(field_id))
+                for field_id, column, sqltype in self.columns ])
+        cursor.executemany(query, rows)
+        unids = [ (unid,) for unid in self.pending ]
+        for field_id, column, child in self.list_columns:
+            cursor.executemany("DELETE FROM %s WHERE unid = ?" % child, unids)
+            items = []
+            for unid, values in self.pending.iteritems():
+                value = values.get(field_id) or []
+                if not isinstance(value, list):
+                    value = [value]
+                items.extend([ (unid, idx, sql_value(item))
+                    for idx, item in enumerate(value) ])
+            cursor.executemany("INSERT INTO %s (unid, idx, value) "
+                    "VALUES (?, ?, ?)" % child, items)
+        self.connection.commit()
+        logger.info("Stored %i forms to %s", len(rows), self.table)
+        self.pending = {}
+
+    def close(self):
+        self.flush()
+
+    def clear(self, unid=None):
+        if unid is None:
+            self.pending = {}
+        elif unid in self.pending:
+            del self.pending[unid]
+        extractor.SQLiteExtractorStorage.clear(self, unid)
+
+    def reset_schema(self):
+        self.pending = {}
+        extractor.SQLiteExtractorStorage.reset_schema(self)
+
+    def export_columns(self, *field_ids):
+        """
+        Return a dict with a list of values per field-id, plus one for 'unid'.
+        Rows are ordered by unid. 'append' fields are returned as a list of
+        item lists, aligned with the unid column.
+        """
+        self.flush()
+        field_ids = field_ids or [ f[0] for f in self.columns+self.list_columns ]
+        scalars = [ (field_id, column)
+            for field_id, column, sqltype in self.columns
+            if field_id in field_ids ]
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT unid%s FROM %s ORDER BY unid" % (
+            ''.join([ ', '+column for field_id, column in scalars ]),
+            self.table))
+        rows = cursor.fetchall()
+        if rows:
+            data = zip(*rows)
+        else:
+            data = [()] * (len(scalars) + 1)
+        columns = { 'unid': list(data[0]) }
+        for i, (field_id, column) in enumerate(scalars):
+            columns[field_id] = list(data[i+1])
+        for field_id, column, child in self.list_columns:
+            if field_id not in field_ids:
+                continue
+            items = dict([ (unid, []) for unid in columns['unid'] ])
+            cursor.execute("SELECT unid, value FROM %s ORDER BY unid, idx"
+                    % child)
+            for unid, value in cursor:
+                if unid in items:
+                    items[unid].append(value)
+            columns[field_id] = [ items[unid] for unid in columns['unid'] ]
+        return columns
+
+
+def sql_value(value):
+    " Return value as-is for SQLite, or JSON for non-scalars. "
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value)
+    return value
+
+
+Extractor = FormExtractor
+Storage = SQLiteFormStorage
@@ -19,6 +19,8 @@ from docutils import nodes
 from dotmpe.du import util
 from dotmpe.du.mpe_du_util import SqlBase, get_session
 from dotmpe.du.ext import extractor
+from dotmpe.du.ext.transform import ranges
+from dotmpe.du.frozen import text_of
 
 
 
@@ -34,7 +36,7 @@ class HtdocsExtractor(extractor.Extractor):
         - value (unicode string)
         - xml-path (used to infer type?)
         - file
-        - char_offset (if I can get it from the parser)
+        - char_offset (from the parser's range table, see transform.ranges)
         - line_offset
 
     Some global identifiers could be inferred. Make up some schemes.. titles,
@@ -143,7 +145,7 @@ class HtdocsStorage(extractor.SQLiteExtractorStorage):
         s = self.session
         q = s.query(self.Title)
 
-        terms = node.astext().split()
+        terms = text_of(node).split()
         for i, t in enumerate(terms):
             if t.isalnum():
                 q = q.filter(self.Title.value.like("%%%s%%" % t))
@@ -155,9 +157,11 @@ class HtdocsStorage(extractor.SQLiteExtractorStorage):
 
         #assert not candidates, (candidates, term)
 
-        # TODO get line number
-        term = node.astext()
+        term = text_of(node)
         t = self.Title(value=term, file_name=visitor.unid)
+        span = ranges.get_range(node)
+        if span:
+            t.line_offset, t.char_offset = span[0], span[2]
         s.add(t)
         s.commit()
 
@@ -188,7 +192,7 @@ class TinkerVisitor(nodes.SparseNodeVisitor):
 
     def visit_term(self, node):
         self.push_stack(node)
-        t = node.astext()
+        t = text_of(node)
         if t not in self.terms:
             self.terms[t] = {}
 #        self.current = self.terms[t]
@@ -1,33 +1,9 @@
-from dotmpe.du.ext import extractor
-
-
-class IncludeDoctree(extract.Extractor):
-
-    "TODO: Include nodes in doctree, resolves <include /> nodes. "
-    "Optionally rewrite relative reference. "
-
-
-    def apply(self, unid=None, store=None, alias=None, **kwds):
-        pass
-
-
-class RecordDependencies(Transform):
-
-    ""
-
-    settings_spec = ()
-
-    default_priority = 500
-
-    def apply(self):
-        rv = DependenciesVisitor(self.document)
-        rv.apply()
-
-
-class DependenciesVisitor(nodes.SparseNodeVisitor):
-
-    def apply(self):
-        self.document.walkabout(self)
-
-    def visit_include(self, node):
-        pass
+"""
+Resolve the ``include`` nodes left by the dotmpe include directive.
+
+The transforms are plain transforms, added by the mpe reader; they are kept in
+`dotmpe.du.ext.transform.include` and imported here for existing users.
+"""
+from dotmpe.du.ext.transform.include import IncludeCache, included, \
+        note_included, resolve_includes, include_directive, IncludeDoctree, \
+        RecordDependencies, DependenciesVisitor
@@ -18,8 +18,12 @@ Initial specs:
 Schema and other notes in journal.
         
 """
+from docutils import nodes
 from nabu import extract
+from dotmpe.du.frozen import text_of
 from dotmpe.du.ext import extractor
+from dotmpe.du.ext.extractor import docinfo
+from dotmpe.du.ext.transform import outline
 
 
 class LogBookExtractor(extract.Extractor):
@@ -44,6 +48,44 @@ class LogBookExtractor(extract.Extractor):
 
         self.document.reporter.debug('LogBookExtractor unid:%s, store:%s, kwds:%r' % (
             unid, storage, kwds))
+        if not unid or not isinstance(storage, LogBookStorage):
+            return
+
+        # With an outline diff, write only the added and changed entries
+        diff = getattr(self.document, 'outline_diff', None)
+        if diff is not None and not diff:
+            return # unchanged since the last run
+        entries = self.entries()
+        dates = [ date for path, date, count in entries ]
+        logbook = (self.document.get('title'), dates and min(dates),
+                dates and max(dates), len(entries))
+        if diff is None:
+            storage.clear(unid)
+            storage.store(unid, logbook, entries)
+        else:
+            paths = set(diff.added + diff.changed)
+            storage.store(unid, logbook, [ entry for entry in entries
+                if entry[0] in paths ], diff.removed)
+
+    def entries(self):
+        """
+        Return a (path, date, blockitem count) tuple for each section with a
+        date for title. The path is the outline path of the section if the
+        outline was recorded, or its first id. The blockitems are the body
+        elements of the section, other than subsections.
+        """
+        entries = []
+        settings = self.document.settings
+        for section in self.document.traverse(nodes.section):
+            date = docinfo.parse_datetime(text_of(section[0]))
+            if not date:
+                continue
+            path = outline.outline_path(section, settings) \
+                    or section['ids'][0]
+            count = len([ child for child in section.children[1:]
+                if not isinstance(child, nodes.section) ])
+            entries.append((path, date.strftime('%Y-%m-%d'), count))
+        return entries
 
 
 class LogBookStorage(extractor.SQLiteExtractorStorage):
@@ -122,11 +164,47 @@ class LogBookStorage(extractor.SQLiteExtractorStorage):
     def __init__(self, *args, **kwds):
         extractor.SQLiteExtractorStorage.__init__(self, *args, **kwds)
 
-    def store(self, source_id, *args):
-        pass
-
-    def clear(self, source_id):
-        pass
+    def store(self, source_id, logbook, entries, removed=()):
+        """
+        Write the logbook row for `source_id` from the (title, date_start,
+        date_end, entry_count) tuple `logbook`, and one row for each (path,
+        date, blockitem count) in `entries`. Delete the entries at the
+        `removed` paths.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("INSERT OR REPLACE INTO logbook (unid, title, "
+                "date_start, date_end, entry_count) VALUES (?, ?, ?, ?, ?)",
+                (source_id,) + tuple(logbook))
+        cursor.executemany("DELETE FROM logbook_entry WHERE unid = ?",
+                [ (entry_unid(source_id, path),) for path in removed ])
+        cursor.executemany("INSERT OR REPLACE INTO logbook_entry "
+                "(unid, date, blockitem_count, logbook_id) VALUES (?, ?, ?, ?)",
+                [ (entry_unid(source_id, path), date, count, source_id)
+                    for path, date, count in entries ])
+        self.connection.commit()
+
+    def clear(self, source_id=None):
+        cursor = self.connection.cursor()
+        if source_id is None:
+            cursor.execute("DELETE FROM logbook_entry")
+            cursor.execute("DELETE FROM logbook")
+        else:
+            cursor.execute("DELETE FROM logbook_entry WHERE logbook_id = ?",
+                    (source_id,))
+            cursor.execute("DELETE FROM logbook WHERE unid = ?", (source_id,))
+        self.connection.commit()
+
+    def entries(self, source_id):
+        "Return the stored (unid, date, blockitem_count) rows of a logbook. "
+        cursor = self.connection.execute("SELECT unid, date, blockitem_count "
+                "FROM logbook_entry WHERE logbook_id = ? ORDER BY unid",
+                (source_id,))
+        return cursor.fetchall()
+
+
+def entry_unid(source_id, path):
+    "Return the unid of the logbook entry at outline `path` of a document. "
+    return '%s#%s' % (source_id, path)
 
 #    def reset_schema(self, source_id):
 #        raise NotImplemented
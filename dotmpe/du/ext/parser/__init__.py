@@ -9,3 +9,4 @@ from inliner import Inliner
 
 # register all local modules with tag 'mpe' as Parser type
 comp.register_extension_components(__name__, 'mpe', 'Parser', __file__)
+comp.parsers['rst-mpe'] = 'dotmpe.du.ext.parser.rst'
@@ -2,8 +2,9 @@ import roman, re
 from docutils import frontend, parsers, nodes
 import docutils.statemachine
 from docutils.statemachine import StateMachineWS, StateWS
-from docutils.utils import escape2null, unescape
 from docutils.parsers.rst import languages, states, tableparser
+from dotmpe.du.ext.parser.inliner import ScanInliner
+from dotmpe.du.ext.transform import ranges
 
 
 class Parser(parsers.Parser):
@@ -21,6 +22,16 @@ class Parser(parsers.Parser):
           ['--tab-width'],
           {'metavar': '<width>', 'type': 'int', 'default': 8,
            'validator': frontend.validate_nonnegative_int}),
+         ('Parse with the docutils state machine (default) or with the '
+          'faster line tokenizer, which builds the same document tree.',
+          ['--atlassian-engine'],
+          {'metavar': '<engine>', 'type': 'choice', 'default': 'statemachine',
+           'choices': ('statemachine', 'fast')}),
+         ('Record the source ranges of the elements, as document.ranges '
+          '(see dotmpe.du.ext.transform.ranges).',
+          ['--source-ranges'],
+          {'action': 'store_true', 'default': False,
+           'validator': frontend.validate_boolean}),
           ))
 
     config_section = 'atlassian parser'
@@ -37,195 +48,77 @@ class Parser(parsers.Parser):
     def parse(self, inputstring, document):
         """Parse `inputstring` and populate `document`, a document tree."""
         self.setup_parse(inputstring, document)
-        self.statemachine = AtlassianStateMachine(
-              state_classes=self.state_classes,
-              initial_state=self.initial_state,
-              debug=document.reporter.debug_flag)
+        if getattr(document.settings, 'atlassian_engine', None) == 'fast':
+            self.statemachine = FastEngine()
+        else:
+            self.statemachine = AtlassianStateMachine(
+                  state_classes=self.state_classes,
+                  initial_state=self.initial_state,
+                  debug=document.reporter.debug_flag)
         inputlines = docutils.statemachine.string2lines(
               inputstring, tab_width=document.settings.tab_width,
               convert_whitespace=1)
         #assert document.settings.input_encoding == 'unicode'
         assert isinstance(inputstring, unicode)
         self.statemachine.run(inputlines, document, inliner=self.inliner)
+        if getattr(document.settings, 'source_ranges', False):
+            ranges.record_ranges(document, inputstring)
         self.finish_parse()
 
 
-class Inliner:
-    def init_customizations(self, settings):
-        pass
+class Inliner(ScanInliner):
 
-    def parse(self, text, lineno, memo, parent):
-        # Needs to be refactored for nested inline markup.
-        # Add nested_parse() method?
-        """
-        Return 2 lists: nodes (text and inline elements), and system_messages.
+    """
+    Parse Atlassian wiki text effects; call the `parse()` method.
+    All effects are matched by one combined pattern (see `ScanInliner`).
+    """
 
-        Using `self.patterns.initial`, a pattern which matches start-strings
-        (emphasis, strong, interpreted, phrase reference, literal,
-        substitution reference, and inline target) and complete constructs
-        (simple reference, footnote reference), search for a candidate.  When
-        one is found, check for validity (e.g., not a quoted '*' character).
-        If valid, search for the corresponding end string if applicable, and
-        check it for validity.  If not found or invalid, generate a warning
-        and ignore the start-string.  Implicit inline markup (e.g. standalone
-        URIs) is found last.
-        """
-        self.reporter = memo.reporter
-        self.document = memo.document
-        self.language = memo.language
-        self.parent = parent
-        pattern_search = self.patterns.initial.search
-        dispatch = self.dispatch
-        remaining = escape2null(text)
-        processed = []
-        unprocessed = []
-        messages = []
-        while remaining:
-            match = pattern_search(remaining)
-            if match:
-                groups = match.groupdict()
-                method = dispatch[groups['start'] or groups['backquote']
-                                  or groups['refend'] or groups['fnend']]
-                before, inlines, remaining, sysmessages = method(self, match,
-                                                                 lineno)
-                unprocessed.append(before)
-                messages += sysmessages
-                if inlines:
-                    #processed += self.implicit_inline(''.join(unprocessed),
-                    #                                  lineno)
-                    processed += inlines
-                    unprocessed = []
-            else:
-                break
-        remaining = ''.join(unprocessed) + remaining
-        #if remaining:
-        #    processed += self.implicit_inline(remaining, lineno)
-        return processed, messages
-    
-    openers = u'\'"([{<\u2018\u201c\xab\u00a1\u00bf' # see quoted_start below
-    closers = u'\'")]}>\u2019\u201d\xbb!?'
-    unicode_delimiters = u'\u2010\u2011\u2012\u2013\u2014\u00a0'
-    start_string_prefix = (u'((?<=^)|(?<=[-/: \\n\u2019%s%s]))'
-                           % (re.escape(unicode_delimiters),
-                              re.escape(openers)))
-    end_string_suffix = (r'((?=$)|(?=[-/:.,; \n\x00%s%s]))'
-                         % (re.escape(unicode_delimiters),
-                            re.escape(closers)))
-    non_whitespace_escape_before = r'(?<![ \n\x00])'
-    non_whitespace_after = r'(?![ \n])'
-    # Alphanumerics with isolated internal [-._+:] chars (i.e. not 2 together):
-    simplename = r'(?:(?!_)\w)+(?:[-._+:](?:(?!_)\w)+)*'
-
-    parts = ('initial_inline', start_string_prefix, '',
-             [('start', '', non_whitespace_after,  # simple start-strings
-               [r'\*',                # strong
-                r'_',                 # emphasis 
-                r'\?\?',              # citation
-                r'-',                 # strikethrough
-                r'\+',                 # underlined
-                r'\^',                 # superscript
-                r'~',                 # subscript
-                r'{',                 # explicit inline markup
-                ]
-               ),
-              ('whole', '', end_string_suffix, # whole constructs
-               [# reference name & end-string
-               # r'(?P<refname>%s)(?P<refend>__?)' % simplename,
-               # ('footnotelabel', r'\[', r'(?P<fnend>\]_)',
-               #  [r'[0-9]+',               # manually numbered
-               #   r'\#(%s)?' % simplename, # auto-numbered (w/ label?)
-               #   r'\*',                   # auto-symbol
-               #   r'(?P<citationlabel>%s)' % simplename] # citation reference
-               #  )
-               ]
-               ),
-              ('backquote',             # interpreted text or phrase reference
-               '(?P<role>(:%s:)?)' % simplename, # optional role
-               non_whitespace_after,
-               ['`(?!`)']               # but not literal
-               )
-              ]
-             )
-    patterns = states.Struct(
-          initial=states.build_regexp(parts),
-          explicit_inline=re.compile(non_whitespace_escape_before
-                            + r'({)' + end_string_suffix),
-      )
+    end = ScanInliner.non_whitespace_escape_before
+    constructs = (
+        ('strong', r'\*', end + r'\*'),
+        ('emphasis', r'_', end + r'_'),
+        ('citation', r'\?\?', end + r'\?\?'),
+        ('deleted', r'-(?!-)', r'(?<![ \n\x00-])-'),
+        ('inserted', r'\+', end + r'\+'),
+        ('superscript', r'\^', end + r'\^'),
+        ('subscript', r'~', end + r'~'),
+        ('monospaced', r'\{\{', end + r'\}\}'),
+    )
+    del end
 
-    def quoted_start(self, match):
-        """Return 1 if inline markup start-string is 'quoted', 0 if not."""
-        string = match.string
-        start = match.start()
-        end = match.end()
-        if start == 0:                  # start-string at beginning of text
-            return 0
-        prestart = string[start - 1]
-        try:
-            poststart = string[end]
-            if self.openers.index(prestart) \
-                  == self.closers.index(poststart):   # quoted
-                return 1
-        except IndexError:              # start-string at end of text
-            return 1
-        except ValueError:              # not quoted
-            pass
-        return 0
-
-    def inline_obj(self, match, lineno, end_pattern, nodeclass,
-                   restore_backslashes=0):
-        string = match.string
-        matchstart = match.start('start')
-        matchend = match.end('start')
-        if self.quoted_start(match):
-            return (string[:matchend], [], string[matchend:], [], '')
-        endmatch = end_pattern.search(string[matchend:])
-        if endmatch and endmatch.start(1):  # 1 or more chars
-            text = unescape(endmatch.string[:endmatch.start(1)],
-                            restore_backslashes)
-            textend = matchend + endmatch.end(1)
-            rawsource = unescape(string[matchstart:textend], 1)
-            return (string[:matchstart], [nodeclass(rawsource, text)],
-                    string[textend:], [], endmatch.group(1))
-        msg = self.reporter.warning(
-              'Inline %s start-string without end-string.'
-              % nodeclass.__name__, line=lineno)
-        text = unescape(string[matchstart:matchend], 1)
-        rawsource = unescape(string[matchstart:matchend], 1)
-        prb = self.problematic(text, rawsource, msg)
-        return string[:matchstart], [prb], string[matchend:], [msg], ''
-
-    def problematic(self, text, rawsource, message):
-        msgid = self.document.set_id(message, self.parent)
-        problematic = nodes.problematic(rawsource, text, refid=msgid)
-        prbid = self.document.set_id(problematic)
-        message.add_backref(prbid)
-        return problematic
+    def strong(self, match, lineno):
+        return self.inline(match, nodes.strong)
 
     def emphasis(self, match, lineno):
-        before, inlines, remaining, sysmessages, endstring = self.inline_obj(
-              match, lineno, self.patterns.emphasis, nodes.emphasis)
-        return before, inlines, remaining, sysmessages
+        return self.inline(match, nodes.emphasis)
 
-    def strong(self, match, lineno):
-        before, inlines, remaining, sysmessages, endstring = self.inline_obj(
-              match, lineno, self.patterns.strong, nodes.strong)
-        return before, inlines, remaining, sysmessages
+    def citation(self, match, lineno):
+        return self.inline(match, nodes.title_reference)
+
+    def deleted(self, match, lineno):
+        return self.inline(match, nodes.inline, classes=['deleted'])
+
+    def inserted(self, match, lineno):
+        return self.inline(match, nodes.inline, classes=['inserted'])
 
-    def explicit_inline(self, match, lineno):
-        before, inlines, remaining, sysmessages, endstring = self.inline_obj(
-              match, lineno, self.patterns.explicit_inline, nodes.strong)
-        return before, inlines, remaining, sysmessages
+    def superscript(self, match, lineno):
+        return self.inline(match, nodes.superscript)
+
+    def subscript(self, match, lineno):
+        return self.inline(match, nodes.subscript)
+
+    def monospaced(self, match, lineno):
+        return self.inline(match, nodes.literal, restore_backslashes=1)
 
     dispatch = {
-            '_': emphasis,
-            #'**': strong,
-            #'`': interpreted_or_phrase_ref,
-            #'``': literal,
-            #'_`': inline_internal_target,
-            #']_': footnote_reference,
-            #'|': substitution_reference,
-            #'_': reference,
-            '{': explicit_inline
+            'strong': strong,
+            'emphasis': emphasis,
+            'citation': citation,
+            'deleted': deleted,
+            'inserted': inserted,
+            'superscript': superscript,
+            'subscript': subscript,
+            'monospaced': monospaced,
         }
 
 
@@ -526,6 +419,58 @@ class Text(AtlassianState):
         return [], next_state, []
 
 
+def tokenize(lines):
+    """
+    Lex `lines` (with trailing whitespace stripped, see string2lines) into
+    block tokens (kind, start, end), with `start` and `end` line indices.
+    Each run of non-blank lines is a 'paragraph' token.
+    """
+    start = None
+    for index, line in enumerate(lines):
+        if line:
+            if start is None:
+                start = index
+        elif start is not None:
+            yield 'paragraph', start, index
+            start = None
+    if start is not None:
+        yield 'paragraph', start, len(lines)
+
+
+class FastEngine:
+
+    """
+    Alternative to AtlassianStateMachine that lexes the lines into block
+    tokens once and builds the document tree from those, without re-testing
+    transition patterns for each line. Selected with
+    ``--atlassian-engine=fast``.
+    """
+
+    def run(self, input_lines, document, inliner=None):
+        if inliner is None:
+            inliner = Inliner()
+        inliner.init_customizations(document.settings)
+        self.memo = states.Struct(document=document,
+                           reporter=document.reporter,
+                           language=languages.get_language(
+                               document.settings.language_code),
+                           inliner=inliner)
+        self.document = document
+        self.source = document['source']
+        for kind, start, end in tokenize(input_lines):
+            getattr(self, kind)(input_lines[start:end], start)
+        self.memo = self.document = None
+
+    def paragraph(self, lines, start):
+        text = '\n'.join(lines).rstrip()
+        textnodes, messages = self.memo.inliner.parse(text, start + 1,
+                self.memo, self.document)
+        p = nodes.paragraph(text, '', *textnodes)
+        p.source, p.line = self.source, start + 1
+        self.document += p
+        self.document += messages
+
+
 state_classes = (
                Body, 
                #  RFC2822Body, 
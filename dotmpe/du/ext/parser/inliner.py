@@ -1,5 +1,9 @@
+import re
 import sys
+
+from docutils import nodes
 from docutils.parsers.rst import states
+from docutils.utils import escape2null, unescape
 
 
 debug = sys.stderr
@@ -103,3 +107,155 @@ class Inliner(states.Inliner):
 
 
 # 
+
+
+class ScanInliner(object):
+
+    """
+    Inline parser that scans a text block once, with a single alternation of
+    all inline constructs.
+
+    Subclasses list their `constructs` as (name, start-string, end-string)
+    patterns, and map each name to a method in `dispatch`. Constructs with an
+    end-string of None are matched whole by their start pattern. Each
+    complete construct becomes a named group in the alternation, the text
+    between start- and end-string is group '<name>_text'. A start-string
+    without end-string matches group '<name>_start' and yields a problematic
+    node and a warning, like the rSt Inliner.
+
+    Methods in `dispatch` are called with the match and line, and return a
+    list of nodes and a list of system messages. They may return None for
+    the nodes to reject a match, scanning continues after its first
+    character.
+    """
+
+    openers = u'\'"([{<\u2018\u201c\xab\u00a1\u00bf'
+    closers = u'\'")]}>\u2019\u201d\xbb!?'
+    unicode_delimiters = u'\u2010\u2011\u2012\u2013\u2014\u00a0'
+    start_string_prefix = (u'(?:(?<=^)|(?<=[-/: \\n\u2019%s%s]))'
+                           % (re.escape(unicode_delimiters),
+                              re.escape(openers)))
+    end_string_suffix = (u'(?:(?=$)|(?=[-/:.,; \\n\\x00%s%s]))'
+                         % (re.escape(unicode_delimiters),
+                            re.escape(closers)))
+    non_whitespace_before = r'(?<![ \n])'
+    non_whitespace_escape_before = r'(?<![ \n\x00])'
+    non_whitespace_after = r'(?![ \n])'
+    # Alphanumerics with isolated internal [-._+:] chars (i.e. not 2 together):
+    simplename = r'(?:(?!_)\w)+(?:[-._+:](?:(?!_)\w)+)*'
+
+    constructs = ()
+    dispatch = {}
+
+    def __init__(self):
+        cls = self.__class__
+        if cls.__dict__.get('_pattern') is None:
+            cls._pattern = cls.build_pattern()
+        self.pattern = cls._pattern
+
+    def init_customizations(self, settings):
+        pass
+
+    @classmethod
+    def build_pattern(cls):
+        """
+        Compile the alternation of all constructs, see the class docstring.
+        """
+        complete, starts = [], []
+        for name, start, end in cls.constructs:
+            if end is None:
+                complete.append(u'(?P<%s>%s)' % (name, start))
+                continue
+            complete.append(u'(?P<%s>%s(?P<%s_text>[^ \\n].*?)%s)'
+                    % (name, start, name, end))
+            starts.append(u'(?P<%s_start>%s)%s'
+                    % (name, start, cls.non_whitespace_after))
+        return re.compile(u'%s(?:(?:%s)%s|%s)' % (cls.start_string_prefix,
+            u'|'.join(complete), cls.end_string_suffix, u'|'.join(starts)),
+            re.DOTALL | re.UNICODE | re.VERBOSE)
+
+    def parse(self, text, lineno, memo, parent):
+        """
+        Return 2 lists: nodes (text and inline elements), and system_messages.
+        """
+        self.reporter = memo.reporter
+        self.document = memo.document
+        self.language = memo.language
+        self.parent = parent
+        search = self.pattern.search
+        groups = self.pattern.groupindex
+        dispatch = self.dispatch
+        text = escape2null(text)
+        processed = []
+        messages = []
+        pos = done = 0
+        while True:
+            match = search(text, pos)
+            if not match:
+                break
+            name = match.lastgroup
+            if name + '_text' in groups:
+                start_end = match.start(name + '_text')
+            elif name.endswith('_start'):
+                start_end = match.end()
+            else:
+                start_end = None
+            if start_end is not None and self.quoted_start(text,
+                    match.start(), start_end):
+                pos = match.start() + 1
+                continue
+            if name.endswith('_start'):
+                inlines, sysmessages = self.unmatched(match, lineno)
+            else:
+                inlines, sysmessages = dispatch[name](self, match, lineno)
+            if inlines is None:
+                pos = match.start() + 1
+                continue
+            if match.start() > done:
+                processed.append(self.text(text[done:match.start()]))
+            processed += inlines
+            messages += sysmessages
+            pos = done = match.end()
+        if done < len(text):
+            processed.append(self.text(text[done:]))
+        return processed, messages
+
+    def quoted_start(self, text, start, end):
+        """Return 1 if inline markup start-string is 'quoted', 0 if not."""
+        if start == 0:                  # start-string at beginning of text
+            return 0
+        prestart = text[start - 1]
+        try:
+            poststart = text[end]
+            if self.openers.index(prestart) \
+                  == self.closers.index(poststart):   # quoted
+                return 1
+        except IndexError:              # start-string at end of text
+            return 1
+        except ValueError:              # not quoted
+            pass
+        return 0
+
+    def text(self, text):
+        return nodes.Text(unescape(text), rawsource=unescape(text, 1))
+
+    def inline(self, match, nodeclass, restore_backslashes=0, **attributes):
+        name = match.lastgroup
+        text = unescape(match.group(name + '_text'), restore_backslashes)
+        rawsource = unescape(match.group(name), 1)
+        return [nodeclass(rawsource, text, **attributes)], []
+
+    def unmatched(self, match, lineno):
+        name = match.lastgroup[:-len('_start')]
+        msg = self.reporter.warning(
+              'Inline %s start-string without end-string.' % name,
+              line=lineno)
+        rawsource = unescape(match.group(), 1)
+        return [self.problematic(rawsource, rawsource, msg)], [msg]
+
+    def problematic(self, text, rawsource, message):
+        msgid = self.document.set_id(message, self.parent)
+        problematic = nodes.problematic(rawsource, text, refid=msgid)
+        prbid = self.document.set_id(problematic)
+        message.add_backref(prbid)
+        return problematic
@@ -0,0 +1,20 @@
+"""
+The standard rSt parser, recording the source ranges of the elements it
+creates as `document.ranges` (see `dotmpe.du.ext.transform.ranges`). In rSt
+patch mode, the ranges are settled once the transforms ran.
+"""
+from docutils.parsers import rst
+
+from dotmpe.du import imagesize
+from dotmpe.du.ext.transform import ranges
+
+
+class Parser(rst.Parser):
+
+    def get_transforms(self):
+        return rst.Parser.get_transforms(self) + [ ranges.SettleRanges ]
+
+    def parse(self, inputstring, document):
+        rst.Parser.parse(self, inputstring, document)
+        ranges.record_ranges(document, inputstring)
+        imagesize.save()
@@ -1,4 +1,7 @@
-#from docutils.parsers.rst import directives
+"""
+Directives for the mpe rSt parser, and the settings for their caches.
+"""
+from docutils import SettingsSpec
 
 
 # override std Du directives? see dotmpe.du.ext
@@ -7,3 +10,30 @@
 #        #'raw': ('dotmpe.du.ext.parser.rst.directives.include', 'Raw'),
 #        #'replace': ('dotmpe.du.ext.parser.rst.directives.blinc', 'Replace'),
 #    })
+
+
+class CacheSettings(SettingsSpec):
+
+    """
+    The settings for the render cache (see `render`) and the image size cache
+    (see `dotmpe.du.imagesize`). The html-mpe and latex2e writers include
+    them, the Builder adds them for other writers.
+    """
+
+    settings_spec = (
+        'Directive caches',
+        None,
+        (('Keep the output of directives that render embedded markup, '
+          'like mediawiki, in directory <dir>.',
+          ['--render-cache'],
+          {'metavar': '<dir>'}),
+         ('Keep the sizes of images, for figwidth=image and scaled images, '
+          'in <file>.',
+          ['--image-size-cache'],
+          {'metavar': '<file>'}),
+        ))
+
+    @classmethod
+    def included(cls, component):
+        "Return true if the settings spec of `component` has these settings. "
+        return cls.settings_spec[2] in component.settings_spec[2::3]
@@ -56,6 +56,7 @@ class Include(Directive):
         before_text = self.options.get('end-before', None)
         self.state.document.settings.record_dependencies.add(path)
         return [include('', refuri=path, encoding=encoding, tab_width=tab_width, 
+                literal='literal' in self.options,
                 startline=startline, endline=endline,
                 start_after=after_text, end_before=before_text)]
 
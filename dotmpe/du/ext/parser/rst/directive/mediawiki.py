@@ -1,29 +1,38 @@
 """
 This is a very simple directive to parse mediawiki formatted content embedded in
-Docutils documents. The content is always published to a raw HTML node.
+Docutils documents. The content is always published to a raw HTML node, which
+is cached by content and mwlib version (see `render`).
 
 https://maze.io/2009/10/22/rendering-mediawiki-markup-in-restructuredtext/
 """
-from docutils.parsers.rst import Directive
 try:
     import xml.etree.ElementTree as ET
 except:
     from elementtree import ElementTree as ET
 
+import mwlib
 from mwlib.dummydb import DummyDB
 from mwlib.uparser import parseString
 from mwlib.xhtmlwriter import MWXHTMLWriter, preprocess
 
+from dotmpe.du.ext.parser.rst.directive.render import RenderDirective
 
-class MediaWiki(Directive):
+try:
+    from mwlib._version import version as mwlib_version
+except ImportError:
+    mwlib_version = getattr(mwlib, '__version__', '')
+
+
+class MediaWiki(RenderDirective):
 
     required_arguments = 0
     optional_arguments = 1
     has_content = True
     option_spec = {}
 
-    def run(self):
-        raw = u'\n'.join(self.content)
+    renderer_version = mwlib_version
+
+    def render(self, raw):
         # empty wikidb
         db = DummyDB()
         # run parser and pre-processors
@@ -36,6 +45,4 @@ class MediaWiki(Directive):
         article = xhtml.xmlbody.getchildren()[0]
         article.remove(article.getchildren()[0]) # remove caption
         # render to string
-        block = ET.tostring(xhtml.xmlbody)
-        return [nodes.raw('', block, format='html')]
-
+        return ET.tostring(xhtml.xmlbody).decode('utf-8')
@@ -0,0 +1,91 @@
+"""
+Base class for directives that render embedded foreign markup to a raw node,
+with a cache of the rendered output.
+
+Output is cached by the SHA-1 of the directive name, the renderer version,
+the options and the content. It is kept in memory for the process, and in a
+directory if the ``render_cache`` setting is given (see `CacheSettings` in
+this package), with one file per digest. The files are written atomically, so that several
+processes can share the directory.
+"""
+import hashlib
+import os
+
+from docutils import nodes
+from docutils.parsers.rst import Directive
+
+
+class RenderCache(object):
+
+    def __init__(self):
+        self.entries = {}
+        "digest -> output "
+
+    def get(self, digest, directory=None):
+        if digest in self.entries:
+            return self.entries[digest]
+        if directory:
+            path = os.path.join(directory, digest)
+            if os.path.exists(path):
+                output = open(path, 'rb').read().decode('utf-8')
+                self.entries[digest] = output
+                return output
+
+    def set(self, digest, output, directory=None):
+        self.entries[digest] = output
+        if directory:
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            path = os.path.join(directory, digest)
+            tmp = '%s.%i.tmp' % (path, os.getpid())
+            open(tmp, 'wb').write(output.encode('utf-8'))
+            os.rename(tmp, path)
+
+    def clear(self):
+        self.entries.clear()
+
+rendered = RenderCache()
+"The render cache shared by all directives in this process. "
+
+
+class RenderDirective(Directive):
+
+    """
+    Render the content with `render` and return it as a raw node of
+    `output_format`, cached. Subclasses set `renderer_version` to the version
+    of the renderer, to drop the cached output when it changes.
+    """
+
+    has_content = True
+
+    output_format = 'html'
+
+    renderer_version = ''
+
+    def render(self, raw):
+        """
+        Return the rendered `raw` content as a unicode string. Abstract,
+        subclasses must implement it.
+        """
+        raise NotImplementedError
+
+    def digest(self, raw):
+        sha1 = hashlib.sha1('\0'.join((self.name, self.output_format,
+            str(self.renderer_version), repr(sorted(self.options.items())),
+            repr(self.arguments))))
+        sha1.update('\0' + raw.encode('utf-8'))
+        return sha1.hexdigest()
+
+    def run(self):
+        raw = u'\n'.join(self.content)
+        directory = getattr(self.state.document.settings, 'render_cache', None)
+        digest = self.digest(raw)
+        output = rendered.get(digest, directory)
+        if output is None:
+            output = self.render(raw)
+            rendered.set(digest, output, directory)
+        return [nodes.raw('', output, format=self.output_format)]
@@ -14,87 +14,28 @@ import re
 import docutils
 from docutils import frontend, parsers, nodes
 from docutils.nodes import fully_normalize_name as normalize_name
+from docutils.nodes import whitespace_normalize_name
 from docutils.statemachine import StateMachineWS, StateWS
-from docutils.utils import escape2null, unescape
+from docutils.utils import unescape, urischemes
 from docutils.parsers.rst import languages
-from docutils.parsers.rst.states import build_regexp, Struct
+from docutils.parsers.rst.states import Struct
+from dotmpe.du.ext.parser.inliner import ScanInliner
+from dotmpe.du.ext.transform import ranges
 
 
 
-class Inliner:
+class Inliner(ScanInliner):
 
     """
     Parse inline markup; call the `parse()` method.
-    """
-
-    def __init__(self):
-        self.implicit_dispatch = [(self.patterns.uri, self.standalone_uri),]
-        """List of (pattern, bound method) tuples, used by
-        `self.implicit_inline`."""
 
-    def parse(self, text, lineno, memo, parent):
-        # Needs to be refactored for nested inline markup.
-        # Add nested_parse() method?
-        """
-        Return 2 lists: nodes (text and inline elements), and system_messages.
+    Strong, emphasis, literal, simple references and standalone URIs are
+    matched by one combined pattern (see `ScanInliner`).
+    """
 
-        Using `self.patterns.initial`, a pattern which matches start-strings
-        (emphasis, strong, interpreted, phrase reference, literal,
-        substitution reference, and inline target) and complete constructs
-        (simple reference, footnote reference), search for a candidate.  When
-        one is found, check for validity (e.g., not a quoted '*' character).
-        If valid, search for the corresponding end string if applicable, and
-        check it for validity.  If not found or invalid, generate a warning
-        and ignore the start-string.  Implicit inline markup (e.g. standalone
-        URIs) is found last.
-        """
-        self.reporter = memo.reporter
-        self.document = memo.document
-        self.language = memo.language
-        self.parent = parent
-        pattern_search = self.patterns.initial.search
-        dispatch = self.dispatch
-        remaining = escape2null(text)
-        processed = []
-        unprocessed = []
-        messages = []
-        while remaining:
-            match = pattern_search(remaining)
-            if match:
-                groups = match.groupdict()
-                method = dispatch[groups['start'] or groups['backquote']
-                                  or groups['refend'] or groups['fnend']]
-                before, inlines, remaining, sysmessages = method(self, match,
-                                                                 lineno)
-                unprocessed.append(before)
-                messages += sysmessages
-                if inlines:
-                    processed += self.implicit_inline(''.join(unprocessed),
-                                                      lineno)
-                    processed += inlines
-                    unprocessed = []
-            else:
-                break
-        remaining = ''.join(unprocessed) + remaining
-        if remaining:
-            processed += self.implicit_inline(remaining, lineno)
-        return processed, messages
-
-    openers = u'\'"([{<\u2018\u201c\xab\u00a1\u00bf' # see quoted_start below
-    closers = u'\'")]}>\u2019\u201d\xbb!?'
-    unicode_delimiters = u'\u2010\u2011\u2012\u2013\u2014\u00a0'
-    start_string_prefix = (u'((?<=^)|(?<=[-/: \\n\u2019%s%s]))'
-                           % (re.escape(unicode_delimiters),
-                              re.escape(openers)))
-    end_string_suffix = (r'((?=$)|(?=[-/:.,; \n\x00%s%s]))'
-                         % (re.escape(unicode_delimiters),
-                            re.escape(closers)))
-    non_whitespace_before = r'(?<![ \n])'
-    non_whitespace_escape_before = r'(?<![ \n\x00])'
-    non_unescaped_whitespace_escape_before = r'(?<!(?<!\x00)[ \n\x00])'
-    non_whitespace_after = r'(?![ \n])'
-    # Alphanumerics with isolated internal [-._+:] chars (i.e. not 2 together):
-    simplename = r'(?:(?!_)\w)+(?:[-._+:](?:(?!_)\w)+)*'
+    non_whitespace_escape_before = ScanInliner.non_whitespace_escape_before
+    non_whitespace_before = ScanInliner.non_whitespace_before
+    simplename = ScanInliner.simplename
     # Valid URI characters (see RFC 2396 & RFC 2732);
     # final \x00 allows backslash escapes in URIs:
     uric = r"""[-_.!~*'()[\];/:@&=+$,%a-zA-Z0-9\x00]"""
@@ -105,182 +46,69 @@ class Inliner:
     # End of a URI (either 'urilast' or 'uric followed by a
     # uri_end_delim'):
     uri_end = r"""(?:%(urilast)s|%(uric)s(?=%(uri_end_delim)s))""" % locals()
-    emailc = r"""[-_!~*'{|}/#?^`&=+$%a-zA-Z0-9\x00]"""
+    emailc = r"""[-_!~*'{|}/\#?^`&=+$%a-zA-Z0-9\x00]"""
     email_pattern = r"""
           %(emailc)s+(?:\.%(emailc)s+)*   # name
           (?<!\x00)@                      # at
           %(emailc)s+(?:\.%(emailc)s*)*   # host
           %(uri_end)s                     # final URI char
-          """
-    parts = ('initial_inline', start_string_prefix, '',
-             [('start', '', non_whitespace_after,  # simple start-strings
-               [r'\*\*',                # strong
-                r'\*(?!\*)',            # emphasis but not strong
-                r'``',                  # literal
-                r'_`',                  # inline internal target
-                r'\|(?!\|)']            # substitution reference
-               ),
-              ('whole', '', end_string_suffix, # whole constructs
-               [# reference name & end-string
-                r'(?P<refname>%s)(?P<refend>__?)' % simplename,
-                ('footnotelabel', r'\[', r'(?P<fnend>\]_)',
-                 [r'[0-9]+',               # manually numbered
-                  r'\#(%s)?' % simplename, # auto-numbered (w/ label?)
-                  r'\*',                   # auto-symbol
-                  r'(?P<citationlabel>%s)' % simplename] # citation reference
-                 )
-                ]
-               ),
-              ('backquote',             # interpreted text or phrase reference
-               '(?P<role>(:%s:)?)' % simplename, # optional role
-               non_whitespace_after,
-               ['`(?!`)']               # but not literal
-               )
-              ]
-             )
-    patterns = Struct(
-          initial=build_regexp(parts),
-          emphasis=re.compile(non_whitespace_escape_before
-                              + r'(\*)' + end_string_suffix),
-          strong=re.compile(non_whitespace_escape_before
-                            + r'(\*\*)' + end_string_suffix),
-          embedded_uri=re.compile(
-              r"""
-              (
-                (?:[ \n]+|^)            # spaces or beginning of line/string
-                <                       # open bracket
-                %(non_whitespace_after)s
-                ([^<>\x00]+)            # anything but angle brackets & nulls
-                %(non_whitespace_before)s
-                >                       # close bracket w/o whitespace before
+          """ % locals()
+    uri_pattern = r"""
+          (?P<absolute>           # absolute URI
+            (?P<scheme>             # scheme (http, ftp, mailto)
+              [a-zA-Z][a-zA-Z0-9.+-]*
+            )
+            :
+            (?:
+              (?:                     # either:
+                (?://?)?                # hierarchical URI
+                %(uric)s*               # URI characters
+                %(uri_end)s             # final URI char
               )
-              $                         # end of string
-              """ % locals(), re.VERBOSE),
-          literal=re.compile(non_whitespace_before + '(``)'
-                             + end_string_suffix),
-          target=re.compile(non_whitespace_escape_before
-                            + r'(`)' + end_string_suffix),
-          substitution_ref=re.compile(non_whitespace_escape_before
-                                      + r'(\|_{0,2})'
-                                      + end_string_suffix),
-          email=re.compile(email_pattern % locals() + '$', re.VERBOSE),
-          uri=re.compile(
-                (r"""
-                %(start_string_prefix)s
-                (?P<whole>
-                  (?P<absolute>           # absolute URI
-                    (?P<scheme>             # scheme (http, ftp, mailto)
-                      [a-zA-Z][a-zA-Z0-9.+-]*
-                    )
-                    :
-                    (
-                      (                       # either:
-                        (//?)?                  # hierarchical URI
-                        %(uric)s*               # URI characters
-                        %(uri_end)s             # final URI char
-                      )
-                      (                       # optional query
-                        \?%(uric)s*
-                        %(uri_end)s
-                      )?
-                      (                       # optional fragment
-                        \#%(uric)s*
-                        %(uri_end)s
-                      )?
-                    )
-                  )
-                |                       # *OR*
-                  (?P<email>              # email address
-                    """ + email_pattern + r"""
-                  )
-                )
-                %(end_string_suffix)s
-                """) % locals(), re.VERBOSE),
+              (?:                     # optional query
+                \?%(uric)s*
+                %(uri_end)s
+              )?
+              (?:                     # optional fragment
+                \#%(uric)s*
+                %(uri_end)s
+              )?
+            )
+          )
+        |                       # *OR*
+          (?P<email>              # email address
+            %(email_pattern)s
           )
+          """ % locals()
 
-    def quoted_start(self, match):
-        """Return 1 if inline markup start-string is 'quoted', 0 if not."""
-        string = match.string
-        start = match.start()
-        end = match.end()
-        if start == 0:                  # start-string at beginning of text
-            return 0
-        prestart = string[start - 1]
-        try:
-            poststart = string[end]
-            if self.openers.index(prestart) \
-                  == self.closers.index(poststart):   # quoted
-                return 1
-        except IndexError:              # start-string at end of text
-            return 1
-        except ValueError:              # not quoted
-            pass
-        return 0
-
-    def inline_obj(self, match, lineno, end_pattern, nodeclass,
-                   restore_backslashes=0):
-        string = match.string
-        matchstart = match.start('start')
-        matchend = match.end('start')
-        if self.quoted_start(match):
-            return (string[:matchend], [], string[matchend:], [], '')
-        endmatch = end_pattern.search(string[matchend:])
-        if endmatch and endmatch.start(1):  # 1 or more chars
-            text = unescape(endmatch.string[:endmatch.start(1)],
-                            restore_backslashes)
-            textend = matchend + endmatch.end(1)
-            rawsource = unescape(string[matchstart:textend], 1)
-            return (string[:matchstart], [nodeclass(rawsource, text)],
-                    string[textend:], [], endmatch.group(1))
-        msg = self.reporter.warning(
-              'Inline %s start-string without end-string.'
-              % nodeclass.__name__, line=lineno)
-        text = unescape(string[matchstart:matchend], 1)
-        rawsource = unescape(string[matchstart:matchend], 1)
-        prb = self.problematic(text, rawsource, msg)
-        return string[:matchstart], [prb], string[matchend:], [msg], ''
-
-    def problematic(self, text, rawsource, message):
-        msgid = self.document.set_id(message, self.parent)
-        problematic = nodes.problematic(rawsource, text, refid=msgid)
-        prbid = self.document.set_id(problematic)
-        message.add_backref(prbid)
-        return problematic
+    constructs = (
+        ('strong', r'\*\*', non_whitespace_escape_before + r'\*\*'),
+        ('emphasis', r'\*(?!\*)', non_whitespace_escape_before + r'\*'),
+        ('literal', r'``', non_whitespace_before + r'``'),
+        ('reference', r'(?P<refname>%s)(?P<refend>__?)' % simplename, None),
+        ('uri', uri_pattern, None),
+    )
 
     def emphasis(self, match, lineno):
-        before, inlines, remaining, sysmessages, endstring = self.inline_obj(
-              match, lineno, self.patterns.emphasis, nodes.emphasis)
-        return before, inlines, remaining, sysmessages
+        return self.inline(match, nodes.emphasis)
 
     def strong(self, match, lineno):
-        before, inlines, remaining, sysmessages, endstring = self.inline_obj(
-              match, lineno, self.patterns.strong, nodes.strong)
-        return before, inlines, remaining, sysmessages
+        return self.inline(match, nodes.strong)
 
     def literal(self, match, lineno):
-        before, inlines, remaining, sysmessages, endstring = self.inline_obj(
-              match, lineno, self.patterns.literal, nodes.literal,
-              restore_backslashes=1)
-        return before, inlines, remaining, sysmessages
+        return self.inline(match, nodes.literal, restore_backslashes=1)
 
-    def reference(self, match, lineno, anonymous=None):
+    def reference(self, match, lineno):
         referencename = match.group('refname')
-        refname = normalize_name(referencename)
         referencenode = nodes.reference(
             referencename + match.group('refend'), referencename,
             name=whitespace_normalize_name(referencename))
-        if anonymous:
+        if match.group('refend') == '__':
             referencenode['anonymous'] = 1
         else:
-            referencenode['refname'] = refname
+            referencenode['refname'] = normalize_name(referencename)
             self.document.note_refname(referencenode)
-        string = match.string
-        matchstart = match.start('whole')
-        matchend = match.end('whole')
-        return (string[:matchstart], [referencenode], string[matchend:], [])
-
-    def anonymous_reference(self, match, lineno):
-        return self.reference(match, lineno, anonymous=1)
+        return [referencenode], []
 
     def standalone_uri(self, match, lineno):
         if (not match.group('scheme')
@@ -289,40 +117,18 @@ class Inliner:
                 addscheme = 'mailto:'
             else:
                 addscheme = ''
-            text = match.group('whole')
+            text = match.group('uri')
             unescaped = unescape(text, 0)
             return [nodes.reference(unescape(text, 1), unescaped,
-                                    refuri=addscheme + unescaped)]
+                                    refuri=addscheme + unescaped)], []
         else:                   # not a valid scheme
-            raise MarkupMismatch
+            return None, []
 
-    def implicit_inline(self, text, lineno):
-        """
-        Check each of the patterns in `self.implicit_dispatch` for a match,
-        and dispatch to the stored method for the pattern.  Recursively check
-        the text before and after the match.  Return a list of `nodes.Text`
-        and inline element nodes.
-        """
-        if not text:
-            return []
-        for pattern, method in self.implicit_dispatch:
-            match = pattern.search(text)
-            if match:
-                try:
-                    # Must recurse on strings before *and* after the match;
-                    # there may be multiple patterns.
-                    return (self.implicit_inline(text[:match.start()], lineno)
-                            + method(match, lineno) +
-                            self.implicit_inline(text[match.end():], lineno))
-                except MarkupMismatch:
-                    pass
-        return [nodes.Text(unescape(text), rawsource=unescape(text, 1))]
-
-    dispatch = {'*': emphasis,
-                '**': strong,
-                '``': literal,
-                '_': reference,
-                '__': anonymous_reference}
+    dispatch = {'emphasis': emphasis,
+                'strong': strong,
+                'literal': literal,
+                'reference': reference,
+                'uri': standalone_uri}
 
 
 
@@ -400,6 +206,11 @@ class Parser(parsers.Parser):
           ['--tab-width'],
           {'metavar': '<width>', 'type': 'int', 'default': 8,
            'validator': frontend.validate_nonnegative_int}),
+         ('Record the source ranges of the elements, as document.ranges '
+          '(see dotmpe.du.ext.transform.ranges).',
+          ['--source-ranges'],
+          {'action': 'store_true', 'default': False,
+           'validator': frontend.validate_boolean}),
           )
         )
 
@@ -424,6 +235,8 @@ class Parser(parsers.Parser):
         #assert document.settings.input_encoding == 'unicode'
         assert isinstance(inputstring, unicode)
         self.statemachine.run(inputlines, document, inliner=self.inliner)
+        if getattr(document.settings, 'source_ranges', False):
+            ranges.record_ranges(document, inputstring)
         self.finish_parse()
 
 
@@ -36,6 +36,7 @@ class Reader(readers.Reader):
             standalone.Reader.settings_spec[2] +
             user.UserSettings.settings_spec +
             include.Include.settings_spec +
+            include.IncludeDoctree.settings_spec +
             #include.RecordDependencies.settings_spec +
             #template.TemplateSubstitutions.settings_spec +
             generate.PathBreadcrumb.settings_spec +
@@ -53,11 +54,16 @@ class Reader(readers.Reader):
     config_section = '.mpe extended standalone reader'
     config_section_dependencies = ('readers',)
 
+    def parse(self):
+        with include.include_directive(self.settings):
+            readers.Reader.parse(self)
+
     def get_transforms(self):
         #return standalone.Reader.get_transforms(self) + [
         return Component.get_transforms(self) + [
             user.UserSettings,              # 20
-            include.Include,                # 50
+            include.IncludeDoctree,         # 150
+            include.Include,                # 180
             #include.RecordDependencies,     # 500
             #template.TemplateSubstitutions, # 190
 #            MyPHPTemplate,
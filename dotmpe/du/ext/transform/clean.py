@@ -1,5 +1,7 @@
 from docutils import transforms, nodes
 
+from dotmpe.du import util
+
 
 class StripSubstitutionDefs(transforms.Transform):
 
@@ -23,9 +25,7 @@ class StripSubstitutionDefs(transforms.Transform):
         if not getattr(doc.settings, 'strip_substitution_definitions', ''):
             return
 
-        subdefs = doc.traverse(nodes.substitution_definition)
-        for e in subdefs:
-            e.parent.remove(e)
+        util.prune(doc, nodes.substitution_definition)
 
 
 class StripAnonymousTargets(transforms.Transform):
@@ -49,8 +49,5 @@ class StripAnonymousTargets(transforms.Transform):
         if not getattr(doc.settings, 'strip_anonymous_targets', ''):
             return
 
-        trgts = doc.traverse(nodes.target)
-        for t in trgts:
-            if 'anonymous' in t.attributes and t['anonymous']:
-                t.parent.remove(t)
+        util.prune(doc, lambda t: t.get('anonymous'), nodes.target)
 
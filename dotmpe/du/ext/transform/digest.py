@@ -0,0 +1,53 @@
+"""
+:Created: 2026-10-19
+
+Structural digests of doctree subtrees.
+
+The digest of an element is the SHA-1 of its tagname, attributes and the
+digests of its children, computed bottom-up and set as the (non-node)
+attribute ``digest``. Equal digests mean equal subtrees, wherever they are
+in a document and whatever their source line.
+
+Digests are only valid until the tree changes, compute them again before
+use. Writers can use the digests to reuse output for unchanged parts (see
+the section cache of `dotmpe.du.ext.writer.html`), the outline transform to
+tell which parts of a document changed.
+"""
+import hashlib
+
+from docutils import nodes
+
+
+def subtree_digest(node):
+    """
+    Set the digest of `node` and its descendant elements, and return the
+    hexdigest for `node`.
+    """
+    if isinstance(node, nodes.Text):
+        return hashlib.sha1('#text\0' + node.encode('utf-8')).hexdigest()
+    sha1 = hashlib.sha1(node.tagname)
+    sha1.update('\0' + repr(sorted(node.attributes.items())))
+    for child in node.children:
+        sha1.update('\0' + subtree_digest(child))
+    node.digest = sha1.hexdigest()
+    return node.digest
+
+def settings_digest(settings, exclude=()):
+    """
+    Return the hexdigest of the public settings with plain (string, number,
+    or sequences of those) values, except those named in `exclude`.
+    """
+    values = []
+    for name, value in sorted(vars(settings).items()):
+        if name.startswith('_') or name in exclude:
+            continue
+        if isinstance(value, (list, tuple)):
+            if not all(isinstance(v, plain_types) for v in value):
+                continue
+        elif not isinstance(value, plain_types):
+            continue
+        values.append((name, value))
+    return hashlib.sha1(repr(values)).hexdigest()
+
+plain_types = basestring, int, long, float, type(None)
+
@@ -12,11 +12,20 @@ from docutils.transforms import Transform
 from docutils.transforms.references import Substitutions
 from dotmpe.du.ext.transform import include
 from dotmpe.du import util
+from dotmpe.du.nodeindex import nodes_of
 
 
 logger = util.get_log(__name__)
 
 
+def has_substitution_ref(document, refname):
+    "True if `document` has a reference to substitution `refname`. "
+    for subref in nodes_of(document, nodes.substitution_reference):
+        if nodes.fully_normalize_name(subref['refname']) == refname:
+            return True
+    return False
+
+
 # This should run before references.Substitutions (220). "
 # 200 places them after template.TemplateSubstitutions "
 # and before the earliest transform (misc.ClassAttribute at 210). "
@@ -72,9 +81,7 @@ class PathBreadcrumb(Generator):
             self.document.settings.breadcrumb_substitution_reference)
         subrefid = nodes.make_id(subrefname)
 
-        subreflist = self.document.traverse(nodes.substitution_reference)
-        
-        if subrefname not in subreflist:
+        if not has_substitution_ref(self.document, subrefname):
             subloc = self.find_breadcrumb_location()
 
             # append sub. reference at location
@@ -95,6 +102,34 @@ class PathBreadcrumb(Generator):
         subloc = self.document.settings.breadcrumb_location
         return self.find_location(subloc)
 
+    directories = {}
+    "(directory path, separator) -> breadcrumb list for the directory. "
+
+    def directory_breadcrumb(self, dirpath, sep):
+        """
+        Return the breadcrumb list with the linked items for `dirpath`. These
+        are built once per directory, and must be copied before use.
+        """
+        key = dirpath, sep
+        if key not in PathBreadcrumb.directories:
+            breadcrumb = nodes.enumerated_list(classes=['breadcrumb'])
+            dirs = dirpath.split(sep) if dirpath is not None else []
+            _p = []
+            for dn in dirs:
+                _p.append(dn)
+                href = sep.join(_p) or sep
+                # XXX: fix the path to be absolute
+                if not href.startswith(sep):
+                    href = sep+href
+                dn += sep
+                ref = nodes.reference('', nodes.Text(dn), refuri=href)
+                p = nodes.paragraph('', '', ref)
+                item = nodes.list_item()
+                item.append(p)
+                breadcrumb.append(item)
+            PathBreadcrumb.directories[key] = breadcrumb
+        return PathBreadcrumb.directories[key]
+
     def generate_breadcrumb(self):
         "Generate ordered and linked 'breadcrumb' path list. "
 
@@ -104,29 +139,17 @@ class PathBreadcrumb(Generator):
         if not path:
             path = self.document['source']
 
-        breadcrumb = nodes.enumerated_list(classes=['breadcrumb'])
-
         # TODO: much more customization, what about domain, etc?
         s,h,path,para,q,f = urlparse.urlparse(path)
-        dirs = path.split(sep) or []
-       
-        _p = []
-        while dirs:
-            dn = dirs.pop(0)
-            _p.append(dn)
-            if dirs:
-                href = sep.join(_p) or sep
-                # XXX: fix the path to be absolute
-                if not href.startswith(sep):
-                    href = sep+href
-                dn += sep
-                ref = nodes.reference('', nodes.Text(dn), refuri=href)
-            else:
-                ref = nodes.Text(dn)
-            p = nodes.paragraph('', '', ref)
-            item = nodes.list_item()
-            item.append(p)
-            breadcrumb.append(item)
+        if sep in path:
+            dirpath, leaf = path.rsplit(sep, 1)
+        else:
+            dirpath, leaf = None, path
+
+        breadcrumb = self.directory_breadcrumb(dirpath, sep).deepcopy()
+        item = nodes.list_item()
+        item.append(nodes.paragraph('', '', nodes.Text(leaf)))
+        breadcrumb.append(item)
 
         return breadcrumb
 
@@ -203,8 +226,7 @@ class CCLicenseLink(include.Include):
         subrefpath = nodes.fully_normalize_name(
                 settings.cc_license_location)
 
-        subreflist = self.document.traverse(nodes.substitution_reference)
-        if subrefname not in subreflist:
+        if not has_substitution_ref(self.document, subrefname):
             subrefloc = self.find_location(subrefpath)
 
             # append sub. ref. at location
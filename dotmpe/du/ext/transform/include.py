@@ -4,11 +4,25 @@
 Insert raw data at location.
 
 Use to include external raw xml, latex or html data in the document
-at publication time.
+at publication time. Data read from files is kept in the process-level asset
+cache (`dotmpe.du.assets`), shared with the html-mpe writer.
+
+Also resolves the ``include`` nodes left by the dotmpe include directive
+(`dotmpe.du.ext.parser.rst.directive.include`), see `IncludeDoctree`.
+Included sources are parsed once per process. The parsed nodes are kept in
+`included`, keyed on the path, mtime and size of the file, and the options
+that select and decode its content. Each including document gets a deep copy.
 """
+import os
 import re
-from docutils import nodes
-from docutils.transforms import Transform
+from contextlib import contextmanager
+from docutils import io, nodes, utils
+from docutils.parsers import rst
+from docutils.parsers.rst import directives
+from docutils.transforms import Transform, TransformError
+from dotmpe.du import nodeindex
+from dotmpe.du.assets import assets
+from dotmpe.du.ext.node.include import include
 
 
 class Include(Transform):
@@ -35,52 +49,77 @@ class Include(Transform):
     default_priority = 180
     "Before actual substitution. "
 
-    datav_re = r'^(latex|html|xml):(file:)?(.*)$'
+    datav_re = re.compile(r'^(latex|html|xml):(file:)?(.*)$', re.DOTALL)
 
     def apply(self):
         if not hasattr(self.document.settings, 'include'):
             return
 
         # validate options
-        inserts = [i.split(',') for i in self.document.settings.include]
+        inserts = [i.split(',', 2) for i in self.document.settings.include]
         for i in range(0, len(inserts)):
             if len(inserts[i]) != 3:
-                raise ""
+                raise TransformError("Expected XPATH,IDX,DATA for include: %s"
+                        % self.document.settings.include[i])
             else:
                 inserts[i][1] = int( inserts[i][1] )
 
+        paths = nodeindex.path_index(self.document)
+        encoding = getattr(self.document.settings, 'input_encoding',
+                None) or 'utf-8'
+
         # insert each value
         for xpath, index, data in inserts:
 
             loc = self.find_location(xpath)
 
             # process data
-            m = re.compile(self.datav_re).match(data)
+            m = self.datav_re.match(data)
             if not m:
-                raise "Unable to read: %s" % data
+                raise TransformError("Unable to read: %s" % data)
 
             datatype, isfile, data = m.groups()
-            assert not isfile
-#            if isfile:
-#                assert document.settings.include
-#                data = open(data).read()
+            if isfile:
+                dependencies = getattr(self.document.settings,
+                        'record_dependencies', None)
+                if dependencies:
+                    dependencies.add(data)
+                data = assets.read(data, encoding=encoding)
 
             # insert
             if index < 0:
                 index = len(loc)+index+1
-            loc.insert(index, nodes.raw('', data, format=datatype))
+            paths.insert(loc, index, nodes.raw('', data, format=datatype))
 
 
-    xpath_re = r'([a-z]?[a-z0-9_]+)(?:\[([0-9]+)\])'
+    xpath_re = re.compile(r'([a-z]?[a-z0-9_]+)(?:\[([0-9]+)\])?$')
+
+    compiled_paths = {}
+    "Path string -> tuple of (node class, ordinal) steps. "
 
     def parse_xpath(self, path):
-        match = re.compile(self.xpath_re).match
-        parts = path.split('/')
-        path = []
-        for p in parts:
-            g = match(p).groups()
-            path.append((g[0], int(g[1])))
-        return path
+        "Return the (name, ordinal) steps of `path`. "
+        return [ (node_class.__name__, ordinal)
+                for node_class, ordinal in self.compile_path(path) ]
+
+    def compile_path(self, path):
+        """
+        Return the (node class, ordinal) steps of `path`, without a leading
+        ``document`` step. The ordinal defaults to 0.
+        """
+        if path not in Include.compiled_paths:
+            steps = []
+            for p in path.split('/'):
+                m = self.xpath_re.match(p)
+                node_class = m and getattr(nodes, m.group(1), None)
+                if not isinstance(node_class, type) \
+                        or not issubclass(node_class, nodes.Node):
+                    raise TransformError("Illegal path %s" % path)
+                steps.append((node_class, int(m.group(2) or 0)))
+            if steps and steps[0][0] is nodes.document:
+                steps.pop(0)
+            Include.compiled_paths[path] = tuple(steps)
+        return Include.compiled_paths[path]
 
     def find_location(self, path):
         decoration = self.document.get_decoration()
@@ -89,22 +128,267 @@ class Include(Transform):
 
         else:
             # use xpath to retrieve parent node
-            parts = self.parse_xpath(path)
+            return nodeindex.path_index(self.document).locate(
+                    self.compile_path(path))
+
+
+class IncludeCache(object):
+
+    """
+    Parsed include sources, see the module docstring.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        "key -> list of parsed nodes "
+
+    def key(self, node):
+        path = node['refuri']
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime, stat.st_size,
+                node.get('startline'), node.get('endline'),
+                node.get('start_after'), node.get('end_before'),
+                node.get('encoding'), node.get('tab_width'),
+                bool(node.get('literal')))
+
+    def read(self, node, settings):
+        "Return the selected text of the source of include `node`. "
+        source = io.FileInput(source_path=node['refuri'],
+                encoding=node.get('encoding') or settings.input_encoding,
+                error_handler=settings.input_encoding_error_handler)
+        text = source.read()
+        if node.get('startline') or node.get('endline') is not None:
+            lines = text.splitlines(True)
+            text = ''.join(lines[node.get('startline') or 0:node.get('endline')])
+        if node.get('start_after'):
+            before, sep, after = text.partition(node['start_after'])
+            if not sep:
+                raise ValueError('Problem with "start-after" option of include '
+                        'file %s: text not found' % node['refuri'])
+            text = after
+        if node.get('end_before'):
+            before, sep, after = text.partition(node['end_before'])
+            if not sep:
+                raise ValueError('Problem with "end-before" option of include '
+                        'file %s: text not found' % node['refuri'])
+            text = before
+        return text
+
+    def parse(self, node, settings):
+        "Parse the source of include `node`, return the list of nodes. "
+        text = self.read(node, settings)
+        tab_width = node.get('tab_width') or settings.tab_width
+        if node.get('literal'):
+            text = text.expandtabs(tab_width)
+            return [ nodes.literal_block(text, text, source=node['refuri']) ]
+        # the settings are shared by the including document
+        settings = settings.copy()
+        settings.tab_width = tab_width
+        document = utils.new_document(node['refuri'], settings)
+        rst.Parser().parse(text, document)
+        return document.children[:]
+
+    def get(self, node, settings):
+        """
+        Return a copy of the nodes parsed from the source of include `node`.
+        """
+        key = self.key(node)
+        if key not in self.entries:
+            self.entries[key] = self.parse(node, settings)
+        return [ deepcopy(child) for child in self.entries[key] ]
+
+    def clear(self):
+        self.entries.clear()
 
-            doc = self.document
-            if parts[0][0] == 'document':
-                parts.pop(0)
+included = IncludeCache()
+"The include cache shared by all documents in this process. "
 
-            while parts:
-                name, index = parts.pop(0)
-                for e in doc:
-                    if isinstance(e, getattr(nodes, name)):
-                        if index == 0:
-                            doc = e
-                            break
-                        index -= 1
 
-            assert not parts, 'illegal path %s' % path
-            return doc
+def deepcopy(node):
+    """
+    Return a deep copy of `node` that shares no attribute lists with it.
+    Unlike `Node.deepcopy`, this also copies system messages.
+    """
+    if isinstance(node, nodes.Text):
+        return node.deepcopy()
+    attributes = dict([ (name, isinstance(value, list) and value[:] or value)
+        for name, value in node.attributes.items() ])
+    if isinstance(node, nodes.system_message):
+        copy = nodes.system_message(**attributes)
+        copy.rawsource = node.rawsource
+    else:
+        copy = node.__class__(rawsource=node.rawsource, **attributes)
+    copy.source, copy.line = node.source, node.line
+    copy.extend([ deepcopy(child) for child in node.children ])
+    return copy
+
+
+def note_included(document, children):
+    """
+    Register the ids, names and references of the included `children`, as
+    the rSt parser does for the nodes it creates. The ids from the separate
+    parse of the include are dropped, `document` assigns new ones.
+    """
+    elements = []
+    for child in children:
+        elements += child.traverse(nodes.Element)
+    parsed_ids = {}
+    for element in elements:
+        if element['ids']:
+            parsed_ids[id(element)] = element['ids']
+            element['ids'] = []
+    for element in elements:
+        if isinstance(element, nodes.substitution_definition):
+            for name in element['names']:
+                document.note_substitution_def(element, name)
+        elif isinstance(element, nodes.footnote):
+            if element.get('auto') == '*':
+                document.note_symbol_footnote(element)
+            elif element.get('auto'):
+                document.note_autofootnote(element)
+            else:
+                document.note_footnote(element)
+            if element['names']:
+                document.note_explicit_target(element)
+            else:
+                document.set_id(element)
+        elif isinstance(element, nodes.citation):
+            document.note_citation(element)
+            document.note_explicit_target(element)
+        elif isinstance(element, nodes.target) and element.get('anonymous'):
+            document.note_anonymous_target(element)
+        elif isinstance(element, nodes.footnote_reference):
+            if element.get('auto') == '*':
+                document.note_symbol_footnote_ref(element)
+            elif element.get('auto'):
+                document.note_autofootnote_ref(element)
+            if element.get('refname'):
+                document.note_footnote_ref(element)
+        elif isinstance(element, nodes.citation_reference):
+            document.note_citation_ref(element)
+        elif isinstance(element, nodes.substitution_reference):
+            document.note_substitution_ref(element, element['refname'])
+        else:
+            if element['ids'] or element['names']:
+                if isinstance(element, nodes.target):
+                    document.note_explicit_target(element)
+                else:
+                    document.note_implicit_target(element)
+            if isinstance(element, nodes.Referential) and 'refname' in element:
+                document.note_refname(element)
+    # Other elements with ids, like system messages, and the references to
+    # the parsed ids
+    renamed = {}
+    for element in elements:
+        if id(element) in parsed_ids:
+            if not element['ids']:
+                document.set_id(element)
+            for parsed_id in parsed_ids[id(element)]:
+                renamed[parsed_id] = element['ids'][0]
+    for element in elements:
+        if element.get('refid') in renamed:
+            element['refid'] = renamed[element['refid']]
+        if element.get('backrefs'):
+            element['backrefs'] = [ renamed.get(backref, backref)
+                for backref in element['backrefs'] ]
+
+def resolve_includes(document, depth=8):
+    """
+    Replace the include nodes in `document` by the nodes of the included
+    source, also those of nested includes up to `depth` levels.
+    """
+    for level in range(depth):
+        includes = nodeindex.nodes_of(document, include)
+        if not includes:
+            return
+        for node in includes:
+            try:
+                children = included.get(node, document.settings)
+            except (IOError, OSError, ValueError), e:
+                node.replace_self(document.reporter.error(
+                    'Cannot include %s: %s' % (node['refuri'], e),
+                    base_node=node))
+                continue
+            note_included(document, children)
+            node.replace_self(children)
+    if nodeindex.nodes_of(document, include):
+        document.reporter.error('Includes nested more than %i levels deep'
+                % depth)
+
+@contextmanager
+def include_directive(settings):
+    """
+    Parse with the dotmpe include directive in place of the standard one,
+    if the ``include_nodes`` setting is given.
+    """
+    if not getattr(settings, 'include_nodes', False):
+        yield
+        return
+    from dotmpe.du.ext.parser.rst.directive.include import Include
+    previous = directives._directives.get('include')
+    directives.register_directive('include', Include)
+    try:
+        yield
+    finally:
+        if previous is None:
+            del directives._directives['include']
+        else:
+            directives._directives['include'] = previous
+
+
+class IncludeDoctree(Transform):
+
+    """
+    Include nodes in doctree, resolves <include /> nodes.
+    TODO: Optionally rewrite relative reference.
+    """
+
+    settings_spec = (
+            (
+                'Parse include directives to include nodes, and insert the '
+                'included sources from a cache of parsed includes. '
+                'Requires file insertion to be enabled. ',
+                ['--include-nodes'],
+                {'action':'store_true', 'default':False}
+            ),)
+
+    default_priority = 150
+    "Before the substitutions and references are resolved. "
+
+    def apply(self):
+        if not nodeindex.nodes_of(self.document, include):
+            return
+        if not self.document.settings.file_insertion_enabled:
+            for node in nodeindex.nodes_of(self.document, include):
+                node.replace_self(self.document.reporter.warning(
+                    '"include" directive disabled.', base_node=node))
+            return
+        resolve_includes(self.document)
+
+
+class RecordDependencies(Transform):
+
+    "Record the source of each include node as a dependency. "
+
+    settings_spec = ()
+
+    default_priority = 500
+
+    def apply(self):
+        rv = DependenciesVisitor(self.document)
+        rv.apply()
+
+
+class DependenciesVisitor(nodes.SparseNodeVisitor):
+
+    def apply(self):
+        self.document.walkabout(self)
 
+    def visit_include(self, node):
+        dependencies = getattr(self.document.settings,
+                'record_dependencies', None)
+        if dependencies:
+            dependencies.add(node['refuri'])
 
+    def depart_include(self, node):
+        pass
@@ -9,6 +9,7 @@ from docutils import transforms, nodes
 import sqlite3
 
 from dotmpe.du import util
+from dotmpe.du.nodeindex import nodes_of
 from dotmpe.du.ext.extractor import logbook
 
 
@@ -29,7 +30,7 @@ class LogBook(transforms.Transform):
         store = logbook.Storage(None, connection)
         logger.debug(store)
 
-        terms = doc.traverse(nodes.term)
+        terms = nodes_of(doc, nodes.term)
         for e in terms:
             tags = e.astext().split(' ')
             logger.warn(e)
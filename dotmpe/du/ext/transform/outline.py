@@ -22,12 +22,17 @@ Usage with .mpe Reader::
 """
 from __future__ import print_function
 
+import atexit
+import sqlite3
 import sys
 
 from docutils import transforms, nodes
 import nabu.extract
 from nabu.extract import ExtractorStorage
 from dotmpe.du import util
+from dotmpe.du.frozen import id_of, text_of
+from dotmpe.du.ext.extractor import SQLiteExtractorStorage
+from dotmpe.du.ext.transform import digest
 
 
 #class RecordOutline(nabu.extract.Extractor): XXX: spec is different
@@ -57,6 +62,10 @@ class RecordOutline(transforms.Transform):
     XXX: set other types for value: date, URL, path, attributes.. metadata, can
     get too complicated to be practical
 
+    Given an OutlineStorage (or --outline-digests) the digest of each outline
+    node is compared with the previous run for the document, and the
+    OutlineDiff is set as `document.outline_diff` so that extractors running
+    later can limit themselves to the added, changed and removed subtrees.
     """
 
     settings_spec = (
@@ -83,6 +92,11 @@ class RecordOutline(transforms.Transform):
         ), (
             'Dont run outline extractor, even if file/dbref is given. ',
             ['--no-outline-record'], { 'dest': 'record_outline', 'action': 'store_false' }
+        ), (
+            'Keep digests of outline nodes in SQLite database FILE, and diff '
+            'with the previous run of the same document. ',
+            ['--outline-digests'],
+            {'default':None, 'metavar':'FILE' }
         ),
     )
 
@@ -92,14 +106,41 @@ class RecordOutline(transforms.Transform):
         doc = self.document
         g = doc.settings
 
-        if not getattr(g, 'record_outline', None):
+        if not isinstance(storage, OutlineStorage):
+            storage = None
+            if getattr(g, 'outline_digests', None):
+                storage = digest_storage(g.outline_digests)
+
+        if not getattr(g, 'record_outline', None) and not storage:
             return
 
         v = OutlineVisitor(doc, g.outline_schema_terms)
         doc.walk(v)
         self.outline = v.terms
 
-        self.write_outline(f)
+        if storage:
+            self.diff_outline(storage, unid or doc.get('source'))
+
+        if getattr(g, 'record_outline', None):
+            self.write_outline(f)
+
+    def diff_outline(self, storage, unid):
+        """
+        Diff the outline node digests with those stored for `unid`, update
+        the storage and set the OutlineDiff as `outline_diff` on the document
+        for the extractors that follow.
+        """
+        g = self.document.settings
+        digest.subtree_digest(self.document)
+        containers = {}
+        for term in self.outline:
+            path = "/".join(util.node_idspath(term, g))
+            containers.setdefault(path, term.parent)
+        diff = OutlineDiff(storage.digests(unid), containers)
+        storage.update(unid, diff)
+        self.document.outline_diff = diff
+        self.document.outline_storage = storage
+        return diff
 
     def write_outline(self, f=None):
         g = self.document.settings
@@ -168,10 +209,141 @@ class OutlineVisitor(nodes.NodeVisitor):
     def _mark_outline_node(self, node):
         nt = node.__class__.__name__
         if nt in self.term_type:
-            node_id = nodes.make_id(node.astext())
+            node_id = id_of(node)
+            if not node_id:
+                # make_id drops leading digits, e.g. of date titles
+                node_id = nodes.make_id('outline-' + text_of(node))
             assert 'ids' in node.attributes, 'TOTEST'
             if node_id not in node.attributes['ids']:
                 node.attributes['ids'].append(node_id)
             self.terms.append(node)
             node['outline-label'] = True
             node.parent['node-for'] = node_id
+
+
+def outline_path(node, settings=None):
+    """
+    Return the path of outline node `node` (the container of a term) as used
+    by OutlineDiff, or None if it is not an outline node.
+    """
+    if not node.get('node-for'):
+        return None
+    return "/".join(util.node_idspath(node, settings) + [node['node-for']])
+
+
+class OutlineDiff(object):
+
+    """
+    Paths of the outline nodes (the containers of the terms) that were added,
+    changed or removed compared to the previous digests. As digests include
+    those of all descendants, the ancestors of a changed node are changed too.
+    """
+
+    def __init__(self, previous, containers):
+        self.nodes = containers
+        "Path to outline node. "
+        self.digests = dict([ (path, node.digest)
+            for path, node in containers.items() ])
+        self.added = sorted([ path for path in self.digests
+            if path not in previous ])
+        self.changed = sorted([ path for path in self.digests
+            if path in previous and previous[path] != self.digests[path] ])
+        self.removed = sorted([ path for path in previous
+            if path not in self.digests ])
+        self.subtree_ids = None
+
+    def __nonzero__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def subtrees(self):
+        """
+        Return the outermost added or changed outline nodes, ie. skip those
+        within an other node in the list.
+        """
+        paths = sorted(self.added + self.changed)
+        outer = []
+        for path in paths:
+            if outer and path.startswith(outer[-1] + '/'):
+                continue
+            outer.append(path)
+        return [ self.nodes[path] for path in outer ]
+
+    def is_unchanged(self, node):
+        "Return wether `node` is not within an added or changed subtree. "
+        if self.subtree_ids is None:
+            self.subtree_ids = set([ id(n) for n in self.subtrees() ])
+        while node is not None:
+            if id(node) in self.subtree_ids:
+                return False
+            node = node.parent
+        return True
+
+
+class OutlineStorage(SQLiteExtractorStorage):
+
+    """
+    Digests of the outline nodes per document.
+    """
+
+    sql_relations_unid = [
+        ('outline_digest', 'TABLE', """
+            CREATE TABLE outline_digest (
+                unid VARCHAR NOT NULL,
+                path VARCHAR NOT NULL,
+                digest CHAR(40) NOT NULL,
+                PRIMARY KEY (unid, path)
+            )
+        """),
+    ]
+
+    def digests(self, unid):
+        cursor = self.connection.execute("SELECT path, digest "
+                "FROM outline_digest WHERE unid = ?", (unid,))
+        return dict(cursor.fetchall())
+
+    def update(self, unid, diff):
+        "Write only the rows for added, changed and removed paths. "
+        self.connection.executemany("DELETE FROM outline_digest "
+                "WHERE unid = ? AND path = ?",
+                [ (unid, path) for path in diff.removed ])
+        self.connection.executemany("INSERT OR REPLACE INTO outline_digest "
+                "(unid, path, digest) VALUES (?, ?, ?)",
+                [ (unid, path, diff.digests[path])
+                    for path in diff.added + diff.changed ])
+
+    def store(self, unid, diff):
+        self.update(unid, diff)
+
+
+digest_storages = {}
+"Outline storages by --outline-digests path, one connection per process. "
+
+def digest_storage(path):
+    "Return the outline storage for the database at `path`. "
+    if path not in digest_storages:
+        digest_storages[path] = OutlineStorage(sqlite3, sqlite3.connect(path))
+    return digest_storages[path]
+
+def finish_outline_diff(document, success=True):
+    """
+    Commit the digests stored for `document` once the extractors that use
+    its outline diff succeeded, or roll them back so that the next run diffs
+    the document again.
+    """
+    storage = getattr(document, 'outline_storage', None)
+    if storage is None:
+        return
+    if success:
+        storage.connection.commit()
+    else:
+        storage.connection.rollback()
+    document.outline_storage = None
+
+def close_digest_storages():
+    "Commit pending digests and close the connections. "
+    for storage in digest_storages.values():
+        storage.connection.commit()
+        storage.connection.close()
+    digest_storages.clear()
+
+atexit.register(close_digest_storages)
@@ -9,6 +9,10 @@ Usage with .mpe Reader::
 
 """
 from __future__ import print_function
+import bisect
+import re
+import zlib
+from array import array
 
 from docutils import transforms, nodes
 from dotmpe.du import util
@@ -41,6 +45,30 @@ class RecordRanges(transforms.Transform):
         doc.walk(v)
 
 
+class SettleRanges(transforms.Transform):
+
+    """
+    Record the `digests` of the elements, and the element children of each,
+    once the other transforms ran (in rSt patch mode only, see
+    `dotmpe.du.ext.writer.rst.RstPatcher`). Nodes the transforms created or
+    changed still correspond to the source at that point, as long as they
+    do not change after.
+    """
+
+    default_priority = 995
+
+    def apply(self):
+        document = self.document
+        if getattr(document, 'ranges', None) is None or getattr(
+                document.settings, 'rst_mode', 'full') != 'patch':
+            return
+        settled = digests(document)
+        for node in document.traverse(nodes.Element):
+            node.settled = settled[id(node)]
+            node.settled_children = [ child for child in node.children
+                    if isinstance(child, nodes.Element) ]
+
+
 class DspVisitor(nodes.NodeVisitor):
 
     def __init__(self, doc, term_type):
@@ -51,10 +79,378 @@ class DspVisitor(nodes.NodeVisitor):
         self._mark_dsp(node)
 
     def _mark_dsp(self, node):
-        if isinstance(node, nodes.Node) and node.line:
+        span = isinstance(node, nodes.Element) and get_range(node)
+        if span:
+            node.attributes['line'] = span[0] + 1
+        elif isinstance(node, nodes.Node) and node.line:
             #print(node.line, util.node_nodepath(node))
             if isinstance(node, nodes.Element):
                 node.attributes['line'] = node.line
         else:
             pass #print('-', util.node_nodepath(node))
 
+
+
+def mark_dirty(node):
+    """
+    Mark node as modified after parsing. Transforms that change the content
+    of a document call this, so that writers can tell which parts of the tree
+    no longer correspond to the source text.
+    """
+    if isinstance(node, nodes.Text):
+        node = node.parent
+    node.dirty = True
+
+def dirty_nodes(document):
+    """
+    Return the set of ids (``id(node)``) of dirty nodes and their ancestors.
+    """
+    dirty = set()
+    for node in document.traverse(lambda n: getattr(n, 'dirty', False)):
+        while node is not None and id(node) not in dirty:
+            dirty.add(id(node))
+            node = node.parent
+    return dirty
+
+adornment = re.compile(r'^([!-/:-@\[-`{-~])\1*$')
+
+def section_start(section, lines, source=None):
+    """
+    Return the index into `lines` of the first line of `section`, ie. the
+    title or its overline. Or None if the section title line does not
+    correspond to the source.
+
+    Du sets the line of a title to that of its underline.
+    """
+    if not len(section) or not isinstance(section[0], nodes.title):
+        return
+    title = section[0]
+    if not title.line or (source and title.source and title.source != source):
+        return
+    underline = title.line - 1
+    idx = underline - 1
+    if idx < 0 or underline >= len(lines):
+        return
+    if lines[idx].strip() != title.rawsource.strip():
+        return
+    if not adornment.match(lines[underline].strip()):
+        return
+    if idx > 0 and lines[idx-1].rstrip() == lines[underline].rstrip():
+        return idx - 1
+    return idx
+
+def node_line(node, source=None):
+    """
+    Return the line of node, or the first line of its descendants. Only
+    nodes from `source` are considered, if given.
+    """
+    if node.line and (not source or node.source in (None, source)):
+        return node.line
+    lines = [ n.line for n in node.traverse(include_self=False)
+        if getattr(n, 'line', None) and (
+            not source or n.source in (None, source)) ]
+    if lines:
+        return min(lines)
+
+def block_start(node, lines, lo=0, hi=None, source=None):
+    """
+    Return the index into `lines` of the first line of a block-level node, or
+    None if the node has no line. This is the start of the blank-line
+    separated block at the line of the node, since Du does not set the line
+    of all nodes to their first line.
+    """
+    line = node_line(node, source)
+    if not line:
+        return
+    if hi is None:
+        hi = len(lines)
+    idx = min(line - 1, hi - 1)
+    while idx > lo and not lines[idx].strip():
+        idx -= 1
+    while idx > lo and lines[idx-1].strip() and \
+            not explicit_markup(lines[idx]):
+        idx -= 1
+    return idx
+
+explicit_markup = re.compile(r'^\.\.(\s|$)').match
+"Explicit markup blocks need not be separated by a blank line. "
+
+
+class RangeTable(object):
+
+    """
+    Source ranges of the elements of a parsed document, as columns of
+    integers indexed by the serial the parser gave each element (the
+    ``serial`` attribute, in document order). Columns are the first line
+    index, the line index after the last, and the character offsets of the
+    start and end. Unknown values are -1.
+
+    To tell if a subtree changed after parsing, the table also has the serial
+    after the last descendant of each element, and the `checksum` of the text
+    of each text element that is not within another one.
+
+    Parsers set the table as `document.ranges`, see `record_ranges`. Nodes
+    created later have no serial and no range.
+    """
+
+    columns = ('line', 'end_line', 'offset', 'end_offset', 'end_serial',
+            'checksum')
+
+    def __init__(self, size=0):
+        for column in self.columns:
+            setattr(self, column, array('i', [-1]) * size)
+
+    def __len__(self):
+        return len(self.line)
+
+    def get(self, node):
+        """
+        Return line, end_line, offset and end_offset for node, or None.
+        """
+        serial = getattr(node, 'serial', None)
+        if serial is None or serial >= len(self.line) \
+                or self.line[serial] < 0:
+            return
+        return (self.line[serial], self.end_line[serial],
+                self.offset[serial], self.end_offset[serial])
+
+    def set(self, serial, line, end_line, offset, end_offset):
+        self.line[serial] = line
+        self.end_line[serial] = end_line
+        self.offset[serial] = offset
+        self.end_offset[serial] = end_offset
+
+
+def checksum(node):
+    "Return the CRC-32 of the text of node. "
+    return zlib.crc32(node.astext().encode('utf-8'))
+
+def digests(node, result=None):
+    """
+    Return the CRC-32 of the tag names, attributes and text of the subtree
+    of each element in the subtree of `node`, by ``id(element)``.
+    """
+    if result is None:
+        result = {}
+    crc = zlib.crc32(repr((node.tagname, node.attlist())))
+    for child in node.children:
+        if isinstance(child, nodes.Element):
+            digests(child, result)
+            crc = zlib.crc32(str(result[id(child)]), crc)
+        else:
+            crc = zlib.crc32(child.encode('utf-8'), crc)
+    result[id(node)] = crc
+    return result
+
+def get_range(node):
+    "Return the source range of node from its document's RangeTable. "
+    document = node.document
+    if document is None:
+        document = node
+        while document.parent is not None:
+            document = document.parent
+    table = getattr(document, 'ranges', None)
+    if table is not None:
+        return table.get(node)
+
+line_elements = (nodes.paragraph, nodes.field_list, nodes.field,
+        nodes.bullet_list, nodes.enumerated_list, nodes.line_block, nodes.line,
+        nodes.target, nodes.footnote, nodes.citation, nodes.literal_block,
+        nodes.doctest_block, nodes.substitution_definition)
+"Elements the rSt parser gives the line they start at. "
+
+scanned_elements = (nodes.table, nodes.comment)
+"Elements that start at the beginning of the block around their line. "
+
+directive = re.compile(r'\s*\.\.\s+[-\w.:+]+::(\s|$)').match
+"The first line of a directive. "
+
+empty_comment = re.compile(r'\s*\.\.\s*$').match
+"An empty comment, that ends the preceding block. "
+
+table_border = re.compile(r'\s*(\+-[-+]+\+|=+( +=+)+)\s*$')
+"Top border of a grid or simple table. "
+
+body_elements = (nodes.field_body, nodes.definition, nodes.description)
+"Elements that start with their first child, after the term or marker. "
+
+def record_ranges(document, inputstring):
+    """
+    Number the elements of a freshly parsed document and set a RangeTable
+    with their ranges in `inputstring` as `document.ranges`.
+
+    Block-level elements start at their line, or at that of their first
+    child, and end before the next sibling. Elements without a line and
+    inline elements are located by their rawsource within their parent.
+    """
+    lines = inputstring.splitlines(True)
+    starts = array('i', [0])
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+    elements = document.traverse(nodes.Element)
+    for serial, node in enumerate(elements):
+        node.serial = serial
+    table = RangeTable(len(elements))
+    document.ranges = table
+    for node in reversed(elements):
+        children = [ child for child in node.children
+                if isinstance(child, nodes.Element) ]
+        if children:
+            table.end_serial[node.serial] = table.end_serial[children[-1].serial]
+        else:
+            table.end_serial[node.serial] = node.serial + 1
+        if isinstance(node, nodes.TextElement) and \
+                not isinstance(node.parent, nodes.TextElement):
+            table.checksum[node.serial] = checksum(node)
+
+    source = document.get('source')
+
+    def line_of(offset):
+        return bisect.bisect_right(starts, offset) - 1
+
+    def find(node, offset, end_offset):
+        "Find the first line of the rawsource of node, return the offset. "
+        raw = node.rawsource.strip().split('\n')[0].strip()
+        if raw:
+            found = inputstring.find(raw, offset, end_offset)
+            if found >= 0:
+                return found
+
+    def included(node):
+        return node.source and node.source != source
+
+    def start_line(node, lo, hi, offset):
+        if included(node):
+            return
+        if isinstance(node, nodes.section):
+            return section_start(node, lines)
+        if node.line and node.line <= len(lines) and \
+                isinstance(node, nodes.literal_block):
+            # Include a literal block marker on a line of its own
+            start = node.line - 1
+            while start > lo and not lines[start-1].strip():
+                start -= 1
+            if start > lo and lines[start-1].strip() == '::':
+                return start - 1
+            return node.line - 1
+        if node.line and isinstance(node, line_elements):
+            return node.line - 1
+        if isinstance(node, nodes.comment) and not node.line \
+                and not node.rawsource:
+            for start in range(lo, hi):
+                if empty_comment(lines[start]):
+                    return start
+            return
+        if isinstance(node, nodes.definition_list_item):
+            definition = node[-1]
+            if definition.children:
+                start = start_line(definition[0], lo, hi, offset)
+                if start is not None:
+                    return start - 1 # XXX: single-line term
+            node = node[0]
+        if isinstance(node, nodes.TextElement):
+            found = find(node, offset, starts[hi])
+            if found is not None:
+                return line_of(found)
+            return
+        if node.line and isinstance(node, scanned_elements):
+            return block_start(node, lines, lo, hi)
+        if isinstance(node, nodes.table):
+            for start in range(lo, hi):
+                if table_border.match(lines[start]) and (
+                        start == 0 or not lines[start-1].strip()):
+                    return start
+            return
+        for child in node.children:
+            if isinstance(child, nodes.Element):
+                start = start_line(child, lo, hi, offset)
+                if start is None:
+                    continue
+                if isinstance(node, scanned_elements):
+                    start = block_start(node, lines, lo, start + 1)
+                return start
+
+    def directive_start(start, lo, parent_line):
+        """
+        Return the line of the directive if lines[start] is (indented) content
+        of one, other than the directive of the parent itself.
+        """
+        indent = len(lines[start]) - len(lines[start].lstrip())
+        if not indent:
+            return start
+        for idx in range(start - 1, lo - 1, -1):
+            text = lines[idx]
+            if text.strip() and len(text) - len(text.lstrip()) < indent:
+                if idx > parent_line and directive(text):
+                    return idx
+                break
+        return start
+
+    def record_inline(node, offset, end_offset):
+        cursor = offset
+        for child in node.children:
+            if not isinstance(child, nodes.Element) or not child.rawsource:
+                continue
+            found = inputstring.find(child.rawsource, cursor, end_offset)
+            if found < 0:
+                continue
+            cursor = found + len(child.rawsource)
+            table.set(child.serial, line_of(found), line_of(cursor - 1) + 1,
+                    found, cursor)
+            record_inline(child, found, cursor)
+
+    def record_block(node, line, end_line, offset=None):
+        while end_line > line + 1 and not lines[end_line-1].strip():
+            end_line -= 1
+        if end_line <= line:
+            return
+        end_offset = starts[end_line-1] + len(lines[end_line-1].rstrip())
+        if offset is None and isinstance(node, nodes.TextElement):
+            offset = find(node, starts[line], end_offset)
+        if offset is None:
+            offset = starts[line] + len(lines[line]) - len(lines[line].lstrip())
+        table.set(node.serial, line, end_line, offset, end_offset)
+        if isinstance(node, nodes.TextElement):
+            record_inline(node, offset, end_offset)
+            return
+        blocks, cursor = [], offset
+        for child in node.children:
+            if not isinstance(child, nodes.Element):
+                continue
+            child_offset = None
+            if isinstance(child, nodes.title) and \
+                    isinstance(node, nodes.section):
+                start = line
+            else:
+                start = start_line(child, blocks and blocks[-1][1] + 1 or line,
+                        end_line, cursor)
+            if start is None and child.rawsource and not included(child):
+                child_offset = find(child, cursor, end_offset)
+                if child_offset is not None:
+                    start = line_of(child_offset)
+            elif start is not None and line < start < end_line:
+                # lines after an include are numbered from the included
+                # source on, check the bounds before looking at the line
+                start = directive_start(start,
+                        blocks and blocks[-1][1] + 1 or line,
+                        isinstance(node, (nodes.document, nodes.section))
+                            and line - 1 or line)
+            if start is None or start < line or start >= end_line or (
+                    blocks and start < blocks[-1][1]):
+                continue
+            blocks.append((child, start, child_offset))
+            cursor = max(cursor, (child_offset or starts[start]) + 1)
+        for i, (child, start, child_offset) in enumerate(blocks):
+            if isinstance(child, nodes.title) and child.line:
+                end = min(child.line, end_line)
+            elif i + 1 < len(blocks):
+                end = max(blocks[i+1][1], start + 1)
+            else:
+                end = end_line
+            record_block(child, start, end, child_offset)
+        if blocks and isinstance(node, body_elements):
+            first = table.get(blocks[0][0])
+            if first:
+                table.offset[node.serial] = first[2]
+
+    record_block(document, 0, len(lines))
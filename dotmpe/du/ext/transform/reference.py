@@ -27,6 +27,7 @@ import socket
 import uriref
 from docutils import transforms, nodes
 from dotmpe.du import mpe_du_util as util
+from dotmpe.du.nodeindex import nodes_of
 
 
 logger = util.get_log(__name__, fout=False)
@@ -185,7 +186,7 @@ class RecordReferences(SimpleRefParser, transforms.Transform):
             ref_tags = [ getattr(nodes, t) for t in self.types ]
 
             for ref_type in ref_tags:
-                for ref_node in self.document.traverse(ref_type):
+                for ref_node in nodes_of(self.document, ref_type):
                     ref = self._parse_link(ref_type, ref_node, g)
                     if ref:
                         self._record_reference(ref_type, ref, ref_node)
@@ -11,6 +11,7 @@ That is what the UserSettings transform does.
 import logging
 from docutils import transforms, nodes
 from dotmpe.du import mpe_du_util as util
+from dotmpe.du.nodeindex import nodes_of
 
 
 class UserSettings(transforms.Transform):
@@ -138,7 +139,7 @@ class UserSettings(transforms.Transform):
                 setattr(settings, normedid, value)
 
     def candidate_field_lists(self):
-        return self.document.traverse(nodes.field_list)
+        return nodes_of(self.document, nodes.field_list)
 
     # XXX: cleanup
         "Returns at most five lists, from header, margin left/right, footer "
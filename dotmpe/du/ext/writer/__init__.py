@@ -4,3 +4,4 @@ from dotmpe.du import comp
 # register all local modules with tag 'mpe' as Writer type
 comp.register_extension_components(__name__, 'mpe', 'Writer', __file__)
 
+comp.writers['xhtml-flat'] = __name__ + '.xhtmlflat'
@@ -3,9 +3,16 @@
 Copyleft 2009  Berend van Berkum <dev@dotmpe.com>
 This file has been placed in the Public Domain.
 """
+import anydbm
 import os
-from docutils import utils, nodes, frontend, io
+import urllib
+from docutils import utils, nodes, frontend
+from docutils.utils.error_reporting import SafeString
 from docutils.writers import html4css1
+from dotmpe.du import imagesize
+from dotmpe.du.assets import AssetCache, assets
+from dotmpe.du.ext.parser.rst.directive import CacheSettings
+from dotmpe.du.ext.transform import digest
 
 
 MIME_HTML = 'text/html'
@@ -38,26 +45,104 @@ class HTMLTranslator(html4css1.HTMLTranslator):
     script_link = '<script src="%s" type="text/javascript"></script>\n'
     embedded_script = '<script type="text/css">\n\n%s\n</script>\n'
 
+    side_effect_attributes = ('head_prefix', 'head', 'stylesheet',
+            'body_prefix', 'body_pre_docinfo', 'docinfo', 'body_suffix',
+            'title', 'subtitle', 'header', 'footer', 'meta', 'math_header',
+            'left_margin', 'right_margin')
+    "Output parts other than body, that a cached section may not extend. "
+
     def __init__(self, document):
         html4css1.HTMLTranslator.__init__(self, document)
         self.left_margin = []
         self.right_margin = []
+        self.section_cache = None
+        "Database with the HTML of top-level sections, see --section-cache. "
+        self.cached_section = None
+        "The section being rendered for the cache, its key and start. "
        
         settings = document.settings
+        if getattr(settings, 'section_cache', None):
+            # Digests set by earlier transforms may be stale by now
+            digest.subtree_digest(document)
+            self.section_cache = anydbm.open(settings.section_cache, 'c')
+            self.section_cache_key = digest.settings_digest(settings)
         scripts = get_script_list(settings)
         if settings.script_path and not(settings.embed_script):
             scripts = [utils.relative_path(settings._destination, script)
                       for script in scripts]
         if settings.embed_script:
-            # XXX: not tested
             settings.record_dependencies.add(*scripts)
-            self.script = [self.embedded_script %
-                io.FileInput(source_path=script, encoding='utf-8').read()
+            self.script = [assets.read(script, self.embedded_script)
                 for script in scripts]
         else: # link to scripts
             self.script = [self.script_link % self.encode(script)
                                for script in scripts]
 
+    def stylesheet_call(self, path):
+        """
+        Override: read embedded stylesheets from the asset cache.
+        """
+        if not self.settings.embed_stylesheet:
+            return html4css1.HTMLTranslator.stylesheet_call(self, path)
+        try:
+            content = assets.read(path, self.embedded_stylesheet)
+        except IOError, err:
+            msg = u"Cannot embed stylesheet '%s': %s." % (
+                            path, SafeString(err.strerror))
+            self.document.reporter.error(msg)
+            return '<--- %s --->\n' % msg
+        self.settings.record_dependencies.add(path)
+        return content
+
+    def side_effects(self):
+        return tuple([ len(getattr(self, attr))
+            for attr in self.side_effect_attributes ])
+
+    # Cached sections
+    def visit_section(self, node):
+        if self.section_cache is None \
+                or not isinstance(node.parent, nodes.document):
+            return html4css1.HTMLTranslator.visit_section(self, node)
+        key = '%s:%s' % (node.digest, self.section_cache_key)
+        if key in self.section_cache:
+            self.body.append(self.section_cache[key].decode('utf-8'))
+            raise nodes.SkipNode
+        self.cached_section = node, key, len(self.body), self.side_effects()
+        html4css1.HTMLTranslator.visit_section(self, node)
+
+    def depart_section(self, node):
+        html4css1.HTMLTranslator.depart_section(self, node)
+        if self.cached_section and self.cached_section[0] is node:
+            node, key, start, side_effects = self.cached_section
+            self.cached_section = None
+            # Do not cache sections that write outside of the body
+            if self.side_effects() == side_effects:
+                self.section_cache[key] = \
+                        ''.join(self.body[start:]).encode('utf-8')
+
+    def depart_document(self, node):
+        html4css1.HTMLTranslator.depart_document(self, node)
+        if self.section_cache is not None:
+            self.section_cache.close()
+            self.section_cache = None
+        imagesize.save()
+
+    def visit_image(self, node):
+        """
+        Override: get the size of scaled images from the image size cache,
+        instead of opening them with PIL.
+        """
+        if 'scale' in node and not ('width' in node and 'height' in node) \
+                and self.settings.file_insertion_enabled:
+            imagepath = urllib.url2pathname(node['uri'])
+            size = imagesize.image_size(imagepath, self.settings)
+            if size:
+                self.settings.record_dependencies.add(
+                    imagepath.replace('\\', '/'))
+                node.attributes.setdefault('width', '%dpx' % size[0])
+                node.attributes.setdefault('height', '%dpx' % size[1])
+        html4css1.HTMLTranslator.visit_image(self, node)
+
     # New visitors
     def visit_left_margin(self, node):
         self.context.append(len(self.body))
@@ -217,7 +302,13 @@ class Writer(html4css1.Writer):
           'Default: embed scripts.',
           ['--link-script'],
           {'dest': 'embed_script', 'action': 'store_false'}),
-      ))
+
+         ('Cache the HTML of top-level sections in database <file>, by '
+          'section digest and writer settings, and reuse it for unchanged '
+          'sections. ',
+          ['--section-cache'],
+          { 'metavar': '<file>' }),
+      )) + CacheSettings.settings_spec
 
     default_template = 'html-template.txt'
 
@@ -239,4 +330,9 @@ class Writer(html4css1.Writer):
         html4css1.Writer.__init__(self)
         self.translator_class = HTMLTranslator
 
+    def apply_template(self):
+        template = assets.read(self.document.settings.template)
+        subs = self.interpolation_dict()
+        return template % subs
+
 
@@ -3,9 +3,13 @@
 from docutils.writers import latex2e
 from docutils.writers.latex2e import PreambleCmds
 
+from dotmpe.du.ext.parser.rst.directive import CacheSettings
+
 
 class Writer(latex2e.Writer):
 
+    settings_spec = latex2e.Writer.settings_spec + CacheSettings.settings_spec
+
     def __init__(self):
         latex2e.Writer.__init__(self)
         self.translator_class = LaTeXTranslator
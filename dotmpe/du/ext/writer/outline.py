@@ -6,13 +6,20 @@ The first req,. is to get nested, identified containers out.
 Get the ID from the titles or term in the document.
 
 """
+import bisect
+import json
 import math
+import mmap
+import os
 import re
 import roman
+import sqlite3
+import struct
 from optparse import Values
 
-from docutils import nodes, writers
-from dotmpe.du.ext.writer.rst import ContextStack
+from docutils import io, languages, nodes, writers
+from dotmpe.du.ext.writer.rst import ContextStack, ContextList, StreamOutput
+from dotmpe.du.frozen import id_of, text_of
 
 
 __docformat__ = 'reStructuredText'
@@ -21,12 +28,22 @@ __docformat__ = 'reStructuredText'
 class Writer(writers.Writer):
 
     """
-    Writer for outlines
-    TODO: json formatting
+    Writer for outlines.
+
+    Formats:
+
+    json
+        The nested outline as one JSON object.
+    jsonl
+        One JSON record per outline node, written as it is found: id, parent
+        id, path, label, depth and line.
+    index
+        Binary table of outline paths and lines, sorted by path, to the
+        outline file (see OutlineIndex).
     """
 
     defaults = Values(dict(
-        #outline_format = 'json',
+        outline_format = 'json',
         outline_file = None
         #element = 'definition',
         #content = 'none',
@@ -47,20 +64,48 @@ class Writer(writers.Writer):
                 ['--outline'],
                 { 'default': defaults.outline_file, 'dest': 'outline_file', 'metavar': '<FILE>' }),
 
-            #( "Outline format, '%default' for now. ",
-            #    ['--format'],
-            #    { 'default': defaults.outline_format, 'dest': 'outline_format',
-            #        'metavar': '<FORMAT>' }),
+            ( "Outline format, 'json', 'jsonl' or 'index' (default: "
+                "%default). The index is written to the outline file only. ",
+                ['--outline-format'],
+                { 'default': defaults.outline_format, 'dest': 'outline_format',
+                    'choices': ['json', 'jsonl', 'index'],
+                    'metavar': '<FORMAT>' }),
         )
     )
 
+    stream = None
+
     def __init__(self):
         writers.Writer.__init__(self)
 
+    def write(self, document, destination):
+        """
+        Stream jsonl records to file destinations, if there is no outline
+        file. Returns None then, instead of the output.
+        """
+        if not isinstance(destination, io.FileOutput) \
+                or getattr(document.settings, 'outline_format', 'json') != 'jsonl' \
+                or getattr(document.settings, 'outline_file', None):
+            return writers.Writer.write(self, document, destination)
+        self.document = document
+        self.language = languages.get_language(
+            document.settings.language_code,
+            document.reporter)
+        self.destination = destination
+        self.stream = StreamOutput(destination)
+        try:
+            self.translate()
+        finally:
+            self.stream.close()
+            self.stream = None
+        return self.output
+
     def init_from_settings(self):
         settings = self.document.settings
         self.outline_file = getattr(settings, 'outline_file',
                 self.__class__.defaults.outline_file)
+        self.outline_format = getattr(settings, 'outline_format',
+                self.__class__.defaults.outline_format)
         #self.element = getattr(settings, 'element',
         #        self.__class__.defaults.element)
         #self.content = getattr(settings, 'content',
@@ -69,32 +114,78 @@ class Writer(writers.Writer):
     def translate(self):
         self.init_from_settings()
 
+        if self.outline_format == 'jsonl':
+            return self.translate_records()
+        elif self.outline_format == 'index':
+            return self.translate_index()
+
         visitor = OutlineExtractor(self.document)#, self.element, self.content)
         self.document.walkabout(visitor)
 
         self.data = visitor.data
 
-        import json
         self.output = json.dumps(visitor.data)
         if self.outline_file:
             open(self.outline_file, 'w+').write(self.output)
 
+    def translate_records(self):
+        "Write a JSON line per outline record as soon as it is found. "
+        if self.outline_file:
+            out = open(self.outline_file, 'w+')
+        else:
+            out = self.stream
+        lines = []
+        def emit(record):
+            line = json.dumps(record) + '\n'
+            if out:
+                out.write(line)
+            else:
+                lines.append(line)
+        visitor = OutlineExtractor(self.document, emit)
+        self.document.walkabout(visitor)
+        self.data = visitor.data
+        if self.outline_file:
+            out.close()
+            self.output = ''
+        elif out:
+            self.output = None
+        else:
+            self.output = ''.join(lines)
+
+    def translate_index(self):
+        "Write a sorted path, line index to the outline file. "
+        self.output = ''
+        if not self.outline_file:
+            self.document.reporter.error(
+                    'Outline index format requires an outline file. ')
+            return
+        entries = []
+        visitor = OutlineExtractor(self.document, lambda record:
+                entries.append((record['path'], record['line'] or 0)))
+        self.document.walkabout(visitor)
+        self.data = visitor.data
+        write_index(self.outline_file, entries)
+
 
 #class OutlineExtractor(nodes.NodeVisitor):
 class OutlineExtractor(nodes.SparseNodeVisitor):
 
-    def __init__(self, document):#, element, content):
+    def __init__(self, document, emit=None):#, element, content):
         nodes.NodeVisitor.__init__(self, document)
         self.data = { 'names': {} }
         "Dist-n-list struct for return JSON"
+        self.emit = emit
+        "Callback for each outline record, see depart_term. "
+        self.serial = 0
 
         # Initialize root context
         self.context = ContextStack(defaults={
             'data': self.data,
             'terms': {},
-            'path': [ document ],
+            'path': ContextList.from_sequence([ document ]),
             'element': {},
-            'outline_id': 'root'
+            'outline_id': 'root',
+            'record': None
         })
 
 
@@ -118,7 +209,7 @@ class OutlineExtractor(nodes.SparseNodeVisitor):
 
     def visit_definition_list_item(self, node):
         #print 'visit-dl-li', node.line, node
-        self.context.path = self.context.path + [ node ]
+        self.context.append('path', node)
         self.context.terms = {}
         self.context.data = {
                 'names': {}
@@ -128,9 +219,9 @@ class OutlineExtractor(nodes.SparseNodeVisitor):
         #print 'visit-dt', node.line, node
         ce = {
                 # FIXME: '_line': node.line always last line in dl tree?
-                '_label': node.astext()
+                '_label': text_of(node)
             }
-        ce['_id'] = nodes.make_id(ce['_label'])
+        ce['_id'] = id_of(node)
         self.context.element = ce
 
     def depart_term(self, node):
@@ -138,6 +229,22 @@ class OutlineExtractor(nodes.SparseNodeVisitor):
         del self.context.element
         self.context.outline_id = ce['_id']
         self.context.terms[ce['_id']] = ce
+        if self.emit:
+            self.emit_record(node, ce)
+
+    def emit_record(self, node, ce):
+        parent = self.context.record
+        self.serial += 1
+        record = {
+            'id': self.serial,
+            'parent': parent and parent['id'] or None,
+            'label': ce['_label'],
+            'path': parent and parent['path'] +'/'+ ce['_id'] or ce['_id'],
+            'depth': parent and parent['depth'] + 1 or 1,
+            'line': term_line(node.parent)
+        }
+        self.context.record = record
+        self.emit(record)
 
     def depart_definition_list_item(self, node):
 
@@ -155,6 +262,8 @@ class OutlineExtractor(nodes.SparseNodeVisitor):
 
         del self.context.path
         del self.context.outline_id
+        if self.emit:
+            del self.context.record
 
 
     def visit_definition(self, node):
@@ -178,6 +287,32 @@ class OutlineExtractor(nodes.SparseNodeVisitor):
         pass
 
 
+def term_line(item):
+    """
+    Return the line of the term of definition_list_item `item`, or None.
+    Du sets the line of the item and term to that following the list, so
+    instead take the line before the first block of the definition.
+    XXX: assumes single-line terms
+    """
+    definition = item[-1]
+    if isinstance(definition, nodes.definition) and definition.children:
+        line = first_line(definition[0])
+        if line:
+            return line - 1
+
+line_elements = (nodes.paragraph, nodes.literal_block, nodes.target,
+        nodes.field_list)
+"Elements with a reliable line attribute. "
+
+def first_line(node):
+    "Return the first line of body element `node`, or None. "
+    if isinstance(node, nodes.definition_list):
+        return term_line(node[0])
+    if isinstance(node, line_elements):
+        return node.line
+    if isinstance(node, nodes.Element) and node.children:
+        return first_line(node[0])
+
 def is_parent(node1, node2):
     supnode = node2
     while supnode.parent:
@@ -186,3 +321,233 @@ def is_parent(node1, node2):
             return True
 
 
+
+
+index_magic = 'OUTLIDX1'
+index_header = struct.Struct('<8sI')
+"Magic and number of entries. "
+index_entry = struct.Struct('<III')
+"Key offset, key length and line for each entry. "
+
+def write_index(path, entries):
+    """
+    Write the (path, line) `entries` as outline index to file `path`. The
+    entries are sorted by path, and follow the header as fixed-size records
+    pointing into a blob with the UTF-8 encoded paths.
+    """
+    entries = sorted([ (p.encode('utf-8'), line) for p, line in entries ])
+    base = index_header.size + index_entry.size * len(entries)
+    table, offset = [], base
+    for key, line in entries:
+        table.append(index_entry.pack(offset, len(key), line))
+        offset += len(key)
+    out = open(path, 'wb')
+    try:
+        out.write(index_header.pack(index_magic, len(entries)))
+        out.write(''.join(table))
+        out.write(''.join([ key for key, line in entries ]))
+    finally:
+        out.close()
+
+
+class OutlineIndex(object):
+
+    """
+    Read an outline index (see write_index) through mmap. Lookups bisect the
+    sorted table, only the entries visited are decoded.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = index_header.unpack_from(self.map, 0)
+        if magic != index_magic:
+            raise ValueError("Not an outline index: %s" % path)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        "Return path and line of entry `i`. "
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.key(i).decode('utf-8'), self.line(i)
+
+    def entry(self, i):
+        return index_entry.unpack_from(self.map,
+                index_header.size + i * index_entry.size)
+
+    def key(self, i):
+        offset, length, line = self.entry(i)
+        return self.map[offset:offset+length]
+
+    def line(self, i):
+        return self.entry(i)[2]
+
+    def keys(self):
+        "Sequence view of the encoded paths, for bisect. "
+        return IndexKeys(self)
+
+    def find(self, path):
+        "Return the line of the first entry for `path`, or None. "
+        key = path.encode('utf-8')
+        i = bisect.bisect_left(self.keys(), key)
+        if i < self.count and self.key(i) == key:
+            return self.line(i)
+
+    def prefixed(self, prefix):
+        "Generate path and line for every path starting with `prefix`. "
+        key = prefix.encode('utf-8')
+        i = bisect.bisect_left(self.keys(), key)
+        while i < self.count and self.key(i).startswith(key):
+            yield self[i]
+            i += 1
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class IndexKeys(object):
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, i):
+        return self.index.key(i)
+
+
+class OutlineCorpus(object):
+
+    """
+    Persistent index of the outline paths of many documents, for prefix,
+    glob and term queries returning (document, line, path) hits.
+
+    Paths are kept in an SQLite table with B-tree indices on path and last
+    path element (term), so prefix queries are range scans over the sorted
+    paths. Documents are updated one at a time, and skipped if their mtime
+    and size did not change since the last update.
+    """
+
+    sql_relations = [
+        ('outline_documents', 'TABLE', """
+            CREATE TABLE outline_documents (
+                document TEXT PRIMARY KEY,
+                mtime REAL,
+                size INTEGER
+            )
+        """),
+        ('outline_paths', 'TABLE', """
+            CREATE TABLE outline_paths (
+                path TEXT,
+                term TEXT,
+                document TEXT,
+                line INTEGER
+            )
+        """),
+        ('outline_paths_path', 'INDEX', """
+            CREATE INDEX outline_paths_path ON outline_paths (path)
+        """),
+        ('outline_paths_term', 'INDEX', """
+            CREATE INDEX outline_paths_term ON outline_paths (term)
+        """),
+        ('outline_paths_document', 'INDEX', """
+            CREATE INDEX outline_paths_document ON outline_paths (document)
+        """),
+    ]
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        cursor = self.connection.cursor()
+        for name, type, schema in self.sql_relations:
+            cursor.execute("SELECT name FROM sqlite_master "
+                    "WHERE type = ? AND name = ?", (type.lower(), name))
+            if not cursor.fetchone():
+                cursor.execute(schema)
+        self.connection.commit()
+
+    def is_current(self, document, mtime, size):
+        cursor = self.connection.execute("SELECT mtime, size "
+                "FROM outline_documents WHERE document = ?", (document,))
+        return cursor.fetchone() == (mtime, size)
+
+    def update(self, document, entries, mtime=None, size=None):
+        "Replace the (path, line) entries for `document`. "
+        self.connection.execute("DELETE FROM outline_paths "
+                "WHERE document = ?", (document,))
+        self.connection.executemany("INSERT INTO outline_paths "
+                "(path, term, document, line) VALUES (?, ?, ?, ?)",
+            [ (path, path.split('/')[-1], document, line)
+                for path, line in entries ])
+        self.connection.execute("INSERT OR REPLACE INTO outline_documents "
+                "(document, mtime, size) VALUES (?, ?, ?)",
+                (document, mtime, size))
+        self.connection.commit()
+
+    def remove(self, document):
+        self.connection.execute("DELETE FROM outline_paths "
+                "WHERE document = ?", (document,))
+        self.connection.execute("DELETE FROM outline_documents "
+                "WHERE document = ?", (document,))
+        self.connection.commit()
+
+    def documents(self):
+        return [ row[0] for row in self.connection.execute(
+            "SELECT document FROM outline_documents ORDER BY document") ]
+
+    def query(self, where, *args):
+        return self.connection.execute("SELECT document, line, path "
+                "FROM outline_paths WHERE %s ORDER BY path, document, line"
+                    % where, args).fetchall()
+
+    def prefix(self, prefix):
+        "Return hits for paths starting with `prefix`. "
+        prefix = unicode(prefix)
+        return self.query("path >= ? AND path < ?", prefix, prefix + u'\uffff')
+
+    def glob(self, pattern):
+        "Return hits for paths matching glob `pattern` (`*`, `?`, `[...]`). "
+        pattern = unicode(pattern)
+        prefix = re.split(r'[*?\[]', pattern, 1)[0]
+        if prefix == pattern:
+            return self.query("path = ?", pattern)
+        return self.query("path >= ? AND path < ? AND path GLOB ?",
+                prefix, prefix + u'\uffff', pattern)
+
+    def term(self, term):
+        "Return hits for paths ending with (the ID for) `term`. "
+        return self.query("term = ?", nodes.make_id(term))
+
+    def close(self):
+        self.connection.close()
+
+
+def document_outline(path, settings_overrides={}):
+    "Parse rSt document at `path` and return its (path, line) entries. "
+    from docutils.core import publish_doctree
+    overrides = { 'report_level': 5, 'halt_level': 5 }
+    overrides.update(settings_overrides)
+    document = publish_doctree(open(path).read(), path,
+            settings_overrides=overrides)
+    entries = []
+    visitor = OutlineExtractor(document, lambda record:
+            entries.append((record['path'], record['line'])))
+    document.walkabout(visitor)
+    return entries
+
+def update_corpus(corpus, paths, outline=document_outline):
+    """
+    Update the outline corpus with the documents at `paths`, unless the
+    mtime and size are unchanged. Returns the list of updated paths.
+    """
+    updated = []
+    for path in paths:
+        stat = os.stat(path)
+        if corpus.is_current(path, stat.st_mtime, stat.st_size):
+            continue
+        corpus.update(path, outline(path), stat.st_mtime, stat.st_size)
+        updated.append(path)
+    return updated
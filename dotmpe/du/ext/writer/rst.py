@@ -7,11 +7,13 @@ XXX: This is a heavy work in progress. RstTranslator has some issues with
      There are no extra options at all, and not really a reader/parser to go
      with it yet.
 """
+import bisect
 import math
-import re
+import os
 import roman
 
-from docutils import nodes, writers
+from docutils import io, languages, nodes, utils, writers
+from dotmpe.du.ext.transform import ranges
 
 
 
@@ -23,35 +25,129 @@ class Writer(writers.Writer):
     """
     docutils Writer that writes a doc-tree 'back' to rSt.
     This implementation is lossy.
+
+    In 'patch' mode sections and blocks without nodes marked dirty (see
+    `dotmpe.du.ext.transform.ranges.mark_dirty`) are copied verbatim from the
+    source, and only the others are serialized again. See RstPatcher.
     """
 
     settings_spec = (
         'rST writer',
         None,
-        ()
+        ((
+            "Output mode, 'full' serializes the whole document, 'patch' "
+            "copies unchanged sections from the source (default: %default). ",
+            ['--rst-mode'],
+            {'choices': ['full', 'patch'], 'default': 'full',
+                'metavar': '<MODE>'}
+        ),(
+            "Do not stream full mode output to the destination file, but "
+            "translate the whole document before writing. ",
+            ['--no-rst-stream'],
+            {'action': 'store_false', 'dest': 'rst_stream', 'default': True}
+        ),)
     )
 
+    stream = None
+    "StreamOutput while writing to a file destination. "
+
     def __init__(self):
         writers.Writer.__init__(self)
 
+    def write(self, document, destination):
+        """
+        Translate and write `document` to `destination`. Unless disabled, full
+        mode output to a file is streamed: each top-level section is written
+        as soon as it is translated, and the output is not retained (None is
+        returned).
+        """
+        if not isinstance(destination, io.FileOutput) \
+                or not getattr(document.settings, 'rst_stream', True) \
+                or getattr(document.settings, 'rst_mode', 'full') == 'patch':
+            return writers.Writer.write(self, document, destination)
+        self.document = document
+        self.language = languages.get_language(
+            document.settings.language_code,
+            document.reporter)
+        self.destination = destination
+        self.stream = StreamOutput(destination)
+        try:
+            self.translate()
+        finally:
+            self.stream.close()
+            self.stream = None
+        return self.output
+
     def translate(self):
 
-        visitor = RstPreTranslator(self.document)
-        self.document.walkabout(visitor)
+        if getattr(self.document.settings, 'rst_mode', 'full') == 'patch':
+            source = self.get_source()
+            if source is not None:
+                output = RstPatcher(self.document, source).patch()
+                if output is not None:
+                    self.output = output
+                    return
+            self.document.reporter.info(
+                'Cannot patch source, writing full document. ')
 
-        visitor = RstTranslator(self.document, visitor)
+        visitor = RstTranslator(self.document, RstIndex(self.document))
+        if self.stream:
+            visitor.body.destination = self.stream
         self.document.walkabout(visitor)
 
-        self.output = visitor.astext()
+        if self.stream:
+            visitor.body.flush()
+            self.output = None
+        else:
+            self.output = visitor.astext()
+
+    def get_source(self):
+        """
+        Return the source text the document was read from, from the Reader
+        component or otherwise by reading the source file.
+        """
+        transformer = getattr(self.document, 'transformer', None)
+        if transformer:
+            reader = transformer.components.get('reader')
+            source = getattr(reader, 'input', None)
+            if isinstance(source, unicode):
+                return source
+        path = self.document.get('source')
+        if path and os.path.isfile(path):
+            return io.FileInput(source_path=path,
+                    encoding=self.document.settings.input_encoding).read()
 
 
 class AbstractTranslator(nodes.NodeVisitor):
     pass
 
+class RstIndex(object):
+
+    """
+    Reference indices for RstTranslator, collected from the document without
+    a full visitor pass. Build once per document and share between
+    translators (see RstPatcher).
+    """
+
+    __slots__ = ('id_references', 'uri_references', 'anonymous_references',
+            'targets')
+
+    def __init__(self, document):
+        self.id_references = {}
+        self.uri_references = {}
+        self.anonymous_references = {}
+        self.targets = {}
+        for node in document.traverse(nodes.reference):
+            refid = node.get('refid')
+            if refid:
+                self.id_references[refid] = node
+
+
 class RstPreTranslator(AbstractTranslator):
 
     """
     Pre-pass document visitor. Accumulates indices.
+    Deprecated, use RstIndex.
     """
 
     def __init__(self, document):
@@ -116,7 +212,7 @@ class RstTranslator(AbstractTranslator):
 
     def __init__(self, document, pretranslator):
         nodes.NodeVisitor.__init__(self, document)
-        # fetch indices from RstPreTranslator
+        # fetch indices from RstIndex or RstPreTranslator
         for attr in 'id_references', 'uri_references', 'anonymous_references':
             setattr(self, attr, getattr(pretranslator, attr))
 
@@ -132,8 +228,8 @@ class RstTranslator(AbstractTranslator):
         self.subtitle_adornment = None
         self.capture_text = None
         "Concatenate Text nodes onto `key` on context. "
-        self.body = []
-        "The list of document strings, to be concatenated to final file. "
+        self.body = OutputBuffer()
+        "The document strings, to be concatenated to final file. "
         self.anonymous_role_count = 0
 
         self.preserve_ws = False
@@ -143,7 +239,6 @@ class RstTranslator(AbstractTranslator):
         self.inline = False
         self.roles = []
         #self.docinfo = {}
-        self.body = []
         #self.targets = {}
         """Each stack level represents some node, but not all nodes need a
         stacklevel though we may end up with that.
@@ -152,7 +247,7 @@ class RstTranslator(AbstractTranslator):
         """
         self.context = ContextStack(defaults={
                 # a list of all the elements up to the level, though not all
-                'tree': [],
+                'tree': ContextList(),
                 'bullet': u'',
                 'indent': u'',
                 #'section_adornment': self.section_adornments[0],
@@ -170,35 +265,39 @@ class RstTranslator(AbstractTranslator):
         self.context.append('tree', node)
 
     def pop_tree(self):
-        if self.context.tree[-1].tagname in ('title', 'label'):
+        if self.context.tree.value.tagname in ('title', 'label'):
             self.force_block_level = True
         elif self.force_block_level:
             self.force_block_level = False
         del self.context.tree
 
+    block_parents = frozenset((
+            'document',
+            'section',
+            'footnote',
+            'list_item',
+            'definition',
+            'field_body'))
+    "Tagnames of the elements whose direct children are at block level. "
+
     @property
     def block_level(self):
         if self.force_block_level:
             return True
         if self.context.index:
             return False
-        if len(self.context.tree) < 2:
+        tree = self.context.tree
+        if tree.length < 2:
             return False
-        return self.context.tree[-2].tagname in (
-                'document',
-                'section',
-                'footnote',
-                'list_item',
-                'definition',
-                'field_body')
+        return tree.parent.value.tagname in self.block_parents
 
     @property
     def path(self):
-        return "/".join([n.tagname for n in self.context.tree])
+        return self.context.tree.tagpath
 
     @property
     def current_node(self):
-        return self.context.tree[-1]
+        return self.context.tree.value
 
     def in_tag(self, other_name=None, sup=0):
         node = self.current_node
@@ -232,7 +331,7 @@ class RstTranslator(AbstractTranslator):
         return node.parent.children[pi-1]
 
     def astext(self):
-        return "".join(self.body)
+        return self.body.astext()
 
         # TODO: handle all that support the class option, and others
         #classes = node.attributes['classes']
@@ -359,48 +458,29 @@ class RstTranslator(AbstractTranslator):
         self.indented = 0
 
     def last_string(self, length=1):
+        """
+        Return a marker for the last non-whitespace character written, and the
+        character itself. See `OutputBuffer.last_string`.
+        """
         assert length == 1
-        x = -1
-        bl = len(self.body)
-        while bl+x > -1:
-            y = -1
-            while len(self.body[x])+y > -1:
-                c = self.body[x][y]
-                if not c.isspace():
-                    return bl+x, len(self.body[x])+y, c
-                y -= 1
-            x -= 1
-        return -1, -1, None
+        return self.body.last_string()
 
     def insert(self, x, y, s):
         "Insert string in body text node."
-        text = self.body[x]
-        text = text[:y] +s+ text[y:]
-        self.body[x] = text
+        self.body.insert(x, y, s)
 
     @property
     def current_whitespace(self):
         "The bodies' trailing whitespace. "
         if not self.body:
             return
-        idx = len(self.body)-1
-        ws = ''
-        while idx > -1:
-            str_part = self.body[idx]
-            if str_part:
-                ws = get_trailing_ws(str_part) + ws
-            if str_part and not is_all_ws(str_part):
-                break
-            idx -= 1
-        ws2 = list(ws); ws2.reverse()
-        return ''.join(ws)
+        return self.body.trailing_ws
 
     def _assure_emptyline(self, cnt=1):
         if not self.body:
             return
-        ws = self.current_whitespace
-        newlines = re.sub(r'[^\n]', '', ws) # XXX: unix
-        while len(newlines) < cnt:
+        newlines = self.body.newlines
+        while newlines < cnt:
             self._write_newline()
             cnt -= 1
 
@@ -414,8 +494,7 @@ class RstTranslator(AbstractTranslator):
                     return
         if self.context.index == 0:
             return
-        ws = self.current_whitespace
-        newlines = len(re.sub(r'[^\n]', '', ws)) # XXX: unix
+        newlines = self.body.newlines
         if newlines < 1:
             self._write_newline()
         if newlines < 2:
@@ -534,6 +613,8 @@ class RstTranslator(AbstractTranslator):
         self._assure_emptyline()
         del self.context.index
         self.doclevel -= 1
+        if self.body.destination and isinstance(node.parent, nodes.document):
+            self.body.flush(self.body.marker[0])
 
     def visit_paragraph(self, node):
         #self.debugprint(self.context)
@@ -1045,7 +1126,7 @@ class RstTranslator(AbstractTranslator):
         self._assure_emptyline()
 
     def visit_transition(self, node):
-        while self.context.tree[-1].tagname not in ('section', 'document'):
+        while self.context.tree.value.tagname not in ('section', 'document'):
             self.pop_tree()
         if not self.block_level:
             self._assure_newblock()
@@ -1374,16 +1455,203 @@ class RstTranslator(AbstractTranslator):
         self.body.append("[du.rst:XXX:%s %r %r %r %s]" % (node.tagname, self.context.index,
             self.indented, self.context.indent, node['classes']))
 
-trailing_ws = re.compile('^.*(?<!\s)(\s+)$')
+class OutputBuffer(object):
+
+    """
+    Line-oriented output for RstTranslator.
+
+    Strings are appended as fragments, like to a list. The whitespace
+    trailing the output and the position of the last non-whitespace character
+    are tracked on append, so that the translator does not need to scan back
+    through its output to decide on line and block breaks.
+
+    Positions are markers (fragment serial, character offset) that stay valid
+    as long as the fragment is retained. If a `destination` (anything with a
+    ``write`` method) is given, fragments before the last non-whitespace one
+    are written out once more than `lookback` have accumulated.
+    """
+
+    lookback = 256
+    "Number of fragments retained before flushing to the destination. "
+
+    def __init__(self, destination=None, lookback=None):
+        self.destination = destination
+        if lookback is not None:
+            self.lookback = lookback
+        self.fragments = []
+        "The retained fragments. "
+        self.offset = 0
+        "The serial of the first retained fragment. "
+        self.trailing_ws = u''
+        "Whitespace at the end of the output. "
+        self.newlines = 0
+        "Number of newlines in the trailing whitespace. "
+        self.marker = -1, -1
+        "Serial and offset of the last non-whitespace character. "
+
+    def __len__(self):
+        return self.offset + len(self.fragments)
+
+    def append(self, text):
+        stripped = text.rstrip()
+        if stripped:
+            self.trailing_ws = text[len(stripped):]
+            self.newlines = self.trailing_ws.count('\n') # XXX: unix
+            self.marker = len(self), len(stripped)-1
+        else:
+            self.trailing_ws += text
+            self.newlines += text.count('\n')
+        self.fragments.append(text)
+        if self.destination and len(self.fragments) > self.lookback:
+            self.flush(self.marker[0])
+
+    def last_string(self):
+        """
+        Return serial and offset of the last non-whitespace character, and the
+        character. Or -1, -1 and None if there is none.
+        """
+        x, y = self.marker
+        if x < 0:
+            return -1, -1, None
+        return x, y, self.fragments[x-self.offset][y]
+
+    def insert(self, x, y, text):
+        "Insert text into fragment `x` at offset `y`. "
+        if x < self.offset:
+            raise IndexError("Cannot insert into flushed output (at %i, "
+                "retaining from %i)" % (x, self.offset))
+        fragment = self.fragments[x-self.offset]
+        self.fragments[x-self.offset] = fragment[:y] + text + fragment[y:]
+        if self.marker[0] == x and self.marker[1] >= y:
+            self.marker = x, self.marker[1] + len(text)
+
+    def flush(self, upto=None):
+        """
+        Write fragments up to serial `upto` (or all) to the destination.
+        """
+        if upto is None:
+            upto = len(self)
+        count = upto - self.offset
+        if count <= 0:
+            return
+        self.destination.write(''.join(self.fragments[:count]))
+        del self.fragments[:count]
+        self.offset = upto
+
+    def astext(self):
+        "Return the retained output. "
+        return ''.join(self.fragments)
+
+
+class StreamOutput(object):
+
+    """
+    Write text to a docutils FileOutput in parts. FileOutput closes (and on
+    reopening truncates) its file after every write, so this suspends
+    `autoclose` until `close` is called.
+    """
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.autoclose = destination.autoclose
+        destination.autoclose = False
+
+    def write(self, text):
+        if text:
+            self.destination.write(text)
+
+    def close(self):
+        self.destination.autoclose = self.autoclose
+        if self.autoclose and self.destination.opened:
+            self.destination.close()
+
+
+class ContextList(object):
+
+    """
+    Persistent list for ContextStack.append. Each instance is one item linked
+    to the list it was appended to, so appending and popping are O(1) and
+    the lists on the stack share their heads.
+
+    Supports len, iteration (first to last), indexing and concatenation with
+    a sequence. `tagpath` gives the tagnames of the items joined with '/',
+    which is cached per item.
+    """
+
+    __slots__ = ('value', 'parent', 'length', '_tagpath')
+
+    def __init__(self, value=None, parent=None):
+        self.value = value
+        self.parent = parent
+        self._tagpath = None
+        if parent is None:
+            self.length = 0
+        else:
+            self.length = parent.length + 1
+
+    def __len__(self):
+        return self.length
+
+    def __nonzero__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError(index)
+        item = self
+        for i in xrange(self.length - 1 - index):
+            item = item.parent
+        return item.value
+
+    def __iter__(self):
+        return iter(self.items())
+
+    def __add__(self, other):
+        item = self
+        for value in other:
+            item = ContextList(value, item)
+        return item
+
+    def items(self):
+        values = []
+        item = self
+        while item.length:
+            values.append(item.value)
+            item = item.parent
+        values.reverse()
+        return values
+
+    @property
+    def tagpath(self):
+        if self._tagpath is None:
+            if not self.length:
+                self._tagpath = ''
+            elif self.parent.length:
+                self._tagpath = self.parent.tagpath +'/'+ self.value.tagname
+            else:
+                self._tagpath = self.value.tagname
+        return self._tagpath
+
+    def __repr__(self):
+        return repr(self.items())
+
+    @classmethod
+    def from_sequence(clss, values):
+        return clss() + values
+
+
+class ContextFrame(object):
+
+    "One value on a ContextStack, linked to the value it shadows. "
 
-def get_trailing_ws(string):
-    assert isinstance(string, str) or isinstance(string, unicode), string
-    m = trailing_ws.match(string)
-    if m:
-        return m.group(1)
-    return ''
+    __slots__ = ('value', 'parent')
+
+    def __init__(self, value, parent):
+        self.value = value
+        self.parent = parent
 
-is_all_ws = re.compile('^\s+$').match
 
 class ContextStack(object):
     """A stack of states. Setting an attribute overwrites the last
@@ -1392,81 +1660,393 @@ class ContextStack(object):
 
     This is used for important states during output of rst,
     e.g. indent level, last bullet type.
+
+    Each name maps to its top ContextFrame, so getting, pushing and popping a
+    value is one dict operation. Lists grown with `append` are ContextLists.
     """
 
+    __slots__ = ('_defaults', '_stack')
+
     def __init__(self, defaults=None):
         '''Initialise _defaults and _stack, but avoid calling self.__setattr__'''
         if defaults is None:
-            self.replace('_defaults', {})
+            self.set('_defaults', {})
         else:
             self.set('_defaults', dict(defaults))
         self.set( '_stack', {} )
 
     def __getattr__(self, name):
         '''Return last value of name in stack, or default.'''
-        if name in self._stack:
-            return self._stack[name][-1]
-        if name in self._defaults:
+        frame = self._stack.get(name)
+        if frame is not None:
+            return frame.value
+        try:
             return self._defaults[name]
-        raise AttributeError
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, name, default=None):
+        frame = self._stack.get(name)
+        if frame is not None:
+            return frame.value
+        return self._defaults.get(name, default)
 
     def append(self, name, value):
         """
         Append item to a list property, increasing stack level
         """
-        l = list(getattr(self, name))
-        l.append(value)
-        setattr(self, name, l)
+        l = getattr(self, name)
+        if not isinstance(l, ContextList):
+            l = ContextList.from_sequence(l)
+        setattr(self, name, ContextList(value, l))
 
     def set(self, name, value):
         object.__setattr__(self, name, value)
 
     def replace(self, name, value):
         "do not increase stack level"
-        assert name in self._stack, name
-        values = self._stack[name][:-1]
-        self._stack[name] = values + [value]
+        frame = self._stack.get(name)
+        assert frame is not None, name
+        self._stack[name] = ContextFrame(value, frame.parent)
         return value
 
     def increment(self, name):
-        old = self.current(name)
-        self.replace(name, self.current(name) + 1)
-        return self.current(name)
+        return self.replace(name, self.current(name) + 1)
 
     def current(self, name):
-        try:
-            assert name in self._stack, (name, self._stack)
-            return self._stack[name][-1]
-        except:
-            print 'ContextStack.curront no key', name, self._stack
-            return 0
+        "Return the last pushed value of name, or raise KeyError. "
+        return self._stack[name].value
 
     def __setattr__(self, name, value):
         '''Pushes a new value for name onto the stack.'''
-        if name in self._stack:
-            self._stack[name].append(value)
-        else:
-            self._stack[name] = [value]
+        stack = self._stack
+        stack[name] = ContextFrame(value, stack.get(name))
 
     def __delattr__(self, name):
         '''Remove a value of name from the stack.'''
-        if name not in self._stack:
-            raise AttributeError
-        del self._stack[name][-1]
-        if not self._stack[name] and not isinstance(self._stack[name], int):
+        frame = self._stack.get(name)
+        if frame is None:
+            raise AttributeError(name)
+        if frame.parent is None:
             del self._stack[name]
+        else:
+            self._stack[name] = frame.parent
 
     def depth(self, name):
-        l = len(self._stack[name])
-        if l:
-            return l-1
+        frame, l = self._stack[name], 0
+        while frame.parent is not None:
+            frame, l = frame.parent, l+1
+        return l
 
     def previous(self, name):
-        if len(self._stack[name]) > 1:
-            return self._stack[name][-2]
+        parent = self._stack[name].parent
+        if parent is not None:
+            return parent.value
+
+    def values(self, name):
+        "Return all values of name on the stack, from bottom to top. "
+        values, frame = [], self._stack.get(name)
+        while frame is not None:
+            values.append(frame.value)
+            frame = frame.parent
+        values.reverse()
+        return values
 
     def __repr__(self):
-        return repr(self._stack)
+        return repr(dict([ (name, self.values(name)) for name in self._stack ]))
+
+class RstPatcher(object):
+
+    """
+    Serialize a document by copying the source lines of the nodes that are
+    unchanged since parsing, and translating the others with RstTranslator.
+
+    The source lines of the nodes are taken from the RangeTable the parser
+    set as `document.ranges` (see `dotmpe.du.ext.transform.ranges`). A node
+    is unchanged if it is not marked dirty, if its subtree has the elements
+    the parser numbered, in the same order, and if the text of its text
+    elements did not change. Sections are patched child by child, other body
+    elements are copied or translated as a whole.
+
+    Nodes created by transforms have no range, and nodes moved by transforms
+    are out of source order. These are translated in place of the source
+    lines between the neighbouring nodes that are in place. Those lines are
+    kept only if they belong to no parsed node, or to one of which some
+    descendant is still in place, like a section that became the document.
+
+    Transforms replace, change and remove parsed nodes. If the ranges were
+    settled after the transforms (see `ranges.SettleRanges`), nodes that did
+    not change since are unchanged as well, and the lines between two nodes
+    in place are copied if the nodes in between are those the transforms
+    left there, unchanged and without range.
+
+    If there is no range table, `patch` returns None and the writer
+    translates the full document.
+    """
+
+    def __init__(self, document, source):
+        self.document = document
+        self.lines = source.splitlines(True)
+        self.source_path = document.get('source')
+        self.table = getattr(document, 'ranges', None)
+        self.dirty = ranges.dirty_nodes(document)
+        self.digests = None
+        if getattr(document, 'settled', None) is not None:
+            self.digests = ranges.digests(document)
+        self.clean = set()
+        self.placed = []
+        self.removed = set()
+        self.index = RstIndex(document)
+        self.output = []
+
+    def patch(self):
+        """
+        Return the patched document, or None if the source lines of the
+        nodes are not known.
+        """
+        document_range = self.table is not None \
+                and self.table.get(self.document)
+        if not document_range or document_range[1] > len(self.lines):
+            self.document.reporter.info('No source ranges for document')
+            return
+        self.check(self.document)
+        plan = self.plan_container(self.document, 0, len(self.lines))
+        self.removed = self.removed_lines()
+        self.write(plan)
+        return ''.join(self.output)
+
+    def check(self, node):
+        """
+        Return true if `node` is unchanged since parsing, and collect the ids
+        of unchanged nodes in `self.clean`.
+        """
+        table = self.table
+        serial = getattr(node, 'serial', None)
+        clean = serial is not None and serial < len(table) \
+                and id(node) not in self.dirty
+        if clean and self.is_settled(node):
+            for child in node.children:
+                if isinstance(child, nodes.Element):
+                    self.check(child)
+        elif isinstance(node, nodes.TextElement):
+            if not clean:
+                return False
+            expected = serial
+            for element in node.traverse(nodes.Element):
+                if getattr(element, 'serial', None) != expected:
+                    return False
+                expected += 1
+            if expected != table.end_serial[serial] or \
+                    ranges.checksum(node) != table.checksum[serial]:
+                return False
+        else:
+            expected = serial is not None and serial + 1
+            for child in node.children:
+                if not isinstance(child, nodes.Element):
+                    continue
+                if not self.check(child) or child.serial != expected:
+                    clean = False
+                else:
+                    expected = table.end_serial[child.serial]
+            if clean and expected != table.end_serial[serial]:
+                clean = False
+        if clean:
+            self.clean.add(id(node))
+        return clean
+
+    def is_clean(self, node):
+        return id(node) in self.clean
+
+    def is_settled(self, node):
+        "Return true if `node` did not change since the ranges were settled. "
+        return self.digests is not None and id(node) not in self.dirty \
+                and getattr(node, 'settled', None) == self.digests[id(node)]
+
+    def settled_gap(self, node, children, before, after):
+        """
+        Return true if `children` are the elements of `node` the transforms
+        left between `before` and `after` (None at either end), without
+        range and unchanged since.
+        """
+        settled = getattr(node, 'settled_children', None)
+        if settled is None:
+            return False
+        ids = [ id(child) for child in settled ]
+        try:
+            first = before is not None and ids.index(id(before)) + 1 or 0
+            last = after is not None and ids.index(id(after)) or len(ids)
+        except ValueError:
+            return False
+        return ids[first:last] == map(id, children) and not [ child
+            for child in children if self.table.get(child) is not None
+                or not self.is_settled(child) ]
+
+    def span(self, node, start, end):
+        """
+        Return the first line and the line after the last of `node`, or None
+        if it has no range within `start` and `end`.
+        """
+        r = self.table.get(node)
+        if r is None or (node.source and self.source_path
+                and node.source != self.source_path):
+            return
+        if r[0] < start or r[1] > end or r[1] <= r[0]:
+            return
+        return r[0], r[1]
+
+    def plan_container(self, node, start, end):
+        """
+        Return the steps to write document or section `node`, at
+        `lines[start:end]`, and note the serials of the nodes written at
+        their range in `self.placed`.
+        """
+        if self.is_clean(node):
+            return [ ('copy', start, end) ]
+        plan, cursor, between, before = [], start, [], None
+        expected = node.serial + 1
+        for child in node.children:
+            if not isinstance(child, nodes.Element):
+                continue
+            span = None
+            # Reports have no source
+            if not isinstance(child, nodes.system_message):
+                span = self.span(child, cursor, end)
+            if span is None:
+                between.append(child)
+                continue
+            plan.append(self.plan_gap(between, cursor, span[0], expected,
+                child.serial, self.settled_gap(node, between, before, child)))
+            between, before = [], child
+            self.placed.append(child.serial)
+            if isinstance(child, nodes.section):
+                plan.extend(self.plan_container(child, *span))
+            elif self.is_clean(child):
+                plan.append(('copy',) + span)
+            elif isinstance(child, nodes.title):
+                plan.append(('title', child) + span)
+            else:
+                plan.append(('translate', [child]))
+            cursor = span[1]
+            expected = self.table.end_serial[child.serial]
+        plan.append(self.plan_gap(between, cursor, end, expected,
+            self.table.end_serial[node.serial],
+            self.settled_gap(node, between, before, None)))
+        return plan
+
+    def plan_gap(self, children, start, end, expected, next_serial,
+            settled=False):
+        """
+        Return the step to write the `children` without range between two
+        nodes in place. If these are unchanged and are the nodes parsed in
+        between, with serials from `expected` up to `next_serial`, or if the
+        gap is `settled`, the lines are copied. Otherwise they are
+        translated, see `write_gap`.
+        """
+        if settled:
+            return ('copy', start, end)
+        for child in children:
+            if getattr(child, 'serial', None) != expected \
+                    or not (self.is_clean(child)
+                    or isinstance(child, nodes.system_message)):
+                break
+            expected = self.table.end_serial[child.serial]
+        else:
+            if children and expected == next_serial:
+                self.placed.extend([ child.serial for child in children ])
+                return ('copy', start, end)
+        return ('gap', [ child for child in children
+            if not isinstance(child, nodes.system_message) ], start, end)
+
+    def write(self, plan):
+        for step in plan:
+            if step[0] == 'copy':
+                self.output.append(''.join(self.lines[step[1]:step[2]]))
+            elif step[0] == 'gap':
+                self.write_gap(*step[1:])
+            elif step[0] == 'title':
+                self.write_title(*step[1:])
+            else:
+                self.write_translated(*step[1:])
+
+    def removed_lines(self):
+        """
+        Return the set of line indices of the parsed nodes that are not in
+        place, and have no descendants in place either.
+        """
+        table, placed = self.table, sorted(self.placed)
+        removed = set()
+        for serial in range(1, len(table)):
+            if table.line[serial] < 0:
+                continue
+            idx = bisect.bisect_left(placed, serial)
+            if idx < len(placed) and placed[idx] < table.end_serial[serial]:
+                continue
+            removed.update(range(table.line[serial], table.end_line[serial]))
+        return removed
+
+    def write_gap(self, children, start, end):
+        """
+        Write the lines between two nodes in place, without the lines of
+        parsed nodes that were removed or moved. If there are `children`
+        not in place in between, translate those in place of the gap, keeping
+        the blank lines at either end.
+        """
+        gap = [ line for idx, line in enumerate(self.lines[start:end], start)
+                if idx not in self.removed ]
+        if len(gap) < end - start:
+            gap = [ line for idx, line in enumerate(gap) if line.strip()
+                    or (idx and gap[idx-1].strip()) or (not idx and start) ]
+        if not children:
+            self.output.extend(gap)
+            return
+        lead = 0
+        while lead < len(gap) and not gap[lead].strip():
+            lead += 1
+        trail = len(gap)
+        while trail > lead and not gap[trail-1].strip():
+            trail -= 1
+        if lead < len(gap):
+            self.output.extend(gap[:lead])
+            self.write_translated(children)
+            self.output.extend(gap[trail:])
+            return
+        if gap:
+            self.output.extend(gap)
+        elif self.output and not ''.join(self.output[-2:]).endswith('\n\n'):
+            self.output.append('\n')
+        self.write_translated(children)
+        if end < len(self.lines):
+            self.output.append('\n')
+
+    def write_title(self, title, start, end):
+        "Write title text with the adornment style used at lines[start:end]. "
+        underline = self.lines[end-1].strip()
+        text = title.astext()
+        line = underline[0] * len(text) + '\n'
+        if end - start > 2:
+            self.output.append(line)
+        self.output.extend([text + '\n', line])
+
+    def copy(self, node):
+        "Deep copy node, without the system messages which cannot be copied. "
+        if not isinstance(node, nodes.Element):
+            return node.deepcopy()
+        copy = node.copy()
+        copy.extend([ self.copy(child) for child in node.children
+            if not isinstance(child, nodes.system_message) ])
+        return copy
+
+    def write_translated(self, children):
+        "Translate copies of the nodes as a separate document, and write it. "
+        document = utils.new_document(self.source_path, self.document.settings)
+        for child in children:
+            document.append(self.copy(child))
+        visitor = RstTranslator(document, self.index)
+        document.walkabout(visitor)
+        text = visitor.astext().rstrip()
+        if text:
+            self.output.append(text + '\n')
+
 
 class RstDocumentTranslator(AbstractTranslator):
     """
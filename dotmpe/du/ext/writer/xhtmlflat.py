@@ -0,0 +1,489 @@
+"""
+XHTML writer using the flattener registry of `dotmpe.du.flatten` instead of
+a NodeVisitor.
+
+Each doctree node type maps to a generator flattener that yields the markup
+for the node in chunks. Writing to a file, chunks are written out as the
+document is flattened, without collecting a body list first.
+
+The markup uses the html4css1 class names but is plainer: definition lists
+instead of tables for field lists, option lists, docinfo and footnotes.
+Alias: 'xhtml-flat'.
+"""
+from docutils import io, languages, nodes, writers
+from docutils.transforms import writer_aux
+
+from dotmpe.du import flatten
+from dotmpe.du.flatten import escape, iterflatten, quoteattrs
+from dotmpe.du.ext.writer.rst import StreamOutput
+
+
+class Writer(writers.Writer):
+
+    supported = ('xhtml-flat',)
+    """Formats this writer supports."""
+
+    settings_spec = (
+        'XHTML flat writer',
+        None,
+        ((
+            'Specify comma separated list of stylesheet URLs to link to. ',
+            ['--stylesheet'],
+            {'metavar': '<URL>'}
+        ),)
+    )
+
+    settings_defaults = {'output_encoding_error_handler': 'xmlcharrefreplace'}
+
+    config_section = 'xhtml-flat writer'
+    config_section_dependencies = ('writers',)
+
+    chunk_size = 1 << 16
+    "Number of characters to collect before writing to a file. "
+
+    doctype = (u'<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"'
+        u' "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n')
+
+    def get_transforms(self):
+        return writers.Writer.get_transforms(self) + [writer_aux.Admonitions]
+
+    def chunks(self):
+        "Generate the output document. "
+        document = self.document
+        settings = document.settings
+        yield self.doctype
+        yield u'<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="%s">\n' \
+                % settings.language_code
+        yield u'<head>\n'
+        if settings.output_encoding != 'unicode':
+            yield (u'<meta http-equiv="Content-Type" '
+                u'content="text/html; charset=%s" />\n' \
+                    % settings.output_encoding)
+        title = document.get('title')
+        if not title and document.children \
+                and isinstance(document[0], nodes.title):
+            title = document[0].astext()
+        if title:
+            yield u'<title>%s</title>\n' % escape(title)
+        for href in (getattr(settings, 'stylesheet', None) or '').split(','):
+            if href.strip():
+                yield (u'<link rel="stylesheet" href="%s" type="text/css" />\n'
+                    % escape(href.strip()))
+        yield u'</head>\n<body>\n'
+        for chunk in iterflatten(document):
+            yield chunk
+        yield u'</body>\n</html>\n'
+
+    def translate(self):
+        self.output = u''.join(self.chunks())
+
+    def write(self, document, destination):
+        """
+        Write to file destinations while flattening. Returns None then,
+        instead of the output.
+        """
+        if not isinstance(destination, io.FileOutput):
+            return writers.Writer.write(self, document, destination)
+        self.document = document
+        self.language = languages.get_language(
+            document.settings.language_code,
+            document.reporter)
+        self.destination = destination
+        stream = StreamOutput(destination)
+        try:
+            buffer, size = [], 0
+            for chunk in self.chunks():
+                buffer.append(chunk)
+                size += len(chunk)
+                if size > self.chunk_size:
+                    stream.write(u''.join(buffer))
+                    buffer, size = [], 0
+            stream.write(u''.join(buffer))
+        finally:
+            stream.close()
+        self.output = None
+
+
+# Helpers
+
+def starttag(node, tagname, attrs=None, suffix=u''):
+    """
+    Return the start tag for `node`, with its first ID and its classes
+    added to `attrs`. Other IDs are written as empty span anchors.
+    """
+    attrs = attrs and dict(attrs) or {}
+    classes = node.get('classes')
+    if classes:
+        if attrs.get('class'):
+            classes = [attrs['class']] + classes
+        attrs['class'] = u' '.join(classes)
+    ids = node.get('ids')
+    anchors = u''
+    if ids:
+        attrs['id'] = ids[0]
+        if len(ids) > 1:
+            anchors = u''.join([u'<span id="%s"></span>' % i for i in ids[1:]])
+    return u'<%s%s>%s%s' % (tagname, u''.join(quoteattrs(attrs)), anchors,
+            suffix)
+
+def children(node):
+    "Generate the flattened children of `node`. "
+    for child in node.children:
+        for chunk in iterflatten(child):
+            yield chunk
+
+def element(tagname, cls=None, suffix=u'', end=u'\n'):
+    """
+    Return a generator flattener that wraps the children of a node in
+    a `tagname` element.
+    """
+    attrs = cls and {'class': cls} or None
+    endtag = u'</%s>%s' % (tagname, end)
+    def flattened(node):
+        yield starttag(node, tagname, attrs, suffix)
+        for chunk in children(node):
+            yield chunk
+        yield endtag
+    return flattened
+
+def section_depth(node):
+    depth = 0
+    while node is not None:
+        if isinstance(node, nodes.section):
+            depth += 1
+        node = node.parent
+    return depth
+
+
+# Flatteners for doctree nodes
+
+block_elements = {
+    nodes.Element: ('div', None, u'\n'),
+    nodes.section: ('div', 'section', u'\n'),
+    nodes.topic: ('div', 'topic', u'\n'),
+    nodes.sidebar: ('div', 'sidebar', u'\n'),
+    nodes.admonition: ('div', 'admonition', u'\n'),
+    nodes.container: ('div', 'docutils container', u'\n'),
+    nodes.compound: ('div', 'compound', u'\n'),
+    nodes.figure: ('div', 'figure', u'\n'),
+    nodes.legend: ('div', 'legend', u'\n'),
+    nodes.line_block: ('div', 'line-block', u'\n'),
+    nodes.block_quote: ('blockquote', None, u'\n'),
+    nodes.paragraph: ('p', None, u''),
+    nodes.caption: ('p', 'caption', u''),
+    nodes.rubric: ('p', 'rubric', u''),
+    nodes.bullet_list: ('ul', 'simple', u'\n'),
+    nodes.list_item: ('li', None, u''),
+    nodes.definition_list: ('dl', 'docutils', u'\n'),
+    nodes.term: ('dt', None, u''),
+    nodes.definition: ('dd', None, u'\n'),
+    nodes.field_list: ('dl', 'docutils field-list', u'\n'),
+    nodes.field_name: ('dt', 'field-name', u''),
+    nodes.field_body: ('dd', 'field-body', u'\n'),
+    nodes.option_list: ('dl', 'docutils option-list', u'\n'),
+    nodes.description: ('dd', None, u'\n'),
+    nodes.docinfo: ('dl', 'docinfo', u'\n'),
+    nodes.footnote: ('div', 'footnote', u'\n'),
+    nodes.citation: ('div', 'citation', u'\n'),
+    nodes.math_block: ('pre', 'math', u''),
+    nodes.thead: ('thead', None, u'\n'),
+    nodes.tbody: ('tbody', None, u'\n'),
+    nodes.row: ('tr', None, u''),
+}
+"Nodes written as a block-level element, with class and start tag suffix. "
+
+preformatted_elements = {
+    nodes.literal_block: ('pre', 'literal-block'),
+    nodes.doctest_block: ('pre', 'doctest-block'),
+}
+
+inline_elements = {
+    nodes.Inline: ('span', None),
+    nodes.inline: ('span', None),
+    nodes.emphasis: ('em', None),
+    nodes.strong: ('strong', None),
+    nodes.literal: ('tt', 'docutils literal'),
+    nodes.title_reference: ('cite', None),
+    nodes.subscript: ('sub', None),
+    nodes.superscript: ('sup', None),
+    nodes.abbreviation: ('abbr', None),
+    nodes.acronym: ('acronym', None),
+    nodes.classifier: ('span', 'classifier'),
+    nodes.option_argument: ('var', None),
+    nodes.math: ('span', 'math'),
+}
+"Nodes written as an inline element, with class. "
+
+transparent_elements = (nodes.definition_list_item, nodes.field,
+    nodes.option_list_item, nodes.generated, nodes.tgroup)
+"Nodes written as their children only. "
+
+skipped_elements = (nodes.substitution_definition, nodes.pending,
+    nodes.colspec, nodes.decoration)
+"Nodes not written. Document writes the decoration. "
+
+bibliographic_elements = (nodes.author, nodes.authors, nodes.organization,
+    nodes.address, nodes.contact, nodes.version, nodes.revision,
+    nodes.status, nodes.date, nodes.copyright)
+
+for node_class, (tagname, cls, suffix) in block_elements.items():
+    flatten.register_flattener(node_class, element(tagname, cls, suffix),
+            generator=True)
+for node_class, (tagname, cls) in preformatted_elements.items():
+    flatten.register_flattener(node_class, element(tagname, cls),
+            generator=True)
+for node_class, (tagname, cls) in inline_elements.items():
+    flatten.register_flattener(node_class, element(tagname, cls, end=u''),
+            generator=True)
+for node_class in transparent_elements:
+    flatten.register_flattener(node_class, children, generator=True)
+for node_class in skipped_elements:
+    flatten.register_flattener(node_class, lambda node: u'')
+
+
+def flatten_document(node):
+    header = footer = None
+    for child in node.traverse(nodes.decoration, include_self=False,
+            descend=False):
+        header = child.get_header()
+        footer = child.get_footer()
+    if header is not None and header.children:
+        for chunk in element('div', 'header')(header):
+            yield chunk
+    yield starttag(node, 'div', {'class': 'document'}, u'\n')
+    for chunk in children(node):
+        yield chunk
+    yield u'</div>\n'
+    if footer is not None and footer.children:
+        for chunk in element('div', 'footer')(footer):
+            yield chunk
+
+def flatten_title(node):
+    parent = node.parent
+    if isinstance(parent, nodes.document):
+        tagname, attrs = 'h1', {'class': 'title'}
+    elif isinstance(parent, nodes.section):
+        tagname, attrs = 'h%i' % min(section_depth(parent), 6), None
+    elif isinstance(parent, nodes.table):
+        tagname, attrs = 'caption', None
+    else:
+        tagname, attrs = 'p', {'class': '%s-title' % parent.tagname}
+    yield starttag(node, tagname, attrs)
+    refid = node.get('refid')
+    if refid:
+        yield u'<a class="toc-backref" href="#%s">' % refid
+    for chunk in children(node):
+        yield chunk
+    if refid:
+        yield u'</a>'
+    yield u'</%s>\n' % tagname
+
+def flatten_subtitle(node):
+    if isinstance(node.parent, nodes.document):
+        tagname, attrs = 'h2', {'class': 'subtitle'}
+    else:
+        tagname, attrs = 'p', {'class': '%s-subtitle' % node.parent.tagname}
+    yield starttag(node, tagname, attrs)
+    for chunk in children(node):
+        yield chunk
+    yield u'</%s>\n' % tagname
+
+def flatten_reference(node):
+    attrs = {}
+    if 'refuri' in node:
+        attrs['href'] = node['refuri']
+        attrs['class'] = 'reference external'
+    elif 'refid' in node:
+        attrs['href'] = '#' + node['refid']
+        attrs['class'] = 'reference internal'
+    else:
+        attrs['class'] = 'reference'
+    yield starttag(node, 'a', attrs)
+    for chunk in children(node):
+        yield chunk
+    yield u'</a>'
+
+def flatten_target(node):
+    if node.children:
+        yield starttag(node, 'span', {'class': 'target'})
+        for chunk in children(node):
+            yield chunk
+        yield u'</span>'
+    elif node.get('ids') and not ('refuri' in node or 'refid' in node
+            or 'refname' in node):
+        yield starttag(node, 'span', {'class': 'target'}) + u'</span>'
+
+def flatten_footnote_reference(node):
+    attrs = {'class': node.tagname.replace('_', '-')}
+    if 'refid' in node:
+        attrs['href'] = '#' + node['refid']
+    yield starttag(node, 'a', attrs) + u'['
+    for chunk in children(node):
+        yield chunk
+    yield u']</a>'
+
+def flatten_label(node):
+    backrefs = node.parent.get('backrefs')
+    yield starttag(node, 'span', {'class': 'label'}) + u'['
+    if backrefs:
+        yield u'<a class="fn-backref" href="#%s">' % backrefs[0]
+    for chunk in children(node):
+        yield chunk
+    if backrefs:
+        yield u'</a>'
+    yield u']</span>\n'
+
+def flatten_problematic(node):
+    attrs = {'class': 'problematic'}
+    if 'refid' in node:
+        attrs['href'] = '#' + node['refid']
+    yield starttag(node, 'a', attrs)
+    for chunk in children(node):
+        yield chunk
+    yield u'</a>'
+
+def flatten_image(node):
+    attrs = {'src': node['uri'], 'alt': node.get('alt', node['uri'])}
+    for name in 'width', 'height':
+        if name in node:
+            attrs[name] = node[name]
+    if 'align' in node:
+        attrs['class'] = 'align-%s' % node['align']
+    return starttag(node, 'img', attrs)[:-1] + u' />'
+
+def flatten_enumerated_list(node):
+    attrs = {'class': node.get('enumtype', 'arabic')}
+    if node.get('start', 1) != 1:
+        attrs['start'] = node['start']
+    yield starttag(node, 'ol', attrs, u'\n')
+    for chunk in children(node):
+        yield chunk
+    yield u'</ol>\n'
+
+def flatten_line(node):
+    if not node.children:
+        yield u'<div class="line"><br /></div>\n'
+        return
+    yield starttag(node, 'div', {'class': 'line'})
+    for chunk in children(node):
+        yield chunk
+    yield u'</div>\n'
+
+def flatten_attribution(node):
+    yield starttag(node, 'p', {'class': 'attribution'}) + u'&mdash;'
+    for chunk in children(node):
+        yield chunk
+    yield u'</p>\n'
+
+def flatten_transition(node):
+    return starttag(node, 'hr', {'class': 'docutils'})[:-1] + u' />\n'
+
+def flatten_raw(node):
+    if 'html' in node.get('format', '').split():
+        return node.astext()
+    return u''
+
+def flatten_comment(node):
+    return flatten.flatten_comment(node.astext())
+
+def flatten_bibliographic(node):
+    yield u'<dt class="%s">%s</dt>\n' % (node.tagname,
+            node.tagname.title())
+    yield starttag(node, 'dd', {'class': node.tagname})
+    if isinstance(node, nodes.authors):
+        # the inline content of each author, not their dt/dd pairs
+        yield u'; '.join([u''.join(children(author)) for author in node])
+    else:
+        for chunk in children(node):
+            yield chunk
+    yield u'</dd>\n'
+
+def flatten_option_group(node):
+    yield starttag(node, 'dt', {'class': 'option-group'})
+    yield u', '.join([flatten.flatten(option) for option in node])
+    yield u'</dt>\n'
+
+def flatten_option(node):
+    yield starttag(node, 'span', {'class': 'option'})
+    for child in node.children:
+        if isinstance(child, nodes.option_argument):
+            yield child.get('delimiter', u' ')
+        for chunk in iterflatten(child):
+            yield chunk
+    yield u'</span>'
+
+def flatten_option_string(node):
+    return escape(node.astext())
+
+def flatten_table(node):
+    yield starttag(node, 'table', {'class': 'docutils', 'border': '1'}, u'\n')
+    for child in node.children:
+        if isinstance(child, nodes.tgroup):
+            colspecs = [c for c in child if isinstance(c, nodes.colspec)]
+            total = sum([c.get('colwidth', 1) for c in colspecs]) or 1
+            yield u'<colgroup>\n'
+            for colspec in colspecs:
+                yield u'<col width="%i%%" />\n' % (
+                        colspec.get('colwidth', 1) * 100 / total)
+            yield u'</colgroup>\n'
+        for chunk in iterflatten(child):
+            yield chunk
+    yield u'</table>\n'
+
+def flatten_entry(node):
+    head = isinstance(node.parent.parent, nodes.thead)
+    tagname = head and 'th' or 'td'
+    attrs = {'class': head and 'head' or None}
+    if 'morecols' in node:
+        attrs['colspan'] = node['morecols'] + 1
+    if 'morerows' in node:
+        attrs['rowspan'] = node['morerows'] + 1
+    yield starttag(node, tagname, attrs)
+    if node.children:
+        for chunk in children(node):
+            yield chunk
+    else:
+        yield u'&nbsp;'
+    yield u'</%s>\n' % tagname
+
+def flatten_system_message(node):
+    yield starttag(node, 'div', {'class': 'system-message'}, u'\n')
+    line = node.get('line') and u', line %s' % node['line'] or u''
+    yield u'<p class="system-message-title">%s/%s (<tt class="docutils">' \
+            u'%s</tt>%s)</p>\n' % (node['type'], node['level'],
+                escape(node.get('source') or u''), line)
+    for chunk in children(node):
+        yield chunk
+    yield u'</div>\n'
+
+for node_class, flattener in (
+        (nodes.document, flatten_document),
+        (nodes.title, flatten_title),
+        (nodes.subtitle, flatten_subtitle),
+        (nodes.reference, flatten_reference),
+        (nodes.target, flatten_target),
+        (nodes.footnote_reference, flatten_footnote_reference),
+        (nodes.citation_reference, flatten_footnote_reference),
+        (nodes.label, flatten_label),
+        (nodes.problematic, flatten_problematic),
+        (nodes.enumerated_list, flatten_enumerated_list),
+        (nodes.line, flatten_line),
+        (nodes.attribution, flatten_attribution),
+        (nodes.option_group, flatten_option_group),
+        (nodes.option, flatten_option),
+        (nodes.table, flatten_table),
+        (nodes.entry, flatten_entry),
+        (nodes.system_message, flatten_system_message),
+    ):
+    flatten.register_flattener(node_class, flattener, generator=True)
+for node_class in bibliographic_elements:
+    flatten.register_flattener(node_class, flatten_bibliographic,
+            generator=True)
+for node_class, flattener in (
+        (nodes.image, flatten_image),
+        (nodes.transition, flatten_transition),
+        (nodes.raw, flatten_raw),
+        (nodes.comment, flatten_comment),
+        (nodes.option_string, flatten_option_string),
+    ):
+    flatten.register_flattener(node_class, flattener)
@@ -1,45 +1,135 @@
 """
-TODO: just an idea for another (X)HTML writer, not based on visitor pattern?
+Translating registry of flatteners, an alternative to the visitor pattern
+for writing (X)HTML.
 
-Translating registry of flatteners.
+A flattener turns an object into markup. Plain flatteners return a string,
+generator flatteners yield the markup in chunks, which lets `iterflatten`
+produce a document lazily. Flatteners are looked up by the type of the object
+or, failing that, the nearest base type, so registering one for e.g.
+`docutils.nodes.Element` provides a fallback for all element types.
 
-Ie. xhtml.document flattens a document to valid XHTML frame?
+Tags are built with `T`, e.g. ``T.p( class_='note' )[ 'Text', T.br ]``.
+See `dotmpe.du.ext.writer.xhtmlflat` for flatteners of doctree nodes.
 """
-from docutils import nodes
-
-
 #
-# registry of flatteners 
-#   
+# registry of flatteners
+#
 __registry = { }
+__generators = { }
+__lookup = { }
+
+def register_flattener ( o, f, generator=False ):
+    unregister_flattener ( o )
+    if generator:
+        __generators [ o ] = f
+    else:
+        __registry [ o ] = f
+    __lookup.clear ( )
 
-def register_flattener ( o, f ):
-    __registry [ o ] = f
-    
 def unregister_flattener ( o ):
-    try:
-        del __registry [ o ]
-    except KeyError: 
-        pass
+    for reg in __registry, __generators:
+        try:
+            del reg [ o ]
+        except KeyError:
+            pass
+    __lookup.clear ( )
 
 def registry ( ):
     '''mostly for debugging'''
-    return __registry 
+    return __registry
 
 def get_registered_flattener ( o ):
     return __registry [ o ]
 
-def flatten ( o ): 
+def lookup ( t ):
+    '''return (flattener, is-generator) for type t, or (None, False)'''
     try:
-        return __registry [ type ( o ) ] ( o )
+        return __lookup [ t ]
     except KeyError:
-        return unicode ( o )
+        pass
+    found = None, False
+    for base in getattr ( t, '__mro__', ( t, ) ):
+        if base in __generators:
+            found = __generators [ base ], True
+            break
+        if base in __registry:
+            found = __registry [ base ], False
+            break
+    __lookup [ t ] = found
+    return found
+
+def flatten ( o ):
+    f, generator = lookup ( type ( o ) )
+    if generator:
+        return u''.join ( f ( o ) )
+    elif f:
+        return f ( o )
+    return unicode ( o )
+
+def iterflatten ( o ):
+    '''generator that yields the flattened chunks of o'''
+    f, generator = lookup ( type ( o ) )
+    if generator:
+        for chunk in f ( o ):
+            yield chunk
+    elif f:
+        yield f ( o )
+    else:
+        yield unicode ( o )
+
+
+def escape ( s ):
+    return s.replace ( u'&', u'&amp;' ).replace ( u'<', u'&lt;' ) \
+            .replace ( u'>', u'&gt;' ).replace ( u'"', u'&quot;' )
+
+def quoteattrs ( attrs ):
+    '''generator that yields ` name="value"` for each attribute that is set'''
+    for name, value in sorted ( attrs.items ( ) ):
+        if value is None or value is False:
+            continue
+        if isinstance ( value, ( list, tuple ) ):
+            value = u' '.join ( value )
+        elif not isinstance ( value, basestring ):
+            value = unicode ( value )
+        yield u' %s="%s"' % ( name, escape ( value ) )
 
 
 # Based on Breve's tags and flatten which in turn borrowed from Nevow's tags.
 
+class Tag ( object ):
+    __slots__ = [ 'name', 'attrs', 'children', 'render', 'data' ]
+
+    def __init__ ( self, name ):
+        self.name = name
+        self.attrs = { }
+        self.children = [ ]
+        self.render = None
+        self.data = None
+
+    def __call__ ( self, render=None, data=None, **kw ):
+        '''set attributes, a trailing '_' is stripped from names (class_)'''
+        if render:
+            self.render = render
+        if data is not None:
+            self.data = data
+        for k, v in kw.items ( ):
+            self.attrs [ k.rstrip ( '_' ).replace ( '_', '-' ) ] = v
+        return self
+
+    def __getitem__ ( self, children ):
+        if isinstance ( children, ( list, tuple ) ):
+            self.children.extend ( children )
+        else:
+            self.children.append ( children )
+        return self
+
+    def __unicode__ ( self ):
+        return flatten_tag ( self )
+
+    __str__ = __unicode__
+
 class Proto ( unicode ):
-    __slots__ = [ 'Class' ]
+    __slots__ = [ ]
     Class = Tag
     def __call__ ( self, **kw ):
         return self.Class ( self )( **kw )
@@ -50,12 +140,22 @@ class Proto ( unicode ):
     def __str__ ( self ):
         return unicode ( self.Class ( self ) )
 
-class cdata ( unicode ):
-    def __init__ ( self, children ):
-        self.children = children
+class Tags ( object ):
+    '''namespace of tag prototypes, T.div etc.'''
+    def __getattr__ ( self, name ):
+        if name.startswith ( '__' ):
+            raise AttributeError ( name )
+        return Proto ( name )
 
-    def __str__ ( self ):
-        return u'<![CDATA[%s]]>' % self.childre
+T = Tags ( )
+
+empty_tags = frozenset ( [ 'area', 'base', 'br', 'col', 'hr', 'img',
+    'input', 'link', 'meta', 'param' ] )
+"tags that are written as <tag />"
+
+class cdata ( unicode ): pass
+def flatten_cdata ( o ):
+    return u'<![CDATA[%s]]>' % o
 
 class xml ( unicode ): pass
 def flatten_xml ( o ):
@@ -63,47 +163,50 @@ def flatten_xml ( o ):
 
 class comment ( unicode ): pass
 def flatten_comment ( o ):
+    while u'--' in o:
+        o = o.replace ( u'--', u'- -' )
     return u"\n<!--\n%s\n-->\n" % o
 
 # Standard flatteners.
 def flattened_tags ( o ):
     '''generator that yields flattened tags'''
-    def flattened ( o ):
-        if o.render:
-            o = o.render ( o, o.data )
-            if not isinstance ( o, nodes.Node ):
-                yield flatten ( o )
-                raise StopIteration
-
-        yield u'<%s%s>' % ( o.name, u''.join ( quoteattrs ( o.attrs ) ) )
-        for c in o.children:
-            yield flatten ( c )
-        yield u'</%s>' % o.name
-        raise StopIteration
-    return flattened ( o )
+    if o.render:
+        o = o.render ( o, o.data )
+        if not isinstance ( o, Tag ):
+            for chunk in iterflatten ( o ):
+                yield chunk
+            return
+    attrs = u''.join ( quoteattrs ( o.attrs ) )
+    if not o.children and o.name in empty_tags:
+        yield u'<%s%s />' % ( o.name, attrs )
+        return
+    yield u'<%s%s>' % ( o.name, attrs )
+    for c in o.children:
+        for chunk in iterflatten ( c ):
+            yield chunk
+    yield u'</%s>' % o.name
 
 def flatten_tag ( o ):
-    return  ''.join ( flattened_tags ( o ) )
+    return  u''.join ( flattened_tags ( o ) )
 
 def flatten_proto ( p ):
-    return u'<%s />' % p
+    return flatten_tag ( Tag ( p ) )
 
-def flatten_sequence ( o ):
-    return u''.join ( [ flatten ( i ) for i in o ] )
+def flattened_sequence ( o ):
+    for i in o:
+        for chunk in iterflatten ( i ):
+            yield chunk
 
 def flatten_callable ( o ):
     return flatten ( o ( ) )
 
-register_flattener ( list, flatten_sequence )
-register_flattener ( tuple, flatten_sequence )
+register_flattener ( list, flattened_sequence, generator=True )
+register_flattener ( tuple, flattened_sequence, generator=True )
 register_flattener ( Proto, flatten_proto )
-register_flattener ( Tag, flatten_tag )
+register_flattener ( Tag, flattened_tags, generator=True )
 register_flattener ( str, lambda s: escape ( unicode ( s, 'utf-8' ) ) )
 register_flattener ( unicode, escape )
-register_flattener ( cdata, unicode )
+register_flattener ( cdata, flatten_cdata )
 register_flattener ( comment, flatten_comment )
 register_flattener ( xml, flatten_xml )
 register_flattener ( type ( lambda: None ), flatten_callable )
-
-
-
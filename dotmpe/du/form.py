@@ -104,6 +104,7 @@ from docutils import nodes, utils, transforms
 from docutils.frontend import Values
 from dotmpe.du.ext import extractor
 from dotmpe.du import util
+from dotmpe.du.frozen import id_of, text_of
 
 
 logger = util.get_log(__name__)
@@ -540,7 +541,7 @@ class FormProcessor:
 
 def extract_form_field_label(field):
     " Return text-value of first node.  "
-    return field[0].astext()
+    return text_of(field[0])
 
 
 class FormField:
@@ -639,7 +640,7 @@ class AbstractFormVisitor(nodes.SparseNodeVisitor):
             pass
         if self.settings.form == 'name' or self.settings.form == 'class-and-name':
             pass
-        field_id = nodes.make_id(extract_form_field_label(node))
+        field_id = id_of(node[0])
         if self.field_class not in node['classes']:
             node['classes'].append(self.field_class)
         self.fields.append((field_id, node))
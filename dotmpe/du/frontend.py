@@ -59,17 +59,22 @@ def cli_process(argv, builder=None, builder_name='mpe', description=''):
     builder.settings_default = builder.settings
 
     # Rest deals with argv handling and defers to run_process (tmp)
-    for argv in argvs:
-        # replace settings for initial components
-        builder.process_command_line(argv=argv, usage=None, description=None,
-                settings_spec=None, config_section=None,
-                **builder.settings_default.__dict__)
+    try:
+        for argv in argvs:
+            # replace settings for initial components
+            builder.process_command_line(argv=argv, usage=None,
+                    description=None, settings_spec=None, config_section=None,
+                    **builder.settings_default.__dict__)
 
-        builder._do_process()
+            builder._do_process()
+
+        else:
+            # No further args (or break but not using that)
+            builder._do_process()
 
-    else:
-        # No further args (or break but not using that)
-        builder._do_process()
+    finally:
+        # let storages write out buffered data
+        builder.close_extractors()
 
 
 def cli_render(argv, builder=None, builder_name='mpe'):
@@ -0,0 +1,90 @@
+"""
+Frozen documents: memoized text and ids for doctrees that are only read
+after their transforms have been applied, e.g. by extractors and writers.
+
+`freeze` marks a document. `text_of` and `id_of` then keep the results of
+``node.astext()`` and ``nodes.make_id(node.astext())`` in a table on the
+document, keyed by node. The text of an element is joined from the cached
+text of its children, so each subtree is joined once.
+
+The table is dropped when the tree changes, see `dotmpe.du.nodeindex`. Nodes
+of documents that are not frozen are not cached.
+"""
+from docutils import nodes
+
+from dotmpe.du import nodeindex
+
+
+class FrozenText(object):
+
+    """
+    Side table with the text and id of the nodes of a frozen document.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.generation = None
+
+    def __getstate__(self):
+        return { 'document': self.document, 'generation': None }
+
+    def reset(self):
+        self.texts = {}
+        "id(node) -> (node, text) "
+        self.ids = {}
+        "id(node) -> id "
+        self.generation = nodeindex.generation(self.document)
+        nodeindex.track(self.document)
+
+    def text(self, node):
+        if self.generation != nodeindex.generation(self.document):
+            self.reset()
+        key = id(node)
+        if key not in self.texts:
+            if isinstance(node, nodes.Element) \
+                    and type(node).astext.im_func is joined_astext:
+                text = node.child_text_separator.join([ self.text(child)
+                    for child in node.children ])
+            else:
+                text = node.astext()
+            self.texts[key] = node, text
+        return self.texts[key][1]
+
+    def id(self, node):
+        text = self.text(node)
+        key = id(node)
+        if key not in self.ids:
+            self.ids[key] = nodes.make_id(text)
+        return self.ids[key]
+
+
+joined_astext = nodes.Element.astext.im_func
+"Elements with this astext are joined from their children. "
+
+
+def freeze(document):
+    "Start caching the text and ids of the nodes of `document`. "
+    document.frozen_text = FrozenText(document)
+
+def thaw(document):
+    "Stop caching for `document`. "
+    document.frozen_text = None
+
+def frozen_text(node):
+    document = node.document
+    if document is not None:
+        return getattr(document, 'frozen_text', None)
+
+def text_of(node):
+    "Return ``node.astext()``, cached if the document is frozen. "
+    table = frozen_text(node)
+    if table is None:
+        return node.astext()
+    return table.text(node)
+
+def id_of(node):
+    "Return ``nodes.make_id(node.astext())``, cached if the document is frozen. "
+    table = frozen_text(node)
+    if table is None:
+        return nodes.make_id(node.astext())
+    return table.id(node)
@@ -0,0 +1,163 @@
+"""
+Image dimensions from the file header, without decoding the image.
+
+`probe` reads the width and height in pixels of PNG, GIF, JPEG and SVG files
+(for SVG, from the width and height or the viewBox of the root element).
+
+`image_size` keeps the results per path, mtime and size of the file, in
+memory and, with the ``image_size_cache`` setting (see
+`dotmpe.du.ext.parser.rst.directive.CacheSettings`), in a JSON file. The mpe
+rSt parser and the html-mpe writer save new sizes after each document, as
+processes of a pool do not run exit handlers; saving merges them with the
+sizes other processes wrote to the file meanwhile, holding a lock on
+``<file>.lock``. Used by the figure directive for ``figwidth: image``, and
+by the html-mpe writer for scaled images.
+"""
+import atexit
+import fcntl
+import json
+import os
+import re
+import struct
+
+
+svg_root_re = re.compile(r'<svg\b[^>]*>', re.S)
+svg_attr_re = r'\s%s\s*=\s*["\']\s*([0-9.]+)\s*(px)?\s*["\']'
+svg_viewbox_re = re.compile(
+        r'\sviewBox\s*=\s*["\']\s*[-0-9.]+[\s,]+[-0-9.]+[\s,]+([0-9.]+)[\s,]+'
+        r'([0-9.]+)\s*["\']')
+
+jpeg_sof_markers = frozenset(range(0xC0, 0xD0)) - frozenset([0xC4, 0xC8, 0xCC])
+
+
+def probe(path):
+    "Return the (width, height) of the image at `path`, or None. "
+    f = open(path, 'rb')
+    try:
+        head = f.read(26)
+        if head.startswith('\x89PNG\r\n\x1a\n') and head[12:16] == 'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:6] in ('GIF87a', 'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head.startswith('\xff\xd8'):
+            return probe_jpeg(f)
+        f.seek(0)
+        return probe_svg(f.read(4096))
+    finally:
+        f.close()
+
+def probe_jpeg(f):
+    "Find the size in the first start-of-frame segment. "
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != '\xff':
+            return None
+        code = ord(marker[1])
+        if code == 0xFF:
+            f.seek(-1, 1) # fill byte
+            continue
+        if code == 0xD8 or 0xD0 <= code <= 0xD7:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if code in jpeg_sof_markers:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            return width, height
+        f.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+def probe_svg(head):
+    m = svg_root_re.search(head)
+    if not m:
+        return None
+    root = m.group(0)
+    width = re.search(svg_attr_re % 'width', root)
+    height = re.search(svg_attr_re % 'height', root)
+    if width and height:
+        return int(float(width.group(1))), int(float(height.group(1)))
+    viewbox = svg_viewbox_re.search(root)
+    if viewbox:
+        return int(float(viewbox.group(1))), int(float(viewbox.group(2)))
+
+
+class ImageSizeCache(object):
+
+    """
+    Image sizes by absolute path, checked against the mtime and size of the
+    file. See the module docstring.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.entries = {}
+        "path -> [[mtime, size], [width, height] or None] "
+        self.changed = set()
+        "Paths probed since the last save. "
+
+    def read(self):
+        if self.path and os.path.exists(self.path):
+            return json.load(open(self.path))
+        return {}
+
+    def load(self, path):
+        "Use the cache file at `path`, or none. "
+        if path == self.path:
+            return
+        self.save()
+        self.path = path
+        self.entries = self.read()
+
+    def save(self):
+        "Write the sizes probed since the last save to the cache file. "
+        if self.path and self.changed:
+            lock = open(self.path + '.lock', 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                entries = self.read()
+                for key in self.changed:
+                    entries[key] = self.entries[key]
+                tmp = '%s.%i.tmp' % (self.path, os.getpid())
+                json.dump(entries, open(tmp, 'w'))
+                os.rename(tmp, self.path)
+            finally:
+                lock.close()
+            self.entries.update(entries)
+        self.changed = set()
+
+    def size(self, path):
+        stat = os.stat(path)
+        stamp = [stat.st_mtime, stat.st_size]
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        if not entry or entry[0] != stamp:
+            size = probe(path)
+            entry = self.entries[key] = [stamp, size and list(size)]
+            self.changed.add(key)
+        return entry[1] and tuple(entry[1])
+
+sizes = ImageSizeCache()
+"The image size cache shared by all documents in this process. "
+atexit.register(sizes.save)
+
+
+def save():
+    "Save the sizes probed since the last save, see the module docstring. "
+    sizes.save()
+
+
+def image_size(path, settings=None):
+    """
+    Return the (width, height) of the image at `path`, or None if it cannot
+    be read.
+    """
+    cache = getattr(settings, 'image_size_cache', None)
+    if cache:
+        sizes.load(cache)
+    try:
+        return sizes.size(path)
+    except (IOError, OSError, struct.error):
+        return None
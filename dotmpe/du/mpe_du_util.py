@@ -15,6 +15,8 @@ import logging
 from docutils import utils, nodes, frontend
 #from docutils.nodes import fully_normalize_name, make_id
 from docutils.parsers.rst import directives
+from dotmpe.du import nodeindex
+from dotmpe.du.nodeindex import nodes_of
 
 #from script_mpe.taxus.util import get_session
 from sqlalchemy.ext.declarative import declarative_base
@@ -793,10 +795,15 @@ Regex field-list parsing.
 
 field_re = '^\s*:%s:\s*([a-zA-Z0-9\.,\ _-]+)\s*$'
 
+field_patterns = {}
+"Compiled `field_re` per field name. "
+
 def extract_field(source, field, default=None, strip=False):
     # TODO: configurable body regex
     # TODO: case insensitive option
-    m = re.compile(field_re % field, re.M).search(source)
+    if field not in field_patterns:
+        field_patterns[field] = re.compile(field_re % field, re.M)
+    m = field_patterns[field].search(source)
     if m:
         return m.groups()[0].strip()
     else:
@@ -806,13 +813,76 @@ def extract_field(source, field, default=None, strip=False):
 def extract_modeline(source, strip=False):
     pass # TODO: extract_modeline
 
-def read_buildline(source, strip=False,
-        default_package='standalone',
-        default_class='Document',
-        field_name='build'):
-    "Read builder package and class-name from sentinel line formatted as rSt field.  "
 
-    builder_name = extract_field(source, field_name, strip=strip)
+"""
+Header field sniffing.
+"""
+
+header_field_re = re.compile(r'^:((?:[^:\\]|\\.)+):(?:\s+(.*))?$')
+adornment_re = re.compile(r'^([!-/:-@[-`{-~])\1+\s*$')
+
+def header_fields(source):
+    """
+    Return the fields of the field list at the start of `source`, which may
+    follow a title and subtitle, comments and blank lines, as a dict of
+    lower-cased field name to value. Continuation lines are joined by a space.
+    This does not parse the document, to select a builder or settings before
+    parsing.
+    """
+    fields = {}
+    lines = source.splitlines()
+    name = None
+    comment = False
+    for i, line in enumerate(lines):
+        m = header_field_re.match(line)
+        if m:
+            name = m.group(1).lower()
+            fields[name] = (m.group(2) or '').strip()
+        elif name:
+            if not line[:1].isspace() or not line.strip():
+                break
+            fields[name] = (fields[name] + ' ' + line.strip()).strip()
+        elif not line.strip() or adornment_re.match(line):
+            comment = False
+        elif line.startswith('..'):
+            comment = True
+        elif comment and line[:1].isspace():
+            continue
+        elif i+1 < len(lines) and adornment_re.match(lines[i+1]):
+            comment = False # title
+        else:
+            break
+    return fields
+
+sniff_size = 4096
+"Number of bytes `sniff_fields` reads from the start of a file. "
+
+sniffed = {}
+"path -> ((mtime, size), fields) "
+
+def sniff_fields(path, size=None):
+    """
+    Return the `header_fields` of the file at `path`, reading only its first
+    `sniff_size` bytes. Results are cached until the mtime or size of the
+    file changes.
+    """
+    stat = os.stat(path)
+    stamp = stat.st_mtime, stat.st_size
+    if path in sniffed and sniffed[path][0] == stamp:
+        return sniffed[path][1]
+    f = open(path, 'rb')
+    try:
+        head = f.read(size or sniff_size).decode('utf-8', 'replace')
+    finally:
+        f.close()
+    fields = header_fields(head)
+    sniffed[path] = stamp, fields
+    return fields
+
+def split_buildline(builder_name,
+        default_package='standalone',
+        default_class='Document'):
+    "Return the package and class-name of a builder field value. "
     if not builder_name:
         return default_package, default_class
 
@@ -825,6 +895,27 @@ def read_buildline(source, strip=False,
 
     return builder_name, default_class
 
+def read_buildline(source, strip=False,
+        default_package='standalone',
+        default_class='Document',
+        field_name='build'):
+    "Read builder package and class-name from sentinel line formatted as rSt field.  "
+
+    builder_name = extract_field(source, field_name, strip=strip)
+    return split_buildline(builder_name, default_package, default_class)
+
+def sniff_buildline(path,
+        default_package='standalone',
+        default_class='Document',
+        field_name='build'):
+    """
+    Like `read_buildline` for the file at `path`, but only the field list at
+    the start of the file is read (see `sniff_fields`).
+    """
+
+    builder_name = sniff_fields(path).get(field_name)
+    return split_buildline(builder_name, default_package, default_class)
+
 
 """
 Document visitors.
@@ -857,7 +948,7 @@ class FieldListVisitor(nodes.SparseNodeVisitor):
 def first_and_last_field_list(document):
     """
     """
-    field_lists = document.traverse(nodes.field_list)
+    field_lists = nodes_of(document, nodes.field_list)
 
     if len(field_lists) == 1:
         return (field_lists[0],)
@@ -869,6 +960,33 @@ def first_and_last_field_list(document):
         return ()
 
 
+def prune(document, predicate, node_class=nodes.Node):
+    """
+    Remove the nodes for which `predicate` holds from `document`, and
+    return how many were removed. `predicate` is a callable or a node class
+    (like the condition to traverse); `node_class` limits the nodes tested.
+    The matches are collected first, then the children of each parent
+    are filtered once, instead of one list.remove per match.
+    """
+    if isinstance(predicate, type):
+        node_class, predicate = predicate, None
+    parents = {}
+    for node in nodes_of(document, node_class):
+        if node.parent is None or (predicate and not predicate(node)):
+            continue
+        parents.setdefault(id(node.parent), (node.parent, set()))[1].add(
+                id(node))
+    count = 0
+    for parent, victims in parents.values():
+        children = [ child for child in parent.children
+                if id(child) not in victims ]
+        count += len(parent.children) - len(children)
+        parent.children = children
+    if count:
+        nodeindex.invalidate(document)
+    return count
+
+
 def get_log(
         name, level=logging.DEBUG,
         stdout=False, stdout_level=logging.INFO,
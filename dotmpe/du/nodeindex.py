@@ -0,0 +1,227 @@
+"""
+Per-document index of nodes by class, to replace repeated
+``document.traverse(SomeClass)`` walks by transforms.
+
+The index is built lazily by one walk over the document and kept as
+`document.node_index`. Lookups for a class return the nodes of that class and
+its subclasses in document order, as a new list.
+
+Building an index `track`\s its document. The first one wraps the
+`docutils.nodes.Element` methods that change children (append, insert, pop,
+remove, clear, item assignment and deletion, and so also extend, replace and
+replace_self) to count the mutations of tracked documents, as their
+``tree_generation``. Mutations of other documents are not counted, and cost
+one check while no tracked document is alive. An index built before the last
+mutation of its document is rebuilt on the next lookup. Code that changes
+``node.children`` directly should call `invalidate` with the document.
+
+`path_index` keeps a second per-document index, of the children of each
+visited element by class and position, to resolve paths like
+``document[0]/section[1]`` (see `dotmpe.du.ext.transform.include`).
+"""
+import heapq
+import weakref
+
+from docutils import nodes
+
+
+class NodeIndex(object):
+
+    """
+    Index the nodes of `document` by class. See `nodes_of`.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.generation = None
+
+    def __getstate__(self):
+        # Don't pickle the index with cached doctrees
+        return { 'document': self.document, 'generation': None }
+
+    def build(self):
+        "Walk the document once, recording positions per concrete node type. "
+        self.order = self.document.traverse()
+        self.positions = {}
+        for position, node in enumerate(self.order):
+            self.positions.setdefault(type(node), []).append(position)
+        self.cache = {}
+        self.generation = generation(self.document)
+        track(self.document)
+
+    def get(self, node_class):
+        """
+        Return the nodes that are instances of `node_class` in document order.
+        """
+        if self.generation != generation(self.document):
+            self.build()
+        if node_class not in self.cache:
+            lists = [ positions for t, positions in self.positions.items()
+                    if issubclass(t, node_class) ]
+            if len(lists) == 1:
+                positions = lists[0]
+            else:
+                positions = heapq.merge(*lists)
+            self.cache[node_class] = [ self.order[p] for p in positions ]
+        return list(self.cache[node_class])
+
+
+def node_index(document):
+    "Return the NodeIndex of `document`, creating it if needed. "
+    index = getattr(document, 'node_index', None)
+    if index is None:
+        index = document.node_index = NodeIndex(document)
+    return index
+
+def nodes_of(document, node_class):
+    """
+    Return all nodes of `node_class` in `document`, in document order. Like
+    ``document.traverse(node_class)``, but from the index.
+    """
+    return node_index(document).get(node_class)
+
+tracked = weakref.WeakSet()
+"Documents whose mutations are counted. "
+
+def track(document):
+    """
+    Count the mutations of `document` from now on. Indices and caches that
+    compare the `generation` of their document call this when they are
+    (re)built, also for documents that were unpickled.
+    """
+    install()
+    tracked.add(document)
+
+def generation(document):
+    "Return the mutation count of `document`. "
+    return getattr(document, 'tree_generation', 0)
+
+def invalidate(document):
+    "Make the indices of `document` rebuild on their next lookup. "
+    document.tree_generation = generation(document) + 1
+
+def note_mutation(node):
+    "Count a mutation of the document `node` belongs to, if it is tracked. "
+    if not tracked:
+        return
+    while node is not None:
+        document = node.document
+        if document is None and isinstance(node, nodes.document):
+            document = node
+        if document is not None:
+            if document in tracked:
+                invalidate(document)
+            return
+        node = node.parent
+
+
+class PathIndex(object):
+
+    """
+    Resolve location paths in `document`: sequences of (node class, ordinal)
+    steps from the document down. The children of an element are indexed by
+    class on first use, and resolved paths are remembered, until the tree
+    changes.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.generation = None
+
+    def __getstate__(self):
+        return { 'document': self.document, 'generation': None }
+
+    def reset(self):
+        self.children = {}
+        "id(parent), node class -> (parent, [children of class]) "
+        self.paths = {}
+        "path -> node "
+        self.generation = generation(self.document)
+        track(self.document)
+
+    def child(self, parent, node_class, ordinal):
+        """
+        Return the child at `ordinal` among the children of `parent` that are
+        instances of `node_class`, or None.
+        """
+        if self.generation != generation(self.document):
+            self.reset()
+        key = id(parent), node_class
+        if key not in self.children:
+            self.children[key] = parent, [ child for child in parent.children
+                    if isinstance(child, node_class) ]
+        matches = self.children[key][1]
+        if ordinal < len(matches):
+            return matches[ordinal]
+
+    def locate(self, path):
+        """
+        Return the node at `path`, a tuple of (node class, ordinal) steps.
+        A step that matches no child is skipped.
+        """
+        if self.generation != generation(self.document):
+            self.reset()
+        if path not in self.paths:
+            node = self.document
+            for node_class, ordinal in path:
+                node = self.child(node, node_class, ordinal) or node
+            self.paths[path] = node
+        return self.paths[path]
+
+    def insert(self, parent, index, node):
+        """
+        Insert `node` into `parent` at `index`, and keep the index valid if
+        that is the only change since it was last used.
+        """
+        current = self.generation == generation(self.document)
+        parent.insert(index, node)
+        if current:
+            for key in [ key for key in self.children if key[0] == id(parent) ]:
+                del self.children[key]
+            self.paths.clear()
+            self.generation = generation(self.document)
+
+
+def path_index(document):
+    "Return the PathIndex of `document`, creating it if needed. "
+    index = getattr(document, 'path_index', None)
+    if index is None:
+        index = document.path_index = PathIndex(document)
+    return index
+
+
+def _counting(method):
+    def mutator(self, *args):
+        note_mutation(self)
+        return method(self, *args)
+    mutator.__name__ = method.__name__
+    mutator.__doc__ = method.__doc__
+    mutator.counts_mutations = True
+    return mutator
+
+def _counting_item(method):
+    def mutator(self, key, *args):
+        if not isinstance(key, basestring):
+            note_mutation(self)
+        return method(self, key, *args)
+    mutator.__name__ = method.__name__
+    mutator.__doc__ = method.__doc__
+    mutator.counts_mutations = True
+    return mutator
+
+installed = False
+
+def install():
+    "Wrap the mutating Element methods, once. "
+    global installed
+    if installed:
+        return
+    installed = True
+    for name in ('append', 'insert', 'pop', 'remove', 'clear'):
+        method = getattr(nodes.Element, name).im_func
+        if not getattr(method, 'counts_mutations', False):
+            setattr(nodes.Element, name, _counting(method))
+    for name in ('__setitem__', '__delitem__'):
+        method = getattr(nodes.Element, name).im_func
+        if not getattr(method, 'counts_mutations', False):
+            setattr(nodes.Element, name, _counting_item(method))
@@ -29,9 +29,13 @@ import os
 import unittest
 
 import docutils
+from docutils import frontend
+from docutils.parsers import rst
 
 import dotmpe.du
+from dotmpe.du import comp
 from dotmpe.du.builder import Builder
+from dotmpe.du.ext.parser import rst as rst_mpe
 
 
 class DotmpeDuExtBuilderTest(unittest.TestCase):
@@ -79,6 +83,26 @@ class DotmpeDuExtBuilderTest(unittest.TestCase):
         self.assertEquals(builder.source_id, testfn)
         self.assertEquals(builder.source_class, docutils.io.FileInput)
 
+    def test_parser(self):
+        # the range recording parser is opt-in, see dotmpe.du.builder.htdocs
+        self.assertEquals(Builder.Parser, rst.Parser)
+        from dotmpe.du.builder import htdocs
+        self.assertEquals(htdocs.Builder.Parser, rst_mpe.Parser)
+
+    def test_cache_settings(self):
+        # from the html-mpe writer, or added by the Builder for other writers
+        for writer_name in 'html-mpe', 'null':
+            builder = Builder()
+            builder.prepare_initial_components()
+            builder.writer = comp.get_writer_class(writer_name)()
+            builder.set_settings_components()
+            settings = builder.get_settings(render_cache='/tmp/render')
+            self.assertEquals(settings.render_cache, '/tmp/render')
+            self.assertEquals(settings.image_size_cache, None)
+        settings = frontend.OptionParser(components=(
+            comp.get_writer_class('latex2e-mpe'),)).get_default_values()
+        self.assertEquals(settings.render_cache, None)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+"""
+Test the directory mode of the conversion tools (dotmpe.du.convert).
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from dotmpe.du import convert
+
+
+class ConvertTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.tmpdir, 'src')
+        self.dest_dir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(os.path.join(self.source_dir, 'sub'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, relpath, text):
+        open(os.path.join(self.source_dir, relpath), 'w').write(text)
+
+    def run_convert(self, *options):
+        out = StringIO()
+        argv = list(options) + [ '--jobs', '1', '--report', '5',
+                self.source_dir, self.dest_dir ]
+        failed = convert.cli_convert_tree(argv, 'standalone', 'rst',
+                'pseudoxml', 'pseudoxml', out=out)
+        return failed, out.getvalue()
+
+    def read(self, relpath):
+        return open(os.path.join(self.dest_dir, relpath)).read()
+
+    def test_rerun(self):
+        self.write('a.rst', "Text A.\n")
+        self.write(os.path.join('sub', 'b.rst'), "Text B.\n")
+        failed, out = self.run_convert()
+        self.assertEqual(failed, 0)
+        self.assert_("2 converted, 0 unchanged, 0 failed" in out, out)
+        manifest = convert.load_manifest(self.dest_dir)
+        self.assertEqual(sorted(manifest), [ 'a.rst',
+            os.path.join('sub', 'b.rst') ])
+        self.assert_('Text A.' in self.read('a.pxml'))
+
+        # nothing changed
+        failed, out = self.run_convert()
+        self.assert_("0 converted, 2 unchanged, 0 failed" in out, out)
+        self.assertEqual(convert.load_manifest(self.dest_dir), manifest)
+
+        # one source changed
+        self.write('a.rst', "Text A, changed.\n")
+        failed, out = self.run_convert()
+        self.assert_("1 converted, 1 unchanged, 0 failed" in out, out)
+        self.assert_('Text A, changed.' in self.read('a.pxml'))
+        changed = convert.load_manifest(self.dest_dir)
+        self.assertNotEqual(changed['a.rst'], manifest['a.rst'])
+        self.assertEqual(changed[os.path.join('sub', 'b.rst')],
+                manifest[os.path.join('sub', 'b.rst')])
+
+        # other settings, or a missing output file
+        failed, out = self.run_convert('--no-doc-title')
+        self.assert_("2 converted, 0 unchanged, 0 failed" in out, out)
+        os.remove(os.path.join(self.dest_dir, 'sub', 'b.pxml'))
+        failed, out = self.run_convert('--no-doc-title')
+        self.assert_("1 converted, 1 unchanged, 0 failed" in out, out)
+        failed, out = self.run_convert('--no-doc-title', '--force')
+        self.assert_("2 converted, 0 unchanged, 0 failed" in out, out)
+
+    def test_unknown_builder(self):
+        self.write('a.rst', ":build: no-such-builder\n\nText A.\n")
+        self.write(os.path.join('sub', 'b.rst'), "Text B.\n")
+        failed, out = self.run_convert('--builder-field', 'build')
+        self.assertEqual(failed, 1)
+        self.assert_("Failed a.rst: No builder "
+                "dotmpe.du.builder.no-such-builder" in out, out)
+        self.assert_("1 converted, 0 unchanged, 1 failed" in out, out)
+        self.assertEqual(sorted(convert.load_manifest(self.dest_dir)),
+                [ os.path.join('sub', 'b.rst') ])
+        self.assertFalse(os.path.exists(os.path.join(self.dest_dir,
+            'a.pxml')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,437 @@
+import anydbm
+import json
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
-import docutils
+import docutils.core
+from docutils import frontend, nodes, transforms, utils
 
 import dotmpe.du
-#from dotmpe.du.ext.transform import ...
+from dotmpe.du import frozen, imagesize, nodeindex
+from dotmpe.du.ext.reader import mpe
+from dotmpe.du.ext.transform import digest, generate, include, ranges
+from dotmpe.du.ext.writer import html
+from dotmpe.du.ext.parser.rst import Parser
 
 from util import DotmpeDuTest
 
 
 class DotmpeDuExtTransformTest(DotmpeDuTest): pass
 
+
+class RecordRangesTest(unittest.TestCase):
+
+    source = u"""Title
+=====
+
+Some *text*.
+
+- item one
+  continued
+
+term
+  definition
+"""
+
+    def setUp(self):
+        settings = frontend.OptionParser(components=(Parser,)
+                ).get_default_values()
+        self.document = utils.new_document('<test>', settings)
+        Parser().parse(self.source, self.document)
+
+    def span(self, node):
+        r = ranges.get_range(node)
+        return r[0], r[1], self.source[r[2]:r[3]]
+
+    def test_blocks(self):
+        doc = self.document
+        self.assertEqual(len(doc.ranges), len(doc.traverse(nodes.Element)))
+        self.assertEqual(self.span(doc.traverse(nodes.title)[0]),
+                (0, 2, u'Title\n====='))
+        self.assertEqual(self.span(doc.traverse(nodes.list_item)[0]),
+                (5, 7, u'- item one\n  continued'))
+        self.assertEqual(self.span(doc.traverse(nodes.term)[0]),
+                (8, 9, u'term'))
+        self.assertEqual(self.span(doc.traverse(nodes.definition)[0]),
+                (9, 10, u'definition'))
+
+    def test_inline(self):
+        emphasis = self.document.traverse(nodes.emphasis)[0]
+        self.assertEqual(self.span(emphasis), (3, 4, u'*text*'))
+
+    def test_new_node(self):
+        self.assertEqual(ranges.get_range(nodes.paragraph()), None)
+
+    def test_other_parsers(self):
+        # only with the source_ranges setting
+        from dotmpe.du.ext.parser import atlassian, simplereader
+        for parser in atlassian.Parser, simplereader.Parser:
+            for source_ranges in False, True:
+                document = docutils.core.publish_doctree(u'Some *text*.\n',
+                        parser=parser(), settings_overrides={
+                            'source_ranges': source_ranges,
+                            'input_encoding': 'unicode' })
+                self.assertEqual(hasattr(document, 'ranges'), source_ranges)
+            self.assertEqual(ranges.get_range(
+                document.traverse(nodes.paragraph)[0])[:2], (0, 1))
+
+    def test_include(self):
+        # the lines after an include are numbered from the included source
+        # on, and the included nodes have no range in the including source
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'inc.rst')
+            open(path, 'w').write('Some text.\n\nMore text.\n\n'
+                    '.. __: z\n')
+            source = (u'Text.\n\n.. include:: %s\n\nAfter `x`__\n\n'
+                    u'.. __: y\n' % path)
+            settings = frontend.OptionParser(components=(Parser,)
+                    ).get_default_values()
+            settings.report_level = 5
+            document = utils.new_document('<test>', settings)
+            Parser().parse(source, document)
+        finally:
+            shutil.rmtree(tmpdir)
+        paragraphs = document.traverse(nodes.paragraph)
+        self.assertEqual(len(paragraphs), 4)
+        self.assertEqual(ranges.get_range(paragraphs[1]), None)
+        self.assertEqual(ranges.get_range(paragraphs[2]), None)
+        start, end, offset, end_offset = ranges.get_range(paragraphs[3])
+        self.assertEqual(source[offset:end_offset].split('\n')[0],
+                u'After `x`__')
+
+
+class NodeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.document = docutils.core.publish_doctree(
+                RecordRangesTest.source + u"\n.. _a:\n\n.. _b:\n",
+                settings_overrides={'report_level': 5})
+
+    def test_traverse(self):
+        for node_class in (nodes.paragraph, nodes.Element, nodes.Text,
+                nodes.target, nodes.Invisible):
+            self.assertEqual(nodeindex.nodes_of(self.document, node_class),
+                    self.document.traverse(node_class))
+
+    def test_mutation(self):
+        doc = self.document
+        targets = nodeindex.nodes_of(doc, nodes.target)
+        self.assertEqual(len(targets), 2)
+        targets[0]['names'].append('c')
+        targets[0]['anonymous'] = 1
+        self.assertEqual(nodeindex.node_index(doc).generation,
+                nodeindex.generation(doc))
+        other = docutils.core.publish_doctree(u"Text.\n")
+        other += nodes.paragraph()
+        self.assertEqual(nodeindex.node_index(doc).generation,
+                nodeindex.generation(doc))
+        targets[0].parent.remove(targets[0])
+        self.assertEqual(nodeindex.nodes_of(doc, nodes.target), targets[1:])
+        doc += nodes.target()
+        self.assertEqual(len(nodeindex.nodes_of(doc, nodes.target)), 2)
+
+    def test_tracked(self):
+        # Only the mutations of documents with an index are counted
+        other = docutils.core.publish_doctree(u"Text.\n")
+        nodeindex.nodes_of(self.document, nodes.target)
+        other += nodes.paragraph()
+        self.assertEqual(nodeindex.generation(other), 0)
+        self.assertFalse(other in nodeindex.tracked)
+        paragraph = nodes.paragraph()
+        self.document += paragraph
+        paragraph += nodes.emphasis()
+        self.assertEqual(nodeindex.generation(self.document), 2)
+        # Also after unpickling
+        document = pickle.loads(pickle.dumps(self.document))
+        self.assertFalse(document in nodeindex.tracked)
+        self.assertEqual(len(nodeindex.nodes_of(document, nodes.target)), 2)
+        document += nodes.target()
+        self.assertEqual(len(nodeindex.nodes_of(document, nodes.target)), 3)
+
+
+class BreadcrumbTest(unittest.TestCase):
+
+    def publish(self, source, path):
+        return docutils.core.publish_doctree(source, reader=mpe.Reader(),
+                settings_overrides={ '_disable_config': True,
+                    'report_level': 5, 'breadcrumb': True,
+                    'breadcrumb_path': path })
+
+    def breadcrumbs(self, document):
+        "Return the text of the items of the breadcrumbs outside definitions. "
+        return [ [ item.astext() for item in breadcrumb.children ]
+            for breadcrumb in document.traverse(nodes.enumerated_list)
+                if not isinstance(breadcrumb.parent,
+                    nodes.substitution_definition) ]
+
+    def test_directory(self):
+        # The list for the directory is built once and copied per document
+        generate.PathBreadcrumb.directories.clear()
+        first = self.publish(u'Text.\n', '/a/b/one.rst')
+        second = self.publish(u'Text.\n', '/a/b/two.rst')
+        self.assertEqual(generate.PathBreadcrumb.directories.keys(),
+                [ ('/a/b', '/') ])
+        self.assertEqual(self.breadcrumbs(first),
+                [ [ u'/', u'a/', u'b/', u'one.rst' ] ])
+        self.assertEqual(self.breadcrumbs(second),
+                [ [ u'/', u'a/', u'b/', u'two.rst' ] ])
+        self.assertEqual(len(generate.PathBreadcrumb.directories[
+            ('/a/b', '/')]), 3)
+        self.assertEqual([ ref['refuri'] for ref
+            in second.traverse(nodes.reference) ], [ '/', '/a', '/a/b' ] * 2)
+        self.assertTrue(first.traverse(nodes.header))
+
+    def test_reference(self):
+        # An existing reference is used, the header gets no second one
+        document = self.publish(u'Path: |breadcrumb|.\n', '/a/doc.rst')
+        self.assertEqual(self.breadcrumbs(document),
+                [ [ u'/', u'a/', u'doc.rst' ] ])
+        self.assertEqual(document.traverse(nodes.header), [])
+        self.assertEqual(len(document[0].traverse(nodes.enumerated_list)), 1)
+
+    def test_has_substitution_ref(self):
+        settings = frontend.OptionParser(components=(Parser,)
+                ).get_default_values()
+        document = utils.new_document('<test>', settings)
+        document += nodes.paragraph('', '', nodes.substitution_reference(
+            'x', 'x', refname='Bread  Crumb'))
+        self.assertTrue(generate.has_substitution_ref(document,
+            'bread crumb'))
+        self.assertFalse(generate.has_substitution_ref(document, 'x'))
+
+
+class PruneTest(unittest.TestCase):
+
+    def test_prune(self):
+        document = docutils.core.publish_doctree(
+                u"Text__ and more__.\n\n__ http://a\n\n__ http://b\n\n"
+                u".. _named: http://c\n",
+                settings_overrides={'report_level': 5})
+        self.assertEqual(dotmpe.du.util.prune(document,
+            lambda t: t.get('anonymous'), nodes.target), 2)
+        targets = document.traverse(nodes.target)
+        self.assertEqual([ t['names'] for t in targets ], [['named']])
+        self.assertEqual(nodeindex.nodes_of(document, nodes.target), targets)
+        self.assertEqual(dotmpe.du.util.prune(document, nodes.target), 1)
+        self.assertEqual(document.traverse(nodes.target), [])
+
+
+class IncludeTest(unittest.TestCase):
+
+    def test_insert(self):
+        document = docutils.core.publish_doctree(
+                u"Title\n=====\n\nSub\n---\n\nText.\n\nSub2\n----\n\nText.\n",
+                settings_overrides={'doctitle_xform': False})
+        document.settings.include = [
+                'document[0]/section[0]/section[1],-1,html:<hr/>',
+                'section/section[1],0,xml:<br/>' ]
+        include.Include(document).apply()
+        section = document.traverse(nodes.section)[2]
+        self.assertEqual([ n.tagname for n in section ],
+                ['raw', 'title', 'paragraph', 'raw'])
+        self.assertEqual(section[-1].astext(), '<hr/>')
+        self.assertTrue(include.Include(document).find_location(
+            'section[0]/section[1]') is section)
+        self.assertRaises(transforms.TransformError,
+                include.Include(document).compile_path, 'section/make_id')
+
+
+class HeaderFieldsTest(unittest.TestCase):
+
+    def test_header_fields(self):
+        fields = dotmpe.du.util.header_fields(
+                u".. comment\n\n=====\nTitle\n=====\n\n:Build: mpe\n"
+                u":Author: A.\n   B.\n\nText\n\n:other: field\n")
+        self.assertEqual(fields, {'build': 'mpe', 'author': 'A. B.'})
+        self.assertEqual(dotmpe.du.util.header_fields(
+                u"Text\n\n:build: mpe\n"), {})
+        self.assertEqual(dotmpe.du.util.read_buildline(
+                u":build: dotmpe.du.builder.Page\n"),
+                ('dotmpe.du.builder', 'Page'))
+
+
+class FrozenTest(unittest.TestCase):
+
+    def test_text_of(self):
+        document = docutils.core.publish_doctree(
+                RecordRangesTest.source, settings_overrides={'report_level': 5})
+        frozen.freeze(document)
+        for node in document.traverse():
+            self.assertEqual(frozen.text_of(node), node.astext())
+            self.assertEqual(frozen.id_of(node), nodes.make_id(node.astext()))
+        paragraph = document.traverse(nodes.paragraph)[0]
+        paragraph += nodes.Text(u' More.')
+        self.assertEqual(frozen.text_of(paragraph), paragraph.astext())
+
+
+class ImageSizeTest(unittest.TestCase):
+
+    headers = {
+        '.png': '\x89PNG\r\n\x1a\n\0\0\0\rIHDR\0\0\0\x1e\0\0\0\x14\x08\0\0\0\0',
+        '.gif': 'GIF89a\x1e\0\x14\0' + '\0' * 16,
+        '.jpg': '\xff\xd8\xff\xe0\0\x04\0\0\xff\xc0\0\x0b\x08\0\x14\0\x1e\x01',
+        '.svg': '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 30 20">',
+    }
+
+    def test_probe(self):
+        for suffix, header in self.headers.items():
+            fd, path = tempfile.mkstemp(suffix)
+            os.write(fd, header)
+            os.close(fd)
+            try:
+                self.assertEqual(imagesize.probe(path), (30, 20))
+                self.assertEqual(imagesize.image_size(path), (30, 20))
+            finally:
+                os.remove(path)
+
+    def test_save(self):
+        tmpdir = tempfile.mkdtemp()
+        cache = os.path.join(tmpdir, 'sizes.json')
+        paths = []
+        for suffix in '.png', '.gif':
+            paths.append(os.path.join(tmpdir, 'image' + suffix))
+            open(paths[-1], 'wb').write(self.headers[suffix])
+        try:
+            # Two processes with their own cache, saving to one file
+            first, second = imagesize.ImageSizeCache(), \
+                    imagesize.ImageSizeCache()
+            first.load(cache)
+            second.load(cache)
+            self.assertEqual(first.size(paths[0]), (30, 20))
+            self.assertEqual(second.size(paths[1]), (30, 20))
+            first.save()
+            second.save()
+            self.assertEqual(sorted(json.load(open(cache))), sorted(paths))
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                    ['image.gif', 'image.png', 'sizes.json', 'sizes.json.lock'])
+
+            # The parser saves the sizes after each document
+            os.remove(cache)
+            settings = frontend.OptionParser(components=(Parser,)
+                    ).get_default_values()
+            settings.image_size_cache = cache
+            imagesize.sizes.entries.clear()
+            imagesize.image_size(paths[0], settings)
+            Parser().parse(u'Text.\n', utils.new_document('<test>', settings))
+            self.assertEqual(json.load(open(cache)).keys(), [paths[0]])
+
+            # Without the setting, the loaded sizes are kept
+            imagesize.image_size(paths[1])
+            self.assertEqual(imagesize.sizes.path, cache)
+            self.assertEqual(sorted(imagesize.sizes.entries), sorted(paths))
+        finally:
+            imagesize.sizes.load(None)
+            for name in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+
+    def test_concurrent_save(self):
+        tmpdir = tempfile.mkdtemp()
+        cache = os.path.join(tmpdir, 'sizes.json')
+        paths = []
+        for i in range(8):
+            paths.append(os.path.join(tmpdir, 'image%i.png' % i))
+            open(paths[-1], 'wb').write(self.headers['.png'])
+        try:
+            # Forked processes saving at the same time lose no sizes
+            pids = []
+            for path in paths:
+                pid = os.fork()
+                if not pid:
+                    sizes = imagesize.ImageSizeCache()
+                    sizes.load(cache)
+                    sizes.size(path)
+                    sizes.save()
+                    os._exit(0)
+                pids.append(pid)
+            for pid in pids:
+                self.assertEqual(os.waitpid(pid, 0)[1], 0)
+            self.assertEqual(sorted(json.load(open(cache))), paths)
+        finally:
+            for name in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+
+class SectionCacheTest(unittest.TestCase):
+
+    source = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'var',
+        'test-rst.1.document-5.full-rst-demo.rst')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = os.path.join(self.tmpdir, 'sections')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def publish(self, **settings):
+        settings.update({ '_disable_config': True, 'report_level': 5,
+            'embed_stylesheet': False, 'embed_script': False,
+            'output_encoding': 'utf-8' })
+        return docutils.core.publish_string(open(self.source).read(),
+                source_path=self.source, writer=html.Writer(),
+                settings_overrides=settings)
+
+    def test_later_transform(self):
+        # digests set by an earlier transform are not used for the cache
+        change = []
+
+        class EarlyDigest(transforms.Transform):
+            default_priority = 880
+            def apply(self):
+                digest.subtree_digest(self.document)
+
+        class Change(transforms.Transform):
+            default_priority = 950
+            def apply(self):
+                if change:
+                    self.document.traverse(nodes.paragraph)[-1] += \
+                            nodes.Text(u' Changed.')
+
+        class Writer(html.Writer):
+            def get_transforms(self):
+                return html.Writer.get_transforms(self) + [ EarlyDigest,
+                    Change ]
+
+        source = u'One\n===\n\nFirst.\n\nTwo\n===\n\nText.\n'
+        for run in 0, 1:
+            output = docutils.core.publish_string(source, writer=Writer(),
+                    settings_overrides={ '_disable_config': True,
+                        'embed_stylesheet': False, 'embed_script': False,
+                        'section_cache': self.cache })
+            change.append(run)
+        self.assert_('<p>Text. Changed.</p>' in output, output)
+
+    def test_digest(self):
+        one = docutils.core.publish_doctree(u'Title\n=====\n\nText.\n')
+        two = docutils.core.publish_doctree(u'\n\nTitle\n=====\n\nText.\n')
+        self.assertEqual(digest.subtree_digest(one),
+                digest.subtree_digest(two))
+        two[-1] += nodes.Text(u' More.')
+        self.assertNotEqual(digest.subtree_digest(one),
+                digest.subtree_digest(two))
+
+    def test_cached(self):
+        uncached = self.publish()
+        self.assertEqual(self.publish(section_cache=self.cache), uncached)
+        db = anydbm.open(self.cache, 'w')
+        keys = db.keys()
+        self.assert_(keys)
+        for key in keys:
+            db[key] = db[key] + '<!-- cached -->\n'
+        db.close()
+        # unchanged sections are read from the cache
+        cached = self.publish(section_cache=self.cache)
+        self.assertEqual(cached.count('<!-- cached -->\n'), len(keys))
+        self.assertEqual(cached.replace('<!-- cached -->\n', ''), uncached)
+        # and rendered again when the writer settings change
+        self.assertEqual(self.publish(section_cache=self.cache,
+            initial_header_level=2), self.publish(initial_header_level=2))
+
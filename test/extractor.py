@@ -14,12 +14,21 @@ Builder
 
 """
 
+import datetime
+import os
+import sqlite3
+import tempfile
 import unittest
 
-from docutils import readers, parsers, writers
+import docutils.core
+from docutils import nodes, readers, parsers, writers
 
 import dotmpe.du
 from dotmpe.du import builder
+from dotmpe.du.ext.extractor import docinfo, logbook
+from dotmpe.du.ext.reader import mpe
+from dotmpe.du.ext.transform import include, outline
+from dotmpe.du.ext.node.include import include as include_node
 #from dotmpe.du.ext import reader, parser, writer
 
 
@@ -40,6 +49,230 @@ class ExtractorTest(unittest.TestCase):
         #assert builder.stores['']
 
 
+class DocinfoTest(unittest.TestCase):
+
+    def test_parse_datetime(self):
+        parse = docinfo.parse_datetime
+        self.assertEqual(parse(u'2010-04-11'), datetime.datetime(2010, 4, 11))
+        self.assertEqual(parse(u'Mon, 12 Apr 2010 10:00:00 GMT'),
+                datetime.datetime(2010, 4, 12, 10))
+        self.assertEqual(parse(u'Apr. 2010'), datetime.datetime(2010, 4, 1))
+        self.assertEqual(parse(u'2010-04-11'), datetime.datetime(2010, 4, 11))
+        self.assertEqual(parse(u'yesterday'), None)
+        self.assertEqual(parse(u'mon, 12 apr 2010 10:00:00 gmt'),
+                datetime.datetime(2010, 4, 12, 10))
+        self.assertEqual(parse(u'Mon,  12 Apr 2010 10:00:00 GMT'),
+                datetime.datetime(2010, 4, 12, 10))
+
+    def test_document_record(self):
+        document = docutils.core.publish_doctree(u"Title\n=====\n\n"
+                u":created: 2010-04-11\n:Date: today\n\nText.\n")
+        self.assertEqual(docinfo.docinfo_fields(document),
+                [(u'created', u'2010-04-11'), ('date', u'today')])
+        self.assertEqual(dict(docinfo.document_record(document)), {
+            'source': '<string>', 'title': u'Title', 'ids': ['title'],
+            'created': '2010-04-11T00:00:00Z', 'updated': None })
+
+    def test_docinfo_fields_changed(self):
+        document = docutils.core.publish_doctree(u"Title\n=====\n\n"
+                u":created: 2010-04-11\n\nText.\n")
+        self.assertEqual(docinfo.docinfo_fields(document),
+                [(u'created', u'2010-04-11')])
+        field = document.traverse(nodes.field)[0]
+        field[1][0].replace_self(nodes.paragraph(u'', u'2010-04-12'))
+        self.assertEqual(docinfo.docinfo_fields(document),
+                [(u'created', u'2010-04-12')])
+        document.traverse(nodes.docinfo)[0] += nodes.author(u'', u'A.')
+        self.assertEqual(docinfo.docinfo_fields(document),
+                [(u'created', u'2010-04-12'), ('author', u'A.')])
+
+
+class OutlineDiffTest(unittest.TestCase):
+
+    source = (u"Log\n===\n:created: 2010-04-11\n:tags: a, b\n:project: x\n"
+            u":date: 2010-04-12\n\n"
+            u"2010-04-11\n----------\n- one\n- two\n\n"
+            u"2010-04-12\n----------\nText.\n")
+
+    changed = (u"Log\n===\n:created: 2010-04-11\n:tags: a, c\n"
+            u":date: 2010-04-12\n\n"
+            u"2010-04-11\n----------\n- one\n- two\n\n"
+            u"2010-04-12\n----------\nText.\n\nMore text.\n")
+
+    def setUp(self):
+        fd, self.digests = tempfile.mkstemp('.sqlite')
+        os.close(fd)
+        self.connection = sqlite3.connect(':memory:')
+        self.docinfo = docinfo.DocinfoStorage(sqlite3, self.connection)
+        self.logbook = logbook.LogBookStorage(sqlite3, self.connection)
+
+    def tearDown(self):
+        outline.close_digest_storages()
+        os.remove(self.digests)
+
+    def build(self, source, success=True):
+        document = docutils.core.publish_doctree(source,
+                source_path='log.rst', reader=mpe.Reader(),
+                settings_overrides={ 'outline_digests': self.digests,
+                    'report_level': 5 })
+        if success:
+            docinfo.Extractor(document).apply(unid='log.rst',
+                    storage=self.docinfo)
+            logbook.Extractor(document).apply(unid='log.rst',
+                    storage=self.logbook)
+        outline.finish_outline_diff(document, success)
+        return document
+
+    def mark_rows(self):
+        "Mark all rows, to tell which are written again. "
+        self.connection.execute("UPDATE docinfo SET value = 'old'")
+        self.connection.execute("UPDATE logbook_entry "
+                "SET blockitem_count = -1")
+        self.connection.commit()
+
+    def test_rebuild_changed(self):
+        self.build(self.source)
+        self.assertEqual(self.docinfo.fields('log.rst'), [
+            ('#date', 'date', '2010-04-12'),
+            ('log/created', 'created', '2010-04-11'),
+            ('log/project', 'project', 'x'),
+            ('log/tags', 'tags', 'a, b') ])
+        self.assertEqual(self.logbook.entries('log.rst'), [
+            ('log.rst#log/outline-2010-04-11', '2010-04-11', 1),
+            ('log.rst#log/outline-2010-04-12', '2010-04-12', 1) ])
+
+        self.mark_rows()
+        self.build(self.source)
+        self.assertEqual([ value for path, name, value
+            in self.docinfo.fields('log.rst') ], [ 'old' ] * 4)
+        self.assertEqual([ count for unid, date, count
+            in self.logbook.entries('log.rst') ], [ -1, -1 ])
+
+        self.build(self.changed)
+        self.assertEqual(self.docinfo.fields('log.rst'), [
+            ('#date', 'date', '2010-04-12'),
+            ('log/created', 'created', 'old'),
+            ('log/tags', 'tags', 'a, c') ])
+        self.assertEqual(self.logbook.entries('log.rst'), [
+            ('log.rst#log/outline-2010-04-11', '2010-04-11', -1),
+            ('log.rst#log/outline-2010-04-12', '2010-04-12', 2) ])
+        self.assertEqual(self.connection.execute("SELECT entry_count, "
+            "date_start, date_end FROM logbook").fetchall(),
+            [ (2, '2010-04-11', '2010-04-12') ])
+
+
+    def test_failed_extraction(self):
+        self.build(self.source)
+        self.build(self.changed, success=False)
+        self.assertEqual(outline.digest_storages.keys(), [ self.digests ])
+        # the digests of the failed run were not kept
+        self.mark_rows()
+        self.build(self.changed)
+        self.assertEqual(self.docinfo.fields('log.rst'), [
+            ('#date', 'date', '2010-04-12'),
+            ('log/created', 'created', 'old'),
+            ('log/tags', 'tags', 'a, c') ])
+        outline.close_digest_storages()
+        self.assertEqual(outline.digest_storages, {})
+
+
+class IncludeTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp('.rst')
+        os.write(fd, "Included *text*.\n\nSecond paragraph.\n")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_resolve_includes(self):
+        for endline, paragraphs in ((None, 2), (1, 1)):
+            document = docutils.core.publish_doctree(u"Text.\n")
+            document += include_node('', refuri=self.path, endline=endline)
+            include.resolve_includes(document)
+            self.assertEqual(len(document.traverse(nodes.paragraph)),
+                    paragraphs + 1)
+            self.assertEqual(document.traverse(include_node), [])
+        self.assertTrue(len(include.included.entries) >= 2)
+
+    def test_note_included(self):
+        fd, path = tempfile.mkstemp('.rst')
+        os.write(fd, "Text |sub| [#note]_ [cit]_ `anon`__.\n\n"
+                ".. |sub| replace:: substituted\n"
+                ".. [#note] Footnote.\n"
+                ".. [cit] Citation.\n"
+                "__ http://example.org/\n")
+        os.close(fd)
+        try:
+            rst = u"Title\n=====\n\n.. include:: %s\n" % path
+            settings = { 'include_nodes': True,
+                    'file_insertion_enabled': True }
+            document = docutils.core.publish_doctree(rst,
+                    reader=mpe.Reader(),
+                    settings_overrides=settings)
+        finally:
+            os.remove(path)
+        self.assertEqual(document.traverse(include_node), [])
+        self.assertEqual(document.traverse(nodes.system_message), [])
+        self.assertEqual(document.traverse(nodes.paragraph)[0].astext(),
+                u'Text substituted 1 cit anon.')
+        self.assertEqual(document.traverse(nodes.citation_reference)[0]['refid'],
+                'cit')
+        reference = document.traverse(nodes.reference)[0]
+        self.assertEqual(reference['refuri'], 'http://example.org/')
+
+    def publish_included(self, rst, fragment):
+        "Publish `rst` with include nodes, `%s` is the path of `fragment`. "
+        fd, path = tempfile.mkstemp('.rst')
+        os.write(fd, fragment)
+        os.close(fd)
+        try:
+            return docutils.core.publish_doctree(rst.replace('%s', path),
+                    reader=mpe.Reader(), settings_overrides={
+                        'include_nodes': True, 'file_insertion_enabled': True,
+                        'report_level': 5 })
+        finally:
+            os.remove(path)
+
+    def test_included_ids(self):
+        # the included nodes get new ids, also if included twice
+        document = self.publish_included(u"Text [#]_.\n\n"
+                u".. [#] Note.\n\n"
+                u".. include:: %s\n\n.. include:: %s\n",
+                "Included [#]_.\n\n.. [#] Included note.\n")
+        self.assertEqual(document.traverse(nodes.system_message), [])
+        ids = [ id for node in document.traverse(nodes.Element)
+                for id in node['ids'] ]
+        self.assertEqual(len(ids), len(set(ids)))
+        footnotes = document.traverse(nodes.footnote)
+        self.assertEqual([ f['names'] for f in footnotes ],
+                [ ['1'], ['2'], ['3'] ])
+        for ref in document.traverse(nodes.footnote_reference):
+            self.assertEqual(document.ids[ref['refid']]['backrefs'],
+                    ref['ids'])
+
+    def test_included_title(self):
+        # a title that is also in the including document is a duplicate
+        # implicit target, like with the standard include
+        document = self.publish_included(u"Title\n=====\n\nText.\n\n"
+                u"Section\n-------\n\n.. include:: %s\n",
+                "Section\n-------\n\nIncluded.\n")
+        sections = document.traverse(nodes.section)
+        self.assertEqual(len(sections), 2)
+        self.assertEqual([ s['dupnames'] for s in sections ],
+                [ ['section'], ['section'] ])
+        self.assertEqual(len(set([ s['ids'][0] for s in sections ])), 2)
+
+    def test_include_disabled(self):
+        settings = { 'include_nodes': True,
+                'file_insertion_enabled': False }
+        document = docutils.core.publish_doctree(u".. include:: missing\n",
+                reader=mpe.Reader(),
+                settings_overrides=settings)
+        self.assertEqual(len(document.traverse(nodes.system_message)), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
 
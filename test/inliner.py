@@ -0,0 +1,176 @@
+"""
+Test the single-scan inline parsers (dotmpe.du.ext.parser.inliner.ScanInliner).
+
+The simplereader Inliner is compared with the rSt Inliner, for strings with
+nested, escaped and quoted markup and for the paragraphs of the rSt documents
+in var/ that only use the markup it knows. The atlassian Inliner is checked
+on some strings and on the text blocks of the Confluence documents in var/.
+"""
+import glob
+import os
+import re
+import unittest
+
+import docutils.core
+from docutils import frontend, nodes, utils
+from docutils.parsers import rst
+from docutils.parsers.rst import languages, states
+
+from dotmpe.du.ext.parser import atlassian, simplereader
+
+
+vardir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'var')
+
+settings = frontend.OptionParser(components=(rst.Parser,)).get_default_values()
+settings.report_level = 5
+
+
+def parse(inliner, text):
+    """
+    Return the pformat of a paragraph with the nodes that `inliner` parses
+    from `text`, and the text of the messages. Each parse gets a new
+    document, so the ids of problematic nodes can be compared.
+    """
+    document = utils.new_document('<inliner>', settings)
+    paragraph = nodes.paragraph(text)
+    document += paragraph
+    inliner.init_customizations(settings)
+    memo = states.Struct(document=document, reporter=document.reporter,
+            language=languages.get_language('en'), title_styles=[],
+            section_level=0, section_bubble_up_kludge=0, inliner=inliner)
+    inlines, messages = inliner.parse(text, 1, memo, paragraph)
+    paragraph += inlines
+    return paragraph.pformat(), [ msg.astext() for msg in messages ]
+
+def paragraphs(path, parser):
+    "Return the source text of the paragraphs of the document at `path`. "
+    document = docutils.core.publish_doctree(open(path).read().decode('utf-8'),
+            source_path=path, parser=parser, settings_overrides={
+                '_disable_config': True, 'report_level': 5,
+                'input_encoding': 'unicode' })
+    return [ p.rawsource for p in document.traverse(nodes.paragraph)
+            if p.rawsource ]
+
+
+literal_re = re.compile(r'``.+?``', re.S)
+unknown_re = re.compile(r'`|\||\]_|_`|\\|::$')
+"Markup the simplereader Inliner does not know. "
+
+def simple_markup(text):
+    "Return true if `text` only uses the markup of the simplereader Inliner. "
+    return not unknown_re.search(literal_re.sub('', text))
+
+
+class SimpleInlinerTest(unittest.TestCase):
+
+    strings = [
+        u'plain text',
+        u'*emphasis* and **strong** and ``literal``',
+        u'*a **b** c*',
+        u'**a *b* c**',
+        u'``*not* **markup**``',
+        u'*emphasis with ``literal``*',
+        u'\\*not emphasis\\*',
+        u'*escaped \\* star*',
+        u'``literal \\``',
+        u'in*side* and in**side**',
+        u'quoted "*" and (**) and \'``\'',
+        u'*unclosed emphasis',
+        u'**unclosed strong',
+        u'``unclosed literal',
+        u'* no space',
+        u'name_ and anonymous__ and not_a_ref and name_.',
+        u'see http://example.org/path?q=1#frag and mailto:me@example.org.',
+        u'mail me@example.org, and *emphasis*.',
+        u'unknown:scheme',
+        u'<http://example.org> and (me@example.org)',
+        u'line one\n*two lines*\nthree',
+    ]
+    "Strings with the markup both Inliners handle. "
+
+    def assertSameParse(self, text):
+        self.assertEqual(parse(simplereader.Inliner(), text),
+                parse(states.Inliner(), text), repr(text))
+
+    def test_strings(self):
+        for text in self.strings:
+            self.assertSameParse(text)
+
+    def test_documents(self):
+        documents = glob.glob(os.path.join(vardir, 'test-rst.*.rst'))
+        self.assert_(documents)
+        compared = 0
+        for path in documents:
+            for text in paragraphs(path, rst.Parser()):
+                if simple_markup(text):
+                    self.assertSameParse(text)
+                    compared += 1
+        self.assert_(compared > 50, compared)
+
+    def test_rejected_uri(self):
+        # the rSt Inliner leaves the rest of the text after an unknown URI
+        # scheme unparsed, the ScanInliner continues after it
+        text, messages = parse(simplereader.Inliner(),
+                u'unknown:scheme and http://example.org')
+        self.assertEqual(text, '<paragraph>\n    unknown:scheme and \n'
+            '    <reference refuri="http://example.org">\n'
+            '        http://example.org\n')
+
+
+class AtlassianInlinerTest(unittest.TestCase):
+
+    def assertParse(self, text, expected):
+        self.assertEqual(parse(atlassian.Inliner(), text)[0],
+                '<paragraph>\n' + expected)
+
+    def test_effects(self):
+        self.assertParse(u'*a* _b_ ??c?? -d- +e+ ^f^ ~g~ {{h}}',
+            '    <strong>\n        a\n     \n'
+            '    <emphasis>\n        b\n     \n'
+            '    <title_reference>\n        c\n     \n'
+            '    <inline classes="deleted">\n        d\n     \n'
+            '    <inline classes="inserted">\n        e\n     \n'
+            '    <superscript>\n        f\n     \n'
+            '    <subscript>\n        g\n     \n'
+            '    <literal>\n        h\n')
+
+    def test_nested(self):
+        # like rSt, the content of a construct is not parsed again
+        self.assertParse(u'*a _b_ c* and _d *e* f_',
+            '    <strong>\n        a _b_ c\n     and \n'
+            '    <emphasis>\n        d *e* f\n')
+
+    def test_escaped(self):
+        self.assertParse(u'\\*not strong\\* and *a \\* b*',
+            '    *not strong* and \n    <strong>\n        a * b\n')
+        self.assertParse(u'{{a \\}} b}}',
+            '    <literal>\n        a \\}} b\n')
+
+    def test_unmatched(self):
+        text, messages = parse(atlassian.Inliner(), u'*unclosed')
+        self.assertEqual(text, '<paragraph>\n'
+            '    <problematic ids="id2" refid="id1">\n        *\n'
+            '    unclosed\n')
+        self.assertEqual(messages, [u'<inliner>:1: (WARNING/2) '
+            u'Inline strong start-string without end-string.'])
+
+    def test_documents(self):
+        documents = glob.glob(os.path.join(vardir, 'test-confluence.*.txt'))
+        self.assert_(documents)
+        for path in documents:
+            # the blocks of the source, the statemachine does not parse
+            # all of the Confluence documents
+            source = open(path).read().decode('utf-8')
+            for text in re.split(r'\n\s*\n', source):
+                inlines, messages = atlassian.Inliner().parse(text, 1,
+                        states.Struct(document=utils.new_document(path,
+                            settings), reporter=utils.new_reporter(path,
+                                settings), language=None), None)
+                # no text is dropped between or inside the constructs
+                self.assertEqual(u''.join([ node.rawsource
+                    for node in inlines ]), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
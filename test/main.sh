@@ -19,14 +19,21 @@ form
 sql_storage
 rstwriter
 du_ext_transform_reference
+du_ext_transform
+extractor
+atlassianparser
+inliner
+convert
+outline
+render
+xhtmlflat
 
 EOH
 
 
 # TODO
-#extractor
 #mediawiki
-#atlassianparser
+#rstwriter_util: RstTranslatorUnitTest
 #atlassianwriter
 #confluence
 #simplemuxdem
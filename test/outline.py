@@ -0,0 +1,136 @@
+"""
+Test the outline index and corpus (dotmpe.du.ext.writer.outline), and the
+index and query commands of tools/rst-outline.py.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import docutils.core
+
+from dotmpe.du.ext.writer import outline
+
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+fruit = 'Fruit\n  Apple\n    Red.\n  Pear\n    Green.\n\nVeg\n  Leek\n    Long.\n'
+fruit_outline = [ ('fruit', 1), ('fruit/apple', 2), ('fruit/pear', 4),
+        ('veg', 7), ('veg/leek', 8) ]
+
+
+class OutlineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        open(path, 'w').write(text)
+        return path
+
+
+class OutlineIndexTest(OutlineTestCase):
+
+    def test_index(self):
+        path = os.path.join(self.tmpdir, 'outline.idx')
+        outline.write_index(path, [ (u'b/c', 3), (u'a', 1), (u'b', 2),
+            (u'\xe9t\xe9', 5), (u'b', 4) ])
+        index = outline.OutlineIndex(path)
+        try:
+            self.assertEqual(len(index), 5)
+            self.assertEqual(list(index), [ (u'a', 1), (u'b', 2), (u'b', 4),
+                (u'b/c', 3), (u'\xe9t\xe9', 5) ])
+            keys = index.keys()
+            self.assertEqual(len(keys), 5)
+            self.assertEqual(keys[3], 'b/c')
+            self.assertEqual(index.find(u'b'), 2)
+            self.assertEqual(index.find(u'\xe9t\xe9'), 5)
+            self.assertEqual(index.find(u'c'), None)
+            self.assertEqual(list(index.prefixed(u'b')), [ (u'b', 2),
+                (u'b', 4), (u'b/c', 3) ])
+            self.assertEqual(list(index.prefixed(u'x')), [])
+            self.assertRaises(IndexError, index.__getitem__, 5)
+        finally:
+            index.close()
+        self.assertRaises(ValueError, outline.OutlineIndex,
+                self.write('other', 'not an index'))
+
+    def test_writer(self):
+        source = self.write('fruit.rst', fruit)
+        path = os.path.join(self.tmpdir, 'outline.idx')
+        docutils.core.publish_file(source_path=source,
+                destination_path=os.devnull, writer=outline.Writer(),
+                settings_overrides={ '_disable_config': True,
+                    'outline_format': 'index', 'outline_file': path })
+        index = outline.OutlineIndex(path)
+        try:
+            self.assertEqual(list(index), fruit_outline)
+        finally:
+            index.close()
+
+
+class OutlineCorpusTest(OutlineTestCase):
+
+    def setUp(self):
+        OutlineTestCase.setUp(self)
+        self.corpus_path = os.path.join(self.tmpdir, 'corpus.sqlite')
+        self.fruit = self.write('fruit.rst', fruit)
+        self.more = self.write('more.rst', 'Fruit\n  Plum\n    Blue.\n')
+
+    def test_update(self):
+        corpus = outline.OutlineCorpus(self.corpus_path)
+        paths = [ self.fruit, self.more ]
+        self.assertEqual(outline.update_corpus(corpus, paths), paths)
+        self.assertEqual(outline.update_corpus(corpus, paths), [])
+        self.assertEqual(corpus.documents(), paths)
+        corpus.close()
+
+        # reopen, change one document
+        self.write('more.rst', 'Fruit\n  Plum\n    Blue.\n  Fig\n    Too.\n')
+        corpus = outline.OutlineCorpus(self.corpus_path)
+        self.assertEqual(outline.update_corpus(corpus, paths), [ self.more ])
+        self.assertEqual(corpus.prefix('fruit/'), [
+            (self.fruit, 2, u'fruit/apple'), (self.more, 4, u'fruit/fig'),
+            (self.fruit, 4, u'fruit/pear'), (self.more, 2, u'fruit/plum') ])
+        self.assertEqual(corpus.glob('fruit'), [ (self.fruit, 1, u'fruit'),
+            (self.more, 1, u'fruit') ])
+        self.assertEqual(corpus.glob('*/p*'), [
+            (self.fruit, 4, u'fruit/pear'), (self.more, 2, u'fruit/plum') ])
+        self.assertEqual(corpus.term('Leek'), [ (self.fruit, 8, u'veg/leek') ])
+        corpus.remove(self.more)
+        self.assertEqual(corpus.documents(), [ self.fruit ])
+        self.assertEqual(corpus.prefix('fruit/p'), [
+            (self.fruit, 4, u'fruit/pear') ])
+        corpus.close()
+
+    def rst_outline(self, *args):
+        "Run tools/rst-outline.py, return its standard output. "
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        proc = subprocess.Popen([ sys.executable,
+            os.path.join(basedir, 'tools', 'rst-outline.py') ] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate()
+        self.assertEqual(proc.returncode, 0, err)
+        return out
+
+    def test_commands(self):
+        index = [ '--index', self.corpus_path ]
+        self.rst_outline('index', self.fruit, self.more, *index)
+        self.assertEqual(self.rst_outline('query', '--prefix', 'fruit/p',
+            *index), '%s:4\tfruit/pear\n%s:2\tfruit/plum\n' % (self.fruit,
+                self.more))
+        self.assertEqual(self.rst_outline('query', '--term', 'plum', *index),
+                '%s:2\tfruit/plum\n' % self.more)
+        self.rst_outline('query', '--remove', self.more, *index)
+        self.assertEqual(self.rst_outline('query', '--glob', '*/p*', *index),
+                '%s:4\tfruit/pear\n' % self.fruit)
+
+
+if __name__ == '__main__':
+    unittest.main()
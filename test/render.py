@@ -0,0 +1,92 @@
+"""
+Test the render cache of `RenderDirective` (dotmpe.du.ext.parser.rst.directive.render).
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import docutils.core
+from docutils.parsers.rst import directives
+
+from dotmpe.du.ext.parser.rst.directive import render
+
+
+class Upper(render.RenderDirective):
+
+    "Render the content in upper case, count the calls to `render`. "
+
+    option_spec = { 'prefix': directives.unchanged }
+
+    calls = 0
+
+    def render(self, raw):
+        Upper.calls += 1
+        return self.options.get('prefix', u'') + raw.upper()
+
+
+class RenderDirectiveTest(unittest.TestCase):
+
+    def setUp(self):
+        directives.register_directive('upper', Upper)
+        render.rendered.clear()
+        Upper.calls = 0
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        del directives._directives['upper']
+        render.rendered.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def publish(self, source, render_cache=None):
+        "Return the text of the raw nodes of `source`. "
+        document = docutils.core.publish_doctree(source, settings_overrides={
+            '_disable_config': True, 'report_level': 5,
+            'render_cache': render_cache })
+        return [ node.astext() for node in document.traverse()
+                if node.tagname == 'raw' ]
+
+    def test_memory(self):
+        source = '.. upper::\n\n   text\n\n.. upper::\n\n   text\n'
+        self.assertEqual(self.publish(source), [ u'TEXT', u'TEXT' ])
+        self.assertEqual(Upper.calls, 1)
+        self.assertEqual(self.publish(source), [ u'TEXT', u'TEXT' ])
+        self.assertEqual(Upper.calls, 1)
+        self.assertEqual(self.publish('.. upper::\n\n   other\n'),
+                [ u'OTHER' ])
+        self.assertEqual(Upper.calls, 2)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_directory(self):
+        directory = os.path.join(self.tmpdir, 'render')
+        source = '.. upper::\n\n   text\n'
+        self.assertEqual(self.publish(source, directory), [ u'TEXT' ])
+        self.assertEqual(Upper.calls, 1)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        # a new process reads the output from the directory
+        render.rendered.clear()
+        self.assertEqual(self.publish(source, directory), [ u'TEXT' ])
+        self.assertEqual(Upper.calls, 1)
+        self.assertEqual([ name for name in os.listdir(directory)
+            if name.endswith('.tmp') ], [])
+
+    def test_options(self):
+        self.publish('.. upper::\n\n   text\n')
+        self.assertEqual(self.publish('.. upper::\n   :prefix: >\n\n   text\n'),
+                [ u'>TEXT' ])
+        self.assertEqual(Upper.calls, 2)
+        Upper.renderer_version = '2'
+        try:
+            self.publish('.. upper::\n\n   text\n')
+        finally:
+            del Upper.renderer_version
+        self.assertEqual(Upper.calls, 3)
+
+    def test_render(self):
+        directives.register_directive('upper', render.RenderDirective)
+        self.assertRaises(NotImplementedError, self.publish,
+                '.. upper::\n\n   text\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
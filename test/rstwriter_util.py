@@ -3,6 +3,13 @@ import unittest
 from dotmpe.du.ext.writer import rst
 
 
+def output_buffer(fragments, **kwds):
+    body = rst.OutputBuffer(**kwds)
+    for fragment in fragments:
+        body.append(fragment)
+    return body
+
+
 class RstTranslatorUnitTest(unittest.TestCase):
 
     def test_current_whitespace(self):
@@ -19,7 +26,7 @@ class RstTranslatorUnitTest(unittest.TestCase):
             (['  test  '], '  '),
         ]
         for i, o in bodies:
-            w.body = i
+            w.body = output_buffer(i)
             r = w.current_whitespace # instance property under test
             self.assertEqual(r, o, "Mismatch for input %r, expected %r but got %r" % (i, o, r))
 
@@ -38,7 +45,7 @@ class RstTranslatorUnitTest(unittest.TestCase):
             (['  test  '], '  \n'),
         ]
         for i, o in bodies:
-            w.body = i
+            w.body = output_buffer(i)
             w.assure_newline() # instance method under test
             r = w.current_whitespace
             self.assertEqual(r, o, "Mismatch for input %r, expected %r but got %r" % (i, o, r))
@@ -58,7 +65,263 @@ class RstTranslatorUnitTest(unittest.TestCase):
             (['  test  '], '  \n\n'),
         ]
         for i, o in bodies:
-            w.body = i
+            w.body = output_buffer(i)
             w.assure_newblock() # instance method under test
             r = w.current_whitespace
             self.assertEqual(r, o, "Mismatch for input %r, expected %r but got %r" % (i, o, r))
+
+
+class OutputBufferUnitTest(unittest.TestCase):
+
+    def test_last_string_insert(self):
+        body = output_buffer(['Example', ' ', 'text:', '\n', '\n'])
+        x, y, c = body.last_string()
+        self.assertEqual((x, y, c), (2, 4, ':'))
+        body.insert(x, y, ':')
+        self.assertEqual(body.astext(), 'Example text::\n\n')
+        self.assertEqual(body.newlines, 2)
+
+    def test_flush(self):
+        from StringIO import StringIO
+        destination = StringIO()
+        body = output_buffer(['line %i\n' % i for i in range(10)] + ['last'],
+                destination=destination, lookback=4)
+        self.assert_(len(body.fragments) <= 5, body.fragments)
+        self.assertEqual(len(body), 11)
+        self.assertRaises(IndexError, body.insert, 0, 0, 'x')
+        body.flush()
+        self.assertEqual(destination.getvalue(),
+                ''.join(['line %i\n' % i for i in range(10)]) + 'last')
+
+
+class ContextStackUnitTest(unittest.TestCase):
+
+    def test_push_pop(self):
+        ctx = rst.ContextStack(defaults={'indent': ''})
+        self.assertEqual(ctx.indent, '')
+        ctx.indent += '  '
+        ctx.indent += '  '
+        self.assertEqual(ctx.indent, '    ')
+        self.assertEqual(ctx.depth('indent'), 1)
+        self.assertEqual(ctx.previous('indent'), '  ')
+        del ctx.indent
+        del ctx.indent
+        self.assertEqual(ctx.indent, '')
+        self.assertRaises(AttributeError, delattr, ctx, 'indent')
+        self.assertRaises(AttributeError, getattr, ctx, 'index')
+        self.assertRaises(KeyError, ctx.current, 'index')
+        self.assertRaises(KeyError, ctx.increment, 'index')
+        ctx.index = 0
+        self.assertEqual(ctx.increment('index'), 1)
+        self.assertEqual(ctx.values('index'), [1])
+
+    def test_append(self):
+        ctx = rst.ContextStack(defaults={'tree': []})
+        ctx.append('tree', 'a')
+        ctx.append('tree', 'b')
+        tree = ctx.tree
+        self.assertEqual(len(tree), 2)
+        self.assertEqual((tree[0], tree[-1], tree[-2]), ('a', 'b', 'a'))
+        self.assertEqual(list(tree), ['a', 'b'])
+        self.assertEqual(list(tree + ['c']), ['a', 'b', 'c'])
+        del ctx.tree
+        self.assertEqual(list(ctx.tree), ['a'])
+
+
+class RstPatchUnitTest(unittest.TestCase):
+
+    source = u"""\
+Title
+=====
+Intro paragraph.
+
+Section
+-------
+
+First paragraph
+of section.
+
+.. _target: http://example.org/
+.. _other: http://example.net/
+
+Last paragraph.
+"""
+
+    nested = u"""\
+Chapter
+=======
+
+Intro.
+
+Section
+-------
+
+Term
+  Definition.
+
+  Another term
+    Nested definition.
+
+Subsection
+``````````
+
+Paragraph
+in subsection.
+
+Other section
+-------------
+
+Last paragraph.
+"""
+
+    def parse(self, source, source_path=None, parser=None):
+        from docutils.core import publish_doctree
+        from dotmpe.du.ext.parser.rst import Parser
+        overrides = { '_disable_config': True, 'report_level': 5,
+                'rst_mode': 'patch', 'output_encoding': 'unicode' }
+        return publish_doctree(source, source_path=source_path,
+                parser=parser or Parser(), settings_overrides=overrides)
+
+    def write(self, document):
+        from docutils import io
+        # Write with the transformer of the parse, which has the source text
+        return rst.Writer().write(document, io.StringOutput(encoding='unicode'))
+
+    def patch(self, dirty=None, source=None):
+        from docutils import nodes
+        from dotmpe.du.ext.transform.ranges import mark_dirty
+        document = self.parse(source or self.source)
+        if dirty is not None:
+            paragraph = document.traverse(nodes.paragraph)[dirty]
+            paragraph[:] = [ nodes.Text(u'Changed paragraph.') ]
+            mark_dirty(paragraph)
+        return self.write(document)
+
+    def read(self, name):
+        import os
+        from docutils import io
+        path = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), 'var', name)
+        return path, io.FileInput(source_path=path, encoding='utf-8').read()
+
+    def test_unchanged(self):
+        self.assertEqual(self.patch(), self.source)
+        self.assertEqual(self.patch(source=self.nested), self.nested)
+        for name in ('test-rst.2.sections.rst', 'test-rst.9.definition-list-1.rst',
+                'test-rst.9.definition-list-2.rst'):
+            path, source = self.read(name)
+            self.assertEqual(self.write(self.parse(source, path)), source)
+
+    def test_round_trip(self):
+        # Unchanged documents are copied, including the parts the transforms
+        # replaced, like the docinfo and contents
+        import glob, os
+        from docutils import io
+        basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        paths = glob.glob(os.path.join(basedir, 'doc', '*.rst')) + \
+                glob.glob(os.path.join(basedir, 'var', 'test-rst.*.rst'))
+        self.assert_(paths)
+        for path in paths:
+            source = io.FileInput(source_path=path, encoding='utf-8').read()
+            self.assertEqual(self.write(self.parse(source, path)), source,
+                    path)
+
+    def test_transformed(self):
+        import os
+        from docutils import io, nodes
+        from dotmpe.du.ext.transform.ranges import mark_dirty
+        path = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), 'doc', 'links.rst')
+        source = io.FileInput(source_path=path, encoding='utf-8').read()
+        document = self.parse(source, path)
+        self.assertTrue(document.traverse(nodes.docinfo))
+        for paragraph in document.traverse(nodes.paragraph):
+            if paragraph.astext().startswith('In HTML'):
+                paragraph[:] = [ nodes.Text(u'Changed paragraph.') ]
+                mark_dirty(paragraph)
+        self.assertEqual(self.write(document), source.replace(
+            u'In HTML it is possible to provide for link descriptions in the '
+            u'document header\n(but which often are not granted any real '
+            u'estate by the browser though).\nNevertheless, these are '
+            u'*essential* for writing Web pages.', u'Changed paragraph.'))
+
+    def test_no_ranges(self):
+        from docutils.parsers.rst import Parser
+        document = self.parse(self.source, parser=Parser())
+        self.assertFalse(hasattr(document, 'ranges'))
+        document.settings.rst_mode = 'full'
+        expected = self.write(document)
+        document.settings.rst_mode = 'patch'
+        self.assertEqual(self.write(document), expected)
+
+    def test_nested(self):
+        self.assertEqual(self.patch(0, self.nested), self.nested.replace(
+            u'Intro.', u'Changed paragraph.'))
+        self.assertEqual(self.patch(3, self.nested), self.nested.replace(
+            u'Paragraph\nin subsection.', u'Changed paragraph.'))
+        # Nested definitions are translated with their list
+        patched = self.patch(2, self.nested)
+        self.assertTrue(u'    Changed paragraph.\n' in patched)
+        self.assertEqual(patched.replace(u'Changed paragraph.',
+            u'Nested definition.'), self.nested)
+
+    def test_docinfo(self):
+        from docutils import nodes
+        path, source = self.read('test-rst.22.docinfo.rst')
+        document = self.parse(source, path)
+        self.assertTrue(document.traverse(nodes.docinfo))
+        patched = self.write(document)
+        # The docinfo fields are copied once, in place of the field list
+        self.assertEqual(patched.count(u':Dedication:'), 1)
+        self.assertEqual(patched.lower().count(u':abstract:'), 1)
+        self.assertEqual(patched.count(u'For Docutils users & co-developers.'),
+                1)
+        self.assertTrue(patched.startswith(u'DocInfo\n========\n'))
+        reparsed = self.parse(patched)
+        self.assertEqual(
+            [ n.astext() for n in reparsed.traverse(nodes.topic) ],
+            [ n.astext() for n in document.traverse(nodes.topic) ])
+
+    def test_changed(self):
+        self.assertEqual(self.patch(0), self.source.replace(
+            u'Intro paragraph.', u'Changed paragraph.'))
+        self.assertEqual(self.patch(1), self.source.replace(
+            u'First paragraph\nof section.', u'Changed paragraph.'))
+        self.assertEqual(self.patch(2), self.source.replace(
+            u'Last paragraph.', u'Changed paragraph.'))
+
+
+class RstStreamUnitTest(unittest.TestCase):
+
+    source = RstPatchUnitTest.source + u"""
+Other section
+-------------
+
+Paragraph.
+"""
+
+    def test_stream(self):
+        import os, tempfile
+        from docutils import io
+        from docutils.core import publish_doctree
+        overrides = { '_disable_config': True, 'report_level': 5 }
+        document = publish_doctree(self.source, settings_overrides=overrides)
+        expected = rst.Writer().write(document, io.StringOutput(
+            encoding='unicode'))
+        fd, path = tempfile.mkstemp('.rst')
+        os.close(fd)
+        try:
+            writer = rst.Writer()
+            destination = io.FileOutput(destination_path=path,
+                    encoding='utf-8')
+            written = []
+            write = destination.write
+            def write_part(data):
+                written.append(data)
+                return write(data)
+            destination.write = write_part
+            self.assertEqual(writer.write(document, destination), None)
+            self.assert_(len(written) > 1)
+            self.assertEqual(open(path).read().decode('utf-8'), expected)
+        finally:
+            os.unlink(path)
@@ -7,11 +7,16 @@ TODO: just the beginning of extractor testing.
 
 """
 import os
+import shutil
+import tempfile
 
 import unittest
 import sqlite3
 
 from dotmpe.du.ext.extractor import SQLiteExtractorStorage
+from dotmpe.du.ext.extractor.form2 import FormExtractor, SQLiteFormStorage
+from dotmpe.du import frontend
+from dotmpe.du.builder import form
 
 
 class TestStorage( SQLiteExtractorStorage ):
@@ -50,6 +55,89 @@ class StorageTest(unittest.TestCase):
 
         os.unlink( dbref )
 
+    def test__form_storage(self):
+        connection = sqlite3.connect(':memory:')
+        store = SQLiteFormStorage( None, connection, specs=[
+            ('my-integer', 'int'),
+            ('my-string', 'str'),
+            ('my-cs-list', 'cs-list,str', { 'append': True }),
+        ], batch_size=2 )
+        store.store('a', { 'my-integer': 1, 'my-string': 'Foo',
+            'my-cs-list': [ u'1', u'2' ] })
+        store.store('b', { 'my-integer': 2 })
+        store.store('a', { 'my-integer': 3, 'my-cs-list': [ u'3' ] })
+
+        columns = store.export_columns()
+        self.assertEquals( columns['unid'], [ 'a', 'b' ] )
+        self.assertEquals( columns['my-integer'], [ 3, 2 ] )
+        self.assertEquals( columns['my-string'], [ None, None ] )
+        self.assertEquals( columns['my-cs-list'], [ [ '3' ], [] ] )
+
+        store.clear('a')
+        self.assertEquals( store.export_columns('my-integer'),
+                { 'unid': [ 'b' ], 'my-integer': [ 2 ] } )
+
+    def test__form_storage_close(self):
+        connection = sqlite3.connect(':memory:')
+        store = SQLiteFormStorage( None, connection, specs=[
+            ('my-integer', 'int'),
+        ] )
+        store.store('a', { 'my-integer': 1 })
+        store.store('b', { 'my-integer': 2 })
+        c = connection.cursor()
+        c.execute(""" SELECT unid, my_integer FROM form ORDER BY unid """)
+        self.assertEquals( c.fetchall(), [] )
+
+        store.close()
+        c.execute(""" SELECT unid, my_integer FROM form ORDER BY unid """)
+        self.assertEquals( c.fetchall(), [ ('a', 1), ('b', 2) ] )
+
+    def test__builder_close_extractors(self):
+        connection = sqlite3.connect(':memory:')
+
+        class FormBuilder(form.Builder):
+            settings_default_overrides = {
+                'form_fields_spec': [ ('my-integer', 'int') ],
+            }
+            store_params = {
+                'dotmpe.du.ext.extractor.form2.SQLiteFormStorage': (
+                    (), {'module': None, 'connection': lambda o: connection,
+                        'specs': form._get_form_specs}),
+            }
+
+        builder = FormBuilder()
+        builder.prepare(**builder.store_params)
+        xcls, store = builder.extractors[0]
+        self.assert_( xcls is FormExtractor )
+        self.assert_( isinstance(store, SQLiteFormStorage) )
+        store.store('a', { 'my-integer': 1 })
+
+        builder.close_extractors()
+        c = connection.cursor()
+        c.execute(""" SELECT unid, my_integer FROM form """)
+        self.assertEquals( c.fetchall(), [ ('a', 1) ] )
+
+    def test__form_builder_submit(self):
+        tmpdir = tempfile.mkdtemp()
+        source = os.path.join(tmpdir, 'form.rst')
+        open(source, 'w').write("Form\n====\n\n:my-integer: 3\n")
+        dbref = os.path.join(tmpdir, 'form.db')
+
+        class FormBuilder(form.Builder):
+            settings_default_overrides = {
+                'form_db': dbref,
+                'form_fields_spec': [ ('my-integer', 'int') ],
+            }
+
+        try:
+            frontend.cli_process(['--form-process=submit', source],
+                    builder=FormBuilder())
+            c = sqlite3.connect(dbref).cursor()
+            c.execute(""" SELECT unid, my_integer FROM form """)
+            self.assertEquals( c.fetchall(), [ (source, 3) ] )
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__': unittest.main()
 
@@ -0,0 +1,98 @@
+"""
+Test the flattener registry (dotmpe.du.flatten) and the xhtml-flat writer,
+comparing its output for some of the rSt documents in var/ with the
+``.xhtml`` file next to each.
+"""
+import os
+import unittest
+
+import docutils.core
+from docutils import nodes
+
+from dotmpe.du import comp, flatten
+from dotmpe.du.flatten import T, Tag, iterflatten
+from dotmpe.du.ext.writer import xhtmlflat # registers the node flatteners
+
+
+vardir = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'var')
+
+xhtml_docs = [
+    'test-rst.1.document-5.full-rst-demo.rst',
+    'test-rst.5.inline-1.rst',
+    'test-rst.22.docinfo.rst',
+    'test-rst.24.references.rst',
+]
+"Documents in var/ with the expected xhtml-flat output as ``.xhtml``. "
+
+
+def publish(rst_file):
+    "Return the xhtml-flat output for `rst_file` in var/. "
+    path = os.path.join(vardir, rst_file)
+    writer = comp.get_writer_class('xhtml-flat')()
+    return docutils.core.publish_string(open(path).read(), source_path=path,
+            writer=writer, settings_overrides={ '_disable_config': True,
+                'output_encoding': 'utf-8', 'report_level': 5 })
+
+
+class FlattenTest(unittest.TestCase):
+
+    def test_tags(self):
+        self.assertEqual(flatten.flatten(T.p(class_='note')[ u'a < b',
+            T.br, T.em[ 'x' ] ]),
+            u'<p class="note">a &lt; b<br /><em>x</em></p>')
+        self.assertEqual(flatten.flatten(T.div(data_x=1, hidden=None)),
+            u'<div data-x="1"></div>')
+        self.assertEqual(flatten.flatten(T.span(class_=['a', 'b'])),
+            u'<span class="a b"></span>')
+        self.assert_(isinstance(T.div(), Tag))
+        self.assertEqual(flatten.flatten(T.hr), u'<hr />')
+
+    def test_render(self):
+        tag = T.ul(render=lambda tag, data: [ T.li[ i ] for i in data ],
+                data=[ 1, 2 ])
+        self.assertEqual(flatten.flatten(tag), u'<li>1</li><li>2</li>')
+
+    def test_iterflatten(self):
+        chunks = list(iterflatten([ T.p[ u'one' ], (u'two', T.br) ]))
+        self.assertEqual(chunks, [ u'<p>', u'one', u'</p>', u'two',
+            u'<br />' ])
+        self.assertEqual(list(iterflatten(flatten.comment(u'a--b'))),
+            [ u'\n<!--\na- -b\n-->\n' ])
+        self.assertEqual(list(iterflatten(3)), [ u'3' ])
+
+    def test_lookup(self):
+        class Base(object): pass
+        class Derived(Base): pass
+        flatten.register_flattener(Base, lambda o: u'base')
+        try:
+            self.assertEqual(flatten.flatten(Derived()), u'base')
+            flatten.register_flattener(Derived, lambda o: [ u'derived' ],
+                    generator=True)
+            self.assertEqual(flatten.lookup(Derived)[1], True)
+            self.assertEqual(flatten.flatten(Derived()), u'derived')
+            self.assertEqual(flatten.flatten(Base()), u'base')
+        finally:
+            flatten.unregister_flattener(Base)
+            flatten.unregister_flattener(Derived)
+        self.assertEqual(flatten.lookup(Derived), (None, False))
+
+
+class XHTMLFlatWriterTest(unittest.TestCase):
+
+    def test_documents(self):
+        for rst_file in xhtml_docs:
+            expected = open(os.path.join(vardir,
+                os.path.splitext(rst_file)[0] + '.xhtml')).read()
+            self.assertEqual(publish(rst_file), expected, rst_file)
+
+    def test_authors(self):
+        authors = nodes.authors('', nodes.author('', u'Me'),
+                nodes.author('', '', nodes.emphasis('', u'I')))
+        self.assertEqual(flatten.flatten(authors),
+                u'<dt class="authors">Authors</dt>\n'
+                u'<dd class="authors">Me; <em>I</em></dd>\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
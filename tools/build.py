@@ -61,6 +61,11 @@ E.g. easily have a custom publisher for standard Du components::
     rst2rst
     rst2rst-mpe
 
+Conversion scripts also accept a source and destination directory, to convert
+all files below the source with a pool of workers (see `dotmpe.du.convert`)::
+
+    atlassian2rst --jobs 4 confluence-export/ rst/
+
 XXX: not all parser/reader pairs will work. Likewise not all documents with every writer.
 """
 import os
@@ -74,7 +79,7 @@ try:
 except:
     pass
 
-from dotmpe.du import mpe_du_util as util, frontend, comp
+from dotmpe.du import mpe_du_util as util, frontend, comp, convert
 import dotmpe.du.ext # register extensions
 
 
@@ -154,6 +159,17 @@ if action == 'proc': #
     log.info("Starting Du processor: "+tag)
     frontend.cli_process(sys.argv[1:], None, module_name)
 
+elif action == 'pub' and \
+        convert.is_tree_argv(sys.argv[1:]): # Convert a directory tree
+    log.info("Starting Du tree conversion")
+    sys.exit(convert.cli_convert_tree(
+            sys.argv[1:],
+            reader_name=reader_name,
+            parser_name=parser_name,
+            writer_name=writer_name,
+            target_format=target_format,
+            description=description) and 1 or 0)
+
 elif action == 'pub': # Render src to dest
     log.info("Starting Du publish")
     frontend.cli_render(
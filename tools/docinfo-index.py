@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Write an index of the docinfo of many documents.
+
+Usage::
+
+    docinfo-index.py [--jobs N] [--format tsv|jsonl] [--suffix .rst] <path>...
+
+Paths may be files or directories, which are searched for files with the
+suffix. Documents are parsed by a pool of workers. For each document a line
+with the source, title, ids, created and updated datetime is printed, in the
+order of the arguments.
+"""
+import optparse
+import os
+import sys
+
+from dotmpe.du import convert
+from dotmpe.du.ext.extractor import docinfo
+
+
+def document_paths(args, suffix):
+    for arg in args:
+        if os.path.isdir(arg):
+            for relpath in convert.source_files(arg, suffix):
+                yield os.path.join(arg, relpath)
+        else:
+            yield arg
+
+def main(argv=None):
+    prsr = optparse.OptionParser(usage=__doc__.strip().split('\n\n')[1])
+    prsr.add_option('--jobs', type='int', default=0)
+    prsr.add_option('--format', choices=('tsv', 'jsonl'), default='tsv')
+    prsr.add_option('--suffix', default='.rst')
+    prsr.add_option('--parser', default='rst')
+    opts, args = prsr.parse_args(argv)
+    if not args:
+        prsr.error('Expected one or more paths')
+    failed = 0
+    for record in docinfo.index_documents(document_paths(args, opts.suffix),
+            opts.jobs, parser_name=opts.parser):
+        if 'error' in record:
+            failed += 1
+            print >>sys.stderr, "Failed %s: %s" % (record['source'],
+                    record['error'])
+            continue
+        print docinfo.format_record(record, opts.format)
+    return failed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
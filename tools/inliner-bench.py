@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Time inline parsing of long single paragraphs.
+
+Usage::
+
+    inliner-bench.py [--rounds N] [--sizes 1,8,64]
+
+For each size (in KB), a paragraph of plain words with inline markup mixed
+in is parsed by the rSt Inliner (which searches the remaining text after
+each construct) and by the simplereader and atlassian Inliners (which scan
+once with a combined pattern). Prints seconds per round.
+"""
+import optparse
+import sys
+import time
+
+from docutils import frontend, nodes, utils
+from docutils.parsers import rst
+from docutils.parsers.rst import languages, states
+
+from dotmpe.du.ext.parser import simplereader, atlassian
+
+
+words = {
+    'rst': u'plain words *emphasis* more **strong** text ``literal`` ref_ and',
+    'simplereader': u'plain words *emphasis* more **strong** text ``literal`` ref_ and',
+    'atlassian': u'plain words *strong* more _emphasis_ text {{mono}} ^sup^ and',
+}
+
+def inliners():
+    rst_inliner = states.Inliner()
+    settings = frontend.OptionParser(components=(rst.Parser,)
+            ).get_default_values()
+    rst_inliner.init_customizations(settings)
+    return [
+        ('rst', rst_inliner),
+        ('simplereader', simplereader.Inliner()),
+        ('atlassian', atlassian.Inliner()),
+    ]
+
+def main(argv=None):
+    prsr = optparse.OptionParser(usage=__doc__.strip().split('\n\n')[1])
+    prsr.add_option('--rounds', type='int', default=3)
+    prsr.add_option('--sizes', default='1,8,64')
+    opts, args = prsr.parse_args(argv)
+    settings = frontend.OptionParser(components=(rst.Parser,)
+            ).get_default_values()
+    settings.report_level = 5
+    for size in map(int, opts.sizes.split(',')):
+        for name, inliner in inliners():
+            text = words[name]
+            text = (text + u'\n') * (size * 1024 / len(text) + 1)
+            document = utils.new_document('<bench>', settings)
+            memo = states.Struct(document=document,
+                    reporter=document.reporter,
+                    language=languages.get_language('en'))
+            start = time.time()
+            for i in range(opts.rounds):
+                result, messages = inliner.parse(text, 1, memo,
+                        nodes.paragraph())
+            print "%4iKB %-12s %8.4fs %6i nodes" % (size, name,
+                    (time.time() - start) / opts.rounds, len(result))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,10 +1,63 @@
 #!/usr/bin/env python
+"""
+Publish outline of rSt document, or index and query outlines of many.
+
+Usage::
+
+    rst-outline.py [docutils options] <source> [<destination>]
+    rst-outline.py index --index <file> <source>...
+    rst-outline.py query --index <file> (--prefix|--glob|--term) <query>
+    rst-outline.py query --index <file> --remove <source>...
+
+Index adds or updates the outline of each source that changed since it was
+last indexed. Query prints ``document:line<TAB>path`` for each hit.
+"""
+import optparse
 import os
 import sys
+import time
 
 from dotmpe.du import frontend, comp
 
 
+def index_main(argv):
+    from dotmpe.du.ext.writer import outline
+    prsr = optparse.OptionParser(usage=__doc__.strip().split('\n\n')[1])
+    prsr.add_option('--index', default='.outline.sqlite', metavar='FILE')
+    prsr.add_option('--prefix')
+    prsr.add_option('--glob')
+    prsr.add_option('--term')
+    prsr.add_option('--remove', action='store_true')
+    opts, args = prsr.parse_args(argv[1:])
+    corpus = outline.OutlineCorpus(opts.index)
+    start = time.time()
+    if argv[0] == 'index':
+        updated = outline.update_corpus(corpus, args)
+        print >>sys.stderr, "Updated %i of %i documents (%.3fs)" % (
+                len(updated), len(args), time.time() - start)
+    elif opts.remove:
+        for path in args:
+            corpus.remove(path)
+    else:
+        if opts.prefix is not None:
+            hits = corpus.prefix(opts.prefix)
+        elif opts.glob is not None:
+            hits = corpus.glob(opts.glob)
+        elif opts.term is not None:
+            hits = corpus.term(opts.term)
+        else:
+            prsr.error("Query needs --prefix, --glob or --term")
+        for document, line, path in hits:
+            print "%s:%s\t%s" % (document, line or '', path)
+        print >>sys.stderr, "%i hits (%.6fs)" % (len(hits),
+                time.time() - start)
+    corpus.close()
+
+
+if __name__ == '__main__' and sys.argv[1:2] in (['index'], ['query']):
+    index_main(sys.argv[1:])
+    sys.exit()
+
 reader_name = 'standalone-mpe'
 parser = comp.get_parser_class('rst')()
 writer = comp.get_writer_class('outline')()
@@ -13,4 +66,3 @@ frontend.cli_du_publisher(
         reader_name=reader_name,
         parser=parser,
         writer=writer)
-
@@ -13,10 +13,11 @@ try:
 except:
     pass
 
-from docutils.core import publish_cmdline
+from docutils.core import Publisher, default_description
 
 from dotmpe.du import frontend, comp
 import dotmpe.du.ext # register extensions
+import dotmpe.du.ext.parser
 
 
 script_names = [sys.argv[0]]#os.path.basename(sys.argv[0]).split('-')
@@ -26,13 +27,15 @@ if '2' in script_names[0]:
 
 reader_name='standalone'
 parser_name='rst'
-# XXX: this work because docutils was monkeypatched by dotmpe.du.ext:
 writer_name='rst-mpe'
 
-publish_cmdline(
-        parser_name=parser_name,
-        reader_name=reader_name, 
-        writer_name=writer_name)
-
-
-
+publisher = Publisher(
+        parser=comp.get_parser_class(parser_name)(),
+        writer=comp.get_writer_class(writer_name)())
+publisher.set_components(reader_name, None, None)
+publisher.process_command_line(description=default_description)
+# The patch mode of the writer needs the source ranges of the elements
+if publisher.settings.rst_mode == 'patch':
+    publisher.parser = publisher.reader.parser = \
+            comp.get_parser_class('rst-mpe')()
+publisher.publish()
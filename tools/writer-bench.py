@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Time HTML writers on already parsed documents.
+
+Usage::
+
+    writer-bench.py [--rounds N] [--writers html-mpe,xhtml-flat] FILE...
+
+Each file is parsed once, then written by each writer `rounds` times. Prints
+the total seconds and output size per writer.
+"""
+import optparse
+import sys
+import time
+
+from docutils import core
+from dotmpe.du import comp
+
+
+def main(argv=None):
+    prsr = optparse.OptionParser(usage=__doc__.strip().split('\n\n')[1])
+    prsr.add_option('--rounds', type='int', default=5)
+    prsr.add_option('--writers', default='html-mpe,xhtml-flat')
+    opts, args = prsr.parse_args(argv)
+    overrides = { '_disable_config': True, 'report_level': 5,
+            'halt_level': 5, 'output_encoding': 'utf-8' }
+    doctrees = [ core.publish_doctree(open(path).read(), path,
+            settings_overrides=overrides) for path in args ]
+    for name in opts.writers.split(','):
+        Writer = comp.get_writer_class(name)
+        size, start = 0, time.time()
+        for i in range(opts.rounds):
+            for doctree in doctrees:
+                output = core.publish_from_doctree(doctree, writer=Writer(),
+                        settings_overrides=overrides)
+                size += len(output)
+        print "%-12s %8.3fs %10i bytes" % (name, time.time() - start,
+                size / opts.rounds)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])